@@ -6,13 +6,12 @@ warnings.filterwarnings("ignore", message=r".*declare_namespace\(\'.*google.*",
 # base warning raised when warning above are raised
 warnings.filterwarnings("ignore", message=r".*pkg_resources is deprecated.*", category=DeprecationWarning)
 
-# must import taggers to register them
 # we import the rust extension here and wrap it in a python module
 from . import dolma as _dolma  # type: ignore   # noqa: E402
+from . import taggers  # noqa: E402  # adds built-in taggers to the registry (lazily)
 from .core import TaggerRegistry  # noqa: E402
 from .core.errors import DolmaRustPipelineError  # noqa: E402
 from .core.taggers import BaseTagger  # noqa: E402
-from .taggers import *  # noqa: E402
 
 __all__ = [
     "add_tagger",
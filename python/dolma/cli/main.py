@@ -1,30 +1,40 @@
+import importlib
 import multiprocessing
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
-
-import smart_open
-from yaml import safe_load
-
-from ..core.paths import exists
-from .analyzer import AnalyzerCli
-from .deduper import DeduperCli
-from .mixer import MixerCli
-
-# must import these to register the resolvers
-from .resolvers import *  # noqa: F401,F403,W0401
-from .tagger import ListTaggerCli, TaggerCli
-from .tokenizer import TokenizerCli
-from .warc import WarcExtractorCli
-
-AVAILABLE_COMMANDS = {
-    "dedupe": DeduperCli,
-    "mix": MixerCli,
-    "tag": TaggerCli,
-    "list": ListTaggerCli,
-    "stat": AnalyzerCli,
-    "tokens": TokenizerCli,
-    "warc": WarcExtractorCli,
+from typing import Any, Dict, List, NamedTuple, Optional, Type, Union
+
+from . import BaseCli
+
+
+class LazyCommand(NamedTuple):
+    """A command of the CLI; the module that implements it is only imported when the command is run,
+    so that running one command does not pay the import cost of all the others."""
+
+    entry_point: str  # location of the cli class, as `module:Class`; module is relative to `dolma.cli`
+    help: str  # description of the command shown in `dolma --help`
+
+    def load(self) -> Type[BaseCli]:
+        module_name, _, cls_name = self.entry_point.partition(":")
+        return getattr(importlib.import_module(module_name, package=__package__), cls_name)
+
+
+AVAILABLE_COMMANDS: Dict[str, LazyCommand] = {
+    "dedupe": LazyCommand(".deduper:DeduperCli", "Deduplicate documents or paragraphs using a bloom filter."),
+    "mix": LazyCommand(".mixer:MixerCli", "Mix documents from multiple streams."),
+    "tag": LazyCommand(
+        ".tagger:TaggerCli",
+        "Tag documents or spans of documents using one or more taggers. "
+        "For a list of available taggers, run `dolma list`.",
+    ),
+    "list": LazyCommand(".tagger:ListTaggerCli", "List available taggers."),
+    "stat": LazyCommand(".analyzer:AnalyzerCli", "Analyze the distribution of attributes values in a dataset."),
+    "tokens": LazyCommand(".tokenizer:TokenizerCli", "Tokenize documents using the provided tokenizer."),
+    "tokens-reshard": LazyCommand(
+        ".tokenizer:ReshardCli",
+        "Reshard tokenized documents into files of a different size, without tokenizing them again.",
+    ),
+    "warc": LazyCommand(".warc:WarcExtractorCli", "Extract documents from WARC files and parse HTML out."),
     # following functionality is not yet implemented
     # "train-ft": None,
     # "train-lm": None,
@@ -36,6 +46,11 @@ def read_config(path: Union[None, str]) -> Dict[str, Any]:
     if path is None:
         return {}
 
+    import smart_open
+    from yaml import safe_load
+
+    from ..core.paths import exists
+
     if not exists(path):
         raise FileNotFoundError(f"Config file {path} does not exist")
 
@@ -43,17 +58,9 @@ def read_config(path: Union[None, str]) -> Dict[str, Any]:
         return dict(safe_load(f))
 
 
-def main(argv: Optional[List[str]] = None):
-    """Main entry point for the CLI"""
-
-    try:
-        # attempting to set start method to spawn in case it is not set
-        multiprocessing.set_start_method("spawn")
-    except RuntimeError as ex:
-        # method already set, check if it is set to spawn
-        if multiprocessing.get_start_method() != "spawn":
-            raise RuntimeError("Multiprocessing start method must be set to spawn") from ex
-
+def make_parser(command: Optional[str] = None) -> ArgumentParser:
+    """Make the parser for the CLI. Only the options of `command` are added to the parser, so only the module
+    of that command is imported; parsers of other commands are left empty (and without `--help`)."""
     parser = ArgumentParser(
         prog="dolma",
         usage="dolma {global options} [command] {command options}",
@@ -67,15 +74,32 @@ def main(argv: Optional[List[str]] = None):
         default=None,
     )
 
-    # Continue by adding subparsers and parsing the arguments
+    # Continue by adding subparsers
     subparsers = parser.add_subparsers(dest="command")
     subparsers.required = True
-    subparsers.choices = AVAILABLE_COMMANDS.keys()  # type: ignore
-    for command, cli in AVAILABLE_COMMANDS.items():
-        cli.make_parser(subparsers.add_parser(command, help=cli.DESCRIPTION))
+    for name, lazy_cli in AVAILABLE_COMMANDS.items():
+        if name == command:
+            lazy_cli.load().make_parser(subparsers.add_parser(name, help=lazy_cli.help))
+        else:
+            subparsers.add_parser(name, help=lazy_cli.help, add_help=False)
+
+    return parser
 
-    # parse the arguments
-    args = parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point for the CLI"""
+
+    try:
+        # attempting to set start method to spawn in case it is not set
+        multiprocessing.set_start_method("spawn")
+    except RuntimeError as ex:
+        # method already set, check if it is set to spawn
+        if multiprocessing.get_start_method() != "spawn":
+            raise RuntimeError("Multiprocessing start method must be set to spawn") from ex
+
+    # find out which command to run first; then, parse the arguments with a parser that has its options.
+    known_args, _ = make_parser().parse_known_args(argv)
+    args = make_parser(command=known_args.command).parse_args(argv)
 
     # first, get the command and config path to run
     command = args.__dict__.pop("command")
@@ -85,9 +109,12 @@ def main(argv: Optional[List[str]] = None):
     args.__dict__.pop("dolma_version", None)
     args.__dict__.pop("dolma_commands", None)
 
+    # must import these to register the resolvers
+    from . import resolvers  # noqa: F401
+
     # read the config file if one was provided
     config = read_config(config_path)
 
     # get the cli for the command and run it with the config we just loaded + the args
-    cli = AVAILABLE_COMMANDS[command]
+    cli = AVAILABLE_COMMANDS[command].load()
     return cli.run_from_args(args=args, config=config)
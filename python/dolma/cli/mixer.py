@@ -3,7 +3,12 @@ from typing import Any, Dict, List, Optional
 
 from dolma import mixer
 from dolma.cli import BaseCli, field, print_config
-from dolma.cli.shared import CompressionConfig, WorkDirConfig, make_workdirs
+from dolma.cli.shared import (
+    CompressionConfig,
+    FilterConfig,
+    WorkDirConfig,
+    make_workdirs,
+)
 from dolma.core.errors import DolmaConfigError
 from dolma.core.loggers import get_logger
 from dolma.core.paths import glob_path
@@ -19,16 +24,6 @@ class StreamOutputConfig:
     min_text_length: Optional[int] = field(default=0, help="Minimum length of the text in the output documents.")
 
 
-@dataclass
-class FilterConfig:
-    include: List[str] = field(default=[], help="JSONPath expressions to include documents")
-    exclude: List[str] = field(default=[], help="JSONPath expressions to exclude documents")
-    syntax: str = field(
-        default="jsonpath",
-        help="Syntax to use for filter expressions. Can be either JSONPath or jq. Defaults to JSONPath.",
-    )
-
-
 @dataclass
 class SpanReplacementConfig:
     span: str = field(help="JSONPath expression for the span to replace")
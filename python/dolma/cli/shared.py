@@ -4,7 +4,7 @@ import tempfile
 from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Generator, List, Optional
 
 from dolma.cli import field
 
@@ -21,6 +21,16 @@ class CompressionConfig:
     output: Optional[str] = field(default=None, help="Compression algorithm to use for output files")
 
 
+@dataclass
+class FilterConfig:
+    include: List[str] = field(default=[], help="JSONPath expressions to include documents")
+    exclude: List[str] = field(default=[], help="JSONPath expressions to exclude documents")
+    syntax: str = field(
+        default="jsonpath",
+        help="Syntax to use for filter expressions. Can be either JSONPath or jq. Defaults to JSONPath.",
+    )
+
+
 @contextmanager
 def get_path_to_temp_file(prefix="dolma-", suffix=None) -> Generator[Path, None, None]:
     with tempfile.NamedTemporaryFile(prefix=prefix, suffix=suffix, delete=True) as f:
@@ -1,17 +1,23 @@
+import sys
+from collections import deque
 from dataclasses import dataclass
 from pstats import SortKey
-from typing import List, Optional
+from typing import Deque, Generator, List, Optional
 
+import msgspec
 from rich.console import Console
 from rich.table import Table
 
 from dolma.cli import BaseCli, field, print_config
-from dolma.cli.shared import WorkDirConfig, make_workdirs
+from dolma.cli.shared import FilterConfig, WorkDirConfig, make_workdirs
+from dolma.core.caps import TaggerCap
+from dolma.core.cascade import CascadeStage, FilterSpec
+from dolma.core.data_types import InputSpecWithMetadata, OutputSpec
 from dolma.core.errors import DolmaConfigError
 from dolma.core.loggers import get_logger
 from dolma.core.paths import glob_path
 from dolma.core.registry import TaggerRegistry
-from dolma.core.runtime import create_and_run_tagger
+from dolma.core.runtime import create_and_run_tagger, tag_stream
 from dolma.core.utils import import_modules
 
 
@@ -40,6 +46,68 @@ class ProfilerConfig:
     )
 
 
+@dataclass
+class CascadeConfig:
+    taggers: List[str] = field(
+        default=[],
+        help="Taggers to run only on documents that pass `filter`.",
+    )
+    filter: FilterConfig = field(
+        default=FilterConfig(),
+        help=(
+            "Filter on the attributes computed by the taggers that run before this stage; same syntax as the "
+            "filter of mixer streams. Documents that do not pass the filter skip this and all later stages."
+        ),
+    )
+
+
+@dataclass
+class CapConfig:
+    taggers: List[str] = field(
+        default=[],
+        help="Taggers to apply the cap to.",
+    )
+    max_chars: Optional[int] = field(
+        default=None,
+        help="Maximum number of characters of documents the taggers process in full.",
+    )
+    max_paragraphs: Optional[int] = field(
+        default=None,
+        help="Maximum number of paragraphs (lines) of documents the taggers process in full.",
+    )
+    policy: str = field(
+        default="truncate",
+        choices=["truncate", "sample", "defer"],
+        help=(
+            "What to do with documents over the cap: `truncate` tags their start, `sample` tags `num_windows` "
+            "windows spread across them, and `defer` tags them in full after all other documents."
+        ),
+    )
+    num_windows: int = field(
+        default=4,
+        help="Number of windows to tag with the `sample` policy.",
+    )
+
+
+@dataclass
+class FilteredOutputConfig:
+    destination: Optional[str] = field(
+        default=None,
+        help=(
+            "If set, documents are filtered right after tagging, and documents that pass `filter` are written to "
+            "`documents/` under this prefix instead of writing attributes files to `destination`."
+        ),
+    )
+    filter: FilterConfig = field(
+        default=FilterConfig(),
+        help="Filter on documents and their attributes; same syntax as the filter of mixer streams.",
+    )
+    attributes: bool = field(
+        default=False,
+        help="Whether to also write attributes of documents that pass the filter to `attributes/<experiment>/`.",
+    )
+
+
 @dataclass
 class TaggerConfig:
     documents: List[str] = field(
@@ -74,6 +142,54 @@ class TaggerConfig:
         default=1,
         help="Number of parallel processes to use.",
     )
+    batch_size: int = field(
+        default=1,
+        help=(
+            "Number of documents to pass to each tagger at once. Taggers that support batching (e.g., "
+            "tokenizer-based taggers) are faster with larger batches; other taggers are not affected."
+        ),
+    )
+    cascade: List[CascadeConfig] = field(
+        default=[],
+        help=(
+            "Stages of taggers that only run on documents that pass a filter on attributes computed in the same "
+            "pass; skipped taggers output a `cascade_skipped` attribute instead. Use to run expensive taggers "
+            "only on documents that are not discarded because of the output of cheap ones."
+        ),
+    )
+    caps: List[CapConfig] = field(
+        default=[],
+        help=(
+            "Limits on the size of documents taggers process; documents over a cap are truncated, sampled, or "
+            "deferred, and get a `capped` attribute with the fraction of their text that was tagged."
+        ),
+    )
+    deferred_processes: int = field(
+        default=1,
+        help="Number of parallel processes to use to tag documents deferred by caps.",
+    )
+    sample_rate: Optional[float] = field(
+        default=None,
+        help=(
+            "If set, only tag this fraction of documents, selected by a hash of their id; attributes are only "
+            "written for sampled documents. `dolma stat` extrapolates statistics of sampled attributes."
+        ),
+    )
+    filtered_output: FilteredOutputConfig = field(
+        default=FilteredOutputConfig(),
+        help="Filter documents right after tagging and write the ones that pass, instead of attributes files.",
+    )
+    stdin: bool = field(
+        default=False,
+        help="Read documents as JSON lines from standard input instead of `documents`; requires `--stdout`.",
+    )
+    stdout: bool = field(
+        default=False,
+        help=(
+            "Write attributes as JSON lines to standard output instead of attributes files, in the same order as "
+            "the documents; requires `--stdin`."
+        ),
+    )
     ignore_existing: bool = field(
         default=False,
         help="Whether to ignore existing outputs and re-run the taggers.",
@@ -104,9 +220,24 @@ class TaggerCli(BaseCli):
     def run(cls, parsed_config: TaggerConfig):
         logger = get_logger("tagger")
 
+        if parsed_config.stdin or parsed_config.stdout:
+            if not (parsed_config.stdin and parsed_config.stdout):
+                raise DolmaConfigError("`--stdin` and `--stdout` must be used together.")
+            return cls.run_stream(parsed_config)
+
         with make_workdirs(parsed_config.work_dir) as work_dirs:
             documents = [str(p) for p in parsed_config.documents]
             taggers = [str(p) for p in parsed_config.taggers]
+            cascade = cls._make_cascade(parsed_config)
+            caps = cls._make_caps(parsed_config)
+
+            output_filter: Optional[FilterSpec] = None
+            if parsed_config.filtered_output.destination is not None:
+                output_filter = FilterSpec(
+                    include=[str(i) for i in parsed_config.filtered_output.filter.include],
+                    exclude=[str(e) for e in parsed_config.filtered_output.filter.exclude],
+                    syntax=str(parsed_config.filtered_output.filter.syntax),
+                )
 
             # perform some path validation to make sure we don't call the mixer with invalid config
             total_matching_documents = 0
@@ -134,6 +265,14 @@ class TaggerCli(BaseCli):
                 taggers_modules=parsed_config.tagger_modules,
                 ignore_existing=parsed_config.ignore_existing,
                 num_processes=parsed_config.processes,
+                batch_size=parsed_config.batch_size,
+                cascade=cascade,
+                caps=caps,
+                deferred_processes=parsed_config.deferred_processes,
+                sample_rate=parsed_config.sample_rate,
+                output_filter=output_filter,
+                filtered_destination=parsed_config.filtered_output.destination,
+                filtered_attributes=parsed_config.filtered_output.attributes,
                 experiment=parsed_config.experiment,
                 debug=parsed_config.debug,
                 profile_enable=parsed_config.profile.enable,
@@ -142,6 +281,68 @@ class TaggerCli(BaseCli):
                 profile_sort_key=parsed_config.profile.sort_key,
             )
 
+    @classmethod
+    def _make_cascade(cls, parsed_config: TaggerConfig) -> List[CascadeStage]:
+        return [
+            CascadeStage(
+                taggers=[str(t) for t in stage.taggers],
+                include=[str(i) for i in stage.filter.include],
+                exclude=[str(e) for e in stage.filter.exclude],
+                syntax=str(stage.filter.syntax),
+            )
+            for stage in parsed_config.cascade
+        ]
+
+    @classmethod
+    def _make_caps(cls, parsed_config: TaggerConfig) -> List[TaggerCap]:
+        return [
+            TaggerCap(
+                taggers=[str(t) for t in cap.taggers],
+                max_chars=cap.max_chars,
+                max_paragraphs=cap.max_paragraphs,
+                policy=str(cap.policy),
+                num_windows=cap.num_windows,
+            )
+            for cap in parsed_config.caps
+        ]
+
+    @classmethod
+    def run_stream(cls, parsed_config: TaggerConfig):
+        """Tag documents from standard input, and write their attributes to standard output."""
+
+        # standard output is for attributes only, so the config goes to standard error
+        print_config(parsed_config, console=Console(stderr=True))
+        if parsed_config.dryrun:
+            get_logger("tagger").info("Exiting due to dryrun.")
+            return
+
+        # attributes are yielded in the same order as documents, so we can match each with its source
+        sources: Deque[str] = deque()
+        decoder = msgspec.json.Decoder(InputSpecWithMetadata)
+        encoder = msgspec.json.Encoder()
+
+        def _read_documents() -> Generator[InputSpecWithMetadata, None, None]:
+            for line in sys.stdin:
+                if line.strip():
+                    doc = decoder.decode(line)
+                    sources.append(doc.source)
+                    yield doc
+
+        results = tag_stream(
+            documents=_read_documents(),
+            taggers=[str(t) for t in parsed_config.taggers],
+            taggers_modules=parsed_config.tagger_modules,
+            experiment=parsed_config.experiment,
+            num_workers=parsed_config.processes,
+            batch_size=parsed_config.batch_size,
+            cascade=cls._make_cascade(parsed_config),
+            caps=cls._make_caps(parsed_config),
+        )
+        for doc_id, attributes in results:
+            output = OutputSpec(id=doc_id, attributes=attributes, source=sources.popleft())
+            sys.stdout.write(encoder.encode(output).decode("utf-8") + "\n")
+        sys.stdout.flush()
+
 
 @dataclass
 class ListTaggerConfig:
@@ -164,8 +365,9 @@ class ListTaggerCli(BaseCli):
         table.add_column("name", justify="left", style="cyan")
         table.add_column("class", justify="left", style="magenta")
 
-        for tagger_name, tagger_cls in sorted(TaggerRegistry.items()):
-            tagger_repr = f"{tagger_cls.__module__}.{tagger_cls.__name__}"
+        # we list entry points rather than classes, so that tagger modules don't have to be imported
+        for tagger_name in TaggerRegistry.names():
+            tagger_repr = TaggerRegistry.entry_point(tagger_name).replace(":", ".")
             table.add_row(tagger_name, tagger_repr)
 
         console = Console()
@@ -7,6 +7,8 @@ from dolma.core.errors import DolmaConfigError
 from dolma.core.loggers import get_logger
 from dolma.core.paths import glob_path
 from dolma.tokenizer import tokenize_in_parallel
+from dolma.tokenizer.memmap_reader import find_memmap_paths
+from dolma.tokenizer.shuffle import reshard_memmaps
 
 
 @dataclass
@@ -130,11 +132,75 @@ class TokenizationConfig:
         default=10_000,
         help="Number of sequences to tokenize before writing to disk.",
     )
+    encode_batch_size: int = field(
+        default=64,
+        help="Number of documents of a file to encode at once; the fast tokenizer encodes batches in parallel.",
+    )
+    tokenizer_threads: Optional[int] = field(
+        default=None,
+        help=(
+            "Number of threads each process uses to encode a batch. If not provided, available cores are split "
+            "evenly across processes, so that threads and processes don't oversubscribe them."
+        ),
+    )
+    recycle_after_documents: Optional[int] = field(
+        default=None,
+        help=(
+            "If provided, a process that has read this many documents hands off its unfinished files to a new "
+            "process, which continues where it stopped. Bounds memory leaks in the tokenizers library without "
+            "the stalls of `tokenizer.refresh`."
+        ),
+    )
+    recycle_above_rss: Optional[int] = field(
+        default=None,
+        help="If provided, a process whose peak memory exceeds this many bytes hands off its files to a new one.",
+    )
     ring_size: int = field(default=8, help="Number of files to open in parallel for tokenization.")
     sample_ring_prop: bool = field(
         default=False,
         help="Whether to sample the ring proportionally to the number of documents in each source.",
     )
+    global_shuffle: bool = field(
+        default=False,
+        help=(
+            "Whether to shuffle documents across all files, rather than within `batch_size` documents. Documents "
+            "are first tokenized to `work_dir.input`, which needs room for all tokens, then permuted and gathered "
+            "into the destination."
+        ),
+    )
+    sequence_length: Optional[int] = field(
+        default=None,
+        help=(
+            "If provided, pack documents into sequences of this many tokens, and write an index of the documents "
+            "in each sequence next to each memmap. By default, documents are written back to back."
+        ),
+    )
+    packing_policy: str = field(
+        default="best_fit",
+        help=(
+            "How to pack documents into sequences: 'best_fit' only splits documents longer than a sequence and "
+            "pads the rest; 'concat' splits documents at sequence boundaries, with no padding."
+        ),
+    )
+    dedupe: Optional[str] = field(
+        default=None,
+        help=(
+            "If provided, detect documents with the same tokens as a document tokenized before, using a bloom "
+            "filter in `work_dir.input` shared by all processes: 'drop' skips them, 'count' only counts them."
+        ),
+    )
+    dedupe_bloom_size: int = field(
+        default=1024 * 1024 * 1024,
+        help="Size of the bloom filter for `dedupe` in bytes; about 10 bits per document give ~1% false positives.",
+    )
+    cache_dir: Optional[str] = field(
+        default=None,
+        help=(
+            "If provided, tokenize each source file into its own file in this local directory, keyed by the "
+            "fingerprint of the source file and the tokenizer configuration; files in the cache are not tokenized "
+            "again, and the destination is assembled from the cached files of all sources."
+        ),
+    )
     max_size: int = field(
         default=1024 * 1024 * 1024,
         help="Maximum size of a file in bytes.",
@@ -221,4 +287,109 @@ class TokenizerCli(BaseCli):
                 sample_ring_prop=parsed_config.sample_ring_prop,
                 use_fast_tokenizer=parsed_config.tokenizer.fast,
                 refresh_tokenizer=parsed_config.tokenizer.refresh,
+                encode_batch_size=parsed_config.encode_batch_size,
+                tokenizer_threads=parsed_config.tokenizer_threads,
+                global_shuffle=parsed_config.global_shuffle,
+                shuffle_dir=work_dirs.input,
+                sequence_length=parsed_config.sequence_length,
+                packing_policy=parsed_config.packing_policy,
+                dedupe=parsed_config.dedupe,
+                dedupe_dir=work_dirs.input,
+                dedupe_bloom_size=parsed_config.dedupe_bloom_size,
+                cache_dir=parsed_config.cache_dir,
+                recycle_after_documents=parsed_config.recycle_after_documents,
+                recycle_above_rss=parsed_config.recycle_above_rss,
+            )
+
+
+@dataclass
+class ReshardConfig:
+    sources: List[str] = field(
+        default=[],
+        help=(
+            "One or more directories with the output of `dolma tokens`, or globs of .npy files; each must have a "
+            ".csv.gz metadata file next to it. Files must be local. Required."
+        ),
+    )
+    destination: Optional[str] = field(default=None, help="Directory where to write the new files. Required.")
+    max_size: int = field(
+        default=1024 * 1024 * 1024,
+        help="Maximum number of tokens in each new file.",
+    )
+    dtype: str = field(
+        default="uint16",
+        help="Data type of the memmap files; must be a valid numpy dtype, and the same for all sources.",
+    )
+    shuffle: bool = field(
+        default=False,
+        help="Whether to shuffle documents across all sources. Otherwise, documents keep their order.",
+    )
+    sequence_length: Optional[int] = field(
+        default=None,
+        help="If provided, pack documents into sequences of this many tokens; see `dolma tokens`.",
+    )
+    packing_policy: str = field(
+        default="best_fit",
+        help="How to pack documents into sequences, either 'best_fit' or 'concat'; see `dolma tokens`.",
+    )
+    pad_token_id: Optional[int] = field(
+        default=None,
+        help="The token ID used to pad sequences; required if `sequence_length` is provided.",
+    )
+    processes: int = field(
+        default=1,
+        help="Number of parallel processes to use; each writes different files.",
+    )
+    seed: int = field(
+        default=3920,
+        help="Seed for random number generation.",
+    )
+    debug: bool = field(
+        default=False,
+        help="Whether to run in debug mode.",
+    )
+    work_dir: WorkDirConfig = field(default=WorkDirConfig(), help="Configuration for temporary work directories.")
+    dryrun: bool = field(
+        default=False,
+        help="If true, only print the configuration and exit without resharding.",
+    )
+
+
+class ReshardCli(BaseCli):
+    CONFIG = ReshardConfig
+    DESCRIPTION = "Reshard tokenized documents into files of a different size, without tokenizing them again."
+
+    @classmethod
+    def run(cls, parsed_config: ReshardConfig):
+        logger = get_logger("reshard")
+
+        with make_workdirs(parsed_config.work_dir) as work_dirs:
+            memmap_paths = find_memmap_paths([str(p) for p in parsed_config.sources])
+            if not memmap_paths:
+                raise DolmaConfigError(f"No tokenized files found for paths {parsed_config.sources}.")
+
+            print_config(parsed_config)
+            if parsed_config.dryrun:
+                logger.info("Exiting due to dryrun.")
+                return
+
+            if parsed_config.destination is None:
+                raise DolmaConfigError("Destination must be provided.")
+            if parsed_config.sequence_length is not None and parsed_config.pad_token_id is None:
+                raise DolmaConfigError("pad_token_id must be provided to pack documents into sequences.")
+
+            reshard_memmaps(
+                memmap_paths=memmap_paths,
+                destination=parsed_config.destination,
+                scratch_dir=str(work_dirs.input),
+                metadata_dir=str(work_dirs.output),
+                max_tokens=parsed_config.max_size,
+                dtype=parsed_config.dtype,
+                shuffle=parsed_config.shuffle,
+                num_processes=parsed_config.processes,
+                seed=parsed_config.seed,
+                debug=parsed_config.debug,
+                sequence_length=parsed_config.sequence_length,
+                pad_token_id=parsed_config.pad_token_id,
+                packing_policy=parsed_config.packing_policy,
             )
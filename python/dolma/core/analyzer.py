@@ -22,6 +22,7 @@ from .data_types import OutputSpec
 from .errors import DolmaError
 from .parallel import BaseParallelProcessor, QueueType
 from .paths import glob_path, mkdir_p
+from .sampling import SAMPLE_SUFFIX, read_sample_spec
 
 NUM_BINS = 100_000
 BUFF_SIZE = 1_000
@@ -62,6 +63,16 @@ class SummarySpec(msgspec.Struct):
     def to_summary_tuple(self) -> SummaryTuple:
         return SummaryTuple(counts=self.counts, bins=self.bins, total=self.total, sum=self.sum)
 
+    def scale(self, weight: float) -> "SummarySpec":
+        """Scale counts, total, and sum by `weight`; used to extrapolate summaries of a sample of documents."""
+        return SummarySpec(
+            name=self.name,
+            counts=[round(count * weight) for count in self.counts],
+            bins=self.bins,
+            total=round(self.total * weight),
+            sum=self.sum * weight,
+        )
+
 
 class AnalyzerProcessor(BaseParallelProcessor):
     @classmethod
@@ -86,6 +97,14 @@ class AnalyzerProcessor(BaseParallelProcessor):
         queue: QueueType,
         **kwargs,
     ):
+        if source_path.endswith(SAMPLE_SUFFIX):
+            # this is the sidecar of an attributes file written for a sample, not an attributes file
+            cls.increment_progressbar(queue, files=1)
+            return
+
+        # if attributes were only computed for a sample of documents, we extrapolate counts to all documents
+        sample_spec = read_sample_spec(source_path)
+
         # instantiate a decoder for faster decoding
         decoder = Decoder(OutputSpec)
 
@@ -151,6 +170,8 @@ class AnalyzerProcessor(BaseParallelProcessor):
         with smart_open.open(destination_path, "w") as f:
             for attr_name, tracker in trackers.items():
                 summary = SummarySpec.from_tracker(name=attr_name, tracker=tracker, n=num_bins)
+                if sample_spec is not None:
+                    summary = summary.scale(sample_spec.weight)
                 f.write(msgspec.json.encode(summary).decode("utf-8") + "\n")
 
         # update the progress bar one last time
@@ -0,0 +1,115 @@
+"""
+
+Compact, memory-mapped index for URL and domain blocklists.
+
+Blocklists are parsed once, hashed to 64-bit integers, sorted, deduplicated, and saved as a `.npy` file in
+the dolma cache directory. Workers then open the file with `mmap_mode="r"`, so all processes on a machine
+share the same pages instead of each holding its own `set[str]`.
+"""
+
+import os
+import tempfile
+from hashlib import blake2b, sha256
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from .loggers import get_logger
+from .paths import exists, get_cache_dir, is_local, join_path, mkdir_p
+
+LOGGER = get_logger(__name__)
+
+# bump this if the on-disk format or the hashing function changes
+BLOCKLIST_INDEX_VERSION = 1
+
+# name of the directory (inside the dolma cache directory) where indices are stored
+BLOCKLIST_INDEX_DIR = "blocklists"
+
+
+def hash_entry(entry: str) -> int:
+    """Hash a blocklist entry to an unsigned 64-bit integer; stable across processes and runs."""
+    return int.from_bytes(blake2b(entry.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def make_index_key(name: str, paths: Iterable[str]) -> str:
+    """Derive a cache key for an index from the name of the parser and the paths of the source blocklists.
+
+    For local files, the size and modification time are included in the key, so that the index is rebuilt
+    if the file changes. Remote files are assumed to be immutable (they are versioned by date).
+    """
+    parts: List[str] = [f"v{BLOCKLIST_INDEX_VERSION}", name]
+    for path in paths:
+        parts.append(str(path))
+        if is_local(str(path)) and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class BlocklistIndex:
+    """A sorted array of 64-bit hashes of blocklist entries. Supports `in` and `len()` like a set of strings.
+
+    Lookups cost one hash and one binary search; the array is memory-mapped, so pages are shared between
+    all workers that open the same index. With 64-bit hashes, the probability of a false positive is
+    about `len(index) / 2**64` per lookup.
+    """
+
+    def __init__(self, hashes: npt.NDArray[np.uint64]) -> None:
+        self.hashes = hashes
+
+    def __len__(self) -> int:
+        return int(self.hashes.shape[0])
+
+    def __contains__(self, entry: object) -> bool:
+        if not isinstance(entry, str) or len(self) == 0:
+            return False
+        value = np.uint64(hash_entry(entry))
+        position = int(np.searchsorted(self.hashes, value))
+        return position < len(self) and bool(self.hashes[position] == value)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[str]) -> "BlocklistIndex":
+        """Build an in-memory index from an iterable of (possibly duplicated) entries."""
+        hashes = np.fromiter((hash_entry(e) for e in entries), dtype=np.uint64)
+        return cls(np.unique(hashes))
+
+    def save(self, path: str) -> None:
+        """Atomically write the index to `path`; safe if multiple workers build the same index at once."""
+        dirname = os.path.dirname(path)
+        mkdir_p(dirname)
+        with tempfile.NamedTemporaryFile(dir=dirname, suffix=".npy", delete=False) as f:
+            np.save(f, self.hashes)
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BlocklistIndex":
+        """Open a previously saved index without copying it into memory."""
+        return cls(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def get_or_build(
+        cls,
+        key: str,
+        entries_fn: Callable[[], Iterable[str]],
+        cache_dir: Optional[str] = None,
+    ) -> "BlocklistIndex":
+        """Load the index for `key` from the cache, or build it by calling `entries_fn` and save it.
+
+        Args:
+            key (str): Cache key for the index; see `make_index_key`.
+            entries_fn (Callable[[], Iterable[str]]): Function returning the entries of the blocklist. Only
+                called if the index is not in the cache.
+            cache_dir (str, optional): Directory where indices are stored. Defaults to a `blocklists`
+                directory inside the dolma cache directory.
+        """
+        cache_dir = cache_dir or join_path("", get_cache_dir(), BLOCKLIST_INDEX_DIR)
+        path = join_path("", cache_dir, f"{key}.npy")
+
+        if exists(path):
+            LOGGER.info(f"Using cached blocklist index {path}")
+            return cls.load(path)
+
+        LOGGER.info(f"Building blocklist index {path}")
+        cls.from_entries(entries_fn()).save(path)
+        return cls.load(path)
@@ -0,0 +1,114 @@
+"""
+Caps on the size of the documents a tagger processes. A handful of huge documents can take longer to tag than the
+rest of a shard put together; when a document has more than `max_chars` characters or `max_paragraphs` paragraphs,
+a capped tagger either scores a prefix of it (`truncate`), scores a few windows spread across it (`sample`), or
+skips it during the main pass and scores it in full in a separate, low-concurrency pass afterwards (`defer`).
+Capped taggers add a `capped` attribute to the documents over the caps, spanning the whole document; its score is
+the fraction of characters the tagger saw.
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .errors import DolmaConfigError
+
+__all__ = ["CAPPED_ATTRIBUTE", "TaggerCap", "validate_caps"]
+
+
+CAPPED_ATTRIBUTE = "capped"
+
+CAP_POLICIES = ("truncate", "sample", "defer")
+
+
+def _count_paragraphs(text: str) -> int:
+    """Number of paragraphs in `text`, as returned by `split_paragraphs(text, remove_empty=False)`."""
+    return text.count("\n") + int(bool(text) and not text.endswith("\n"))
+
+
+def _paragraph_bounds(text: str) -> List[int]:
+    """Offsets at which paragraphs of `text` start, followed by the length of the text."""
+    bounds = [0] + [match.end() for match in re.finditer("\n", text)]
+    if bounds[-1] < len(text):
+        bounds.append(len(text))
+    return bounds
+
+
+def _spread(length: int, size: int, num: int) -> List[int]:
+    """Start of `num` windows of `size` units spread evenly over `length` units, from the first to the last."""
+    if num <= 1:
+        return [0]
+    return [round(i * (length - size) / (num - 1)) for i in range(num)]
+
+
+class TaggerCap(NamedTuple):
+    """Limits on the size of documents `taggers` process, and what to do with documents over them."""
+
+    taggers: List[str]
+    max_chars: Optional[int] = None
+    max_paragraphs: Optional[int] = None
+    policy: str = "truncate"
+    num_windows: int = 4
+
+    def exceeds(self, text: str) -> bool:
+        """Whether `text` is over any of the caps."""
+        return (self.max_chars is not None and len(text) > self.max_chars) or (
+            self.max_paragraphs is not None and _count_paragraphs(text) > self.max_paragraphs
+        )
+
+    def windows(self, text: str) -> Optional[List[Tuple[int, int]]]:
+        """Character ranges of `text` to score under the `truncate` or `sample` policies, or None if `text` is
+        within the caps and should be scored in full."""
+        if not self.exceeds(text):
+            return None
+
+        num_windows = 1 if self.policy == "truncate" else self.num_windows
+        windows = [(0, len(text))]
+
+        if self.max_paragraphs is not None and _count_paragraphs(text) > self.max_paragraphs:
+            bounds = _paragraph_bounds(text)
+            num_windows = min(num_windows, self.max_paragraphs)
+            size = self.max_paragraphs // num_windows
+            windows = [(bounds[i], bounds[i + size]) for i in _spread(len(bounds) - 1, size, num_windows)]
+
+        if self.max_chars is not None and sum(end - start for start, end in windows) > self.max_chars:
+            if len(windows) == 1:
+                # only the characters cap was exceeded, or we are truncating: spread windows over the text
+                (start, end), num_windows = windows[0], min(num_windows, self.max_chars)
+                size = self.max_chars // num_windows
+                windows = [(start + i, start + i + size) for i in _spread(end - start, size, num_windows)]
+            else:
+                # windows of paragraphs are too long; we keep the start of each.
+                size = self.max_chars // len(windows)
+                windows = [(start, min(end, start + size)) for start, end in windows]
+
+        return windows
+
+
+def validate_caps(taggers: List[str], cascade_taggers: List[List[str]], caps: List[TaggerCap]) -> None:
+    """Check that caps are valid, that each applies to a tagger that runs, and that no tagger is capped twice.
+    Deferred taggers cannot feed the filters of a cascade, since their attributes are not available until after
+    the main pass: they must be in the last stage of the cascade if there is one."""
+    all_taggers = set(taggers).union(*cascade_taggers)
+    deferrable = set(cascade_taggers[-1] if cascade_taggers else taggers)
+
+    seen: Dict[str, int] = {}
+    for i, cap in enumerate(caps):
+        if cap.policy not in CAP_POLICIES:
+            raise DolmaConfigError(f"Invalid policy {cap.policy} for cap {i}; must be one of {CAP_POLICIES}")
+        if cap.max_chars is None and cap.max_paragraphs is None:
+            raise DolmaConfigError(f"Either `max_chars` or `max_paragraphs` must be specified for cap {i}")
+        if any(limit is not None and limit < 1 for limit in (cap.max_chars, cap.max_paragraphs)):
+            raise DolmaConfigError(f"`max_chars` and `max_paragraphs` of cap {i} must be positive")
+        if cap.num_windows < 1:
+            raise DolmaConfigError(f"`num_windows` of cap {i} must be positive")
+
+        for tagger in cap.taggers:
+            if tagger not in all_taggers:
+                raise DolmaConfigError(f"Tagger {tagger} in cap {i} is not one of the taggers to run")
+            if tagger in seen:
+                raise DolmaConfigError(f"Tagger {tagger} in cap {i} is already capped by cap {seen[tagger]}")
+            if cap.policy == "defer" and tagger not in deferrable:
+                raise DolmaConfigError(
+                    f"Tagger {tagger} in cap {i} cannot be deferred: filters of the cascade depend on its output"
+                )
+            seen[tagger] = i
@@ -0,0 +1,68 @@
+"""
+Cascades of taggers. Taggers in a stage of a cascade only run on documents that pass the filter of that stage
+(and of all stages before it); filters are evaluated on the attributes computed so far in the same pass, using
+the same syntax as the `filter` of mixer streams. This way, expensive taggers can skip documents that the mixer
+would discard anyway because of the output of cheaper taggers. The same filters are used to write documents that
+pass them right after tagging (see `create_and_run_tagger`).
+"""
+
+from typing import Dict, List, NamedTuple
+
+from .. import dolma as _dolma  # type: ignore
+from .errors import DolmaConfigError
+
+__all__ = ["CASCADE_SKIPPED_ATTRIBUTE", "CascadeStage", "FilterSpec", "validate_cascade"]
+
+
+# taggers that are skipped by a cascade output this attribute (spanning the whole document, with score 1)
+# instead of their attributes, so that skipped documents can be told apart from documents with no spans.
+CASCADE_SKIPPED_ATTRIBUTE = "cascade_skipped"
+
+FILTER_SYNTAXES = ("jsonpath", "jq")
+
+
+class FilterSpec(NamedTuple):
+    """A filter on documents and their attributes: documents pass if they match any of the `include`
+    expressions (or if there are none) and none of the `exclude` expressions."""
+
+    include: List[str]
+    exclude: List[str]
+    syntax: str = "jsonpath"
+
+    def make_filter(self) -> "_dolma.DocFilter":
+        if self.syntax not in FILTER_SYNTAXES:
+            raise DolmaConfigError(f"Invalid filter syntax {self.syntax}; must be 'jsonpath' or 'jq'")
+        try:
+            return _dolma.DocFilter(include=list(self.include), exclude=list(self.exclude), syntax=self.syntax)
+        except ValueError as exp:
+            raise DolmaConfigError(f"Invalid filter: {exp}") from exp
+
+
+class CascadeStage(NamedTuple):
+    """A stage of a cascade: `taggers` only run on documents that match any of the `include` expressions
+    (or all documents if there are none) and none of the `exclude` expressions."""
+
+    taggers: List[str]
+    include: List[str]
+    exclude: List[str]
+    syntax: str = "jsonpath"
+
+    def make_filter(self) -> "_dolma.DocFilter":
+        return FilterSpec(include=self.include, exclude=self.exclude, syntax=self.syntax).make_filter()
+
+
+def validate_cascade(taggers: List[str], cascade: List[CascadeStage]) -> None:
+    """Check that every stage of a cascade has taggers and a valid filter, and that no tagger runs twice."""
+    seen: Dict[str, str] = {tagger: "taggers" for tagger in taggers}
+    for i, stage in enumerate(cascade):
+        if not stage.taggers:
+            raise DolmaConfigError(f"Stage {i} of the cascade has no taggers")
+        if not stage.include and not stage.exclude:
+            raise DolmaConfigError(f"Either `include` or `exclude` must be specified for stage {i} of the cascade")
+
+        for tagger in stage.taggers:
+            if tagger in seen:
+                raise DolmaConfigError(f"Tagger {tagger} in stage {i} of the cascade is already in {seen[tagger]}")
+            seen[tagger] = f"stage {i} of the cascade"
+
+        stage.make_filter()
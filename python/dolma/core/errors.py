@@ -14,6 +14,15 @@ class DolmaRetryableFailure(DolmaError):
     """Retry if a shard throws this error"""
 
 
+class DolmaHandoff(DolmaError):
+    """Stop processing a shard in this process and continue in a new one; `kwargs` are passed to the call to
+    `process_single` that continues"""
+
+    def __init__(self, kwargs: dict):
+        super().__init__(kwargs)
+        self.kwargs = kwargs
+
+
 class DolmaRustPipelineError(DolmaError):
     """Error raised by the rust pipeline"""
 
@@ -8,7 +8,7 @@ Base implementation for a fasttext tagger; all fasttext taggers should inherit f
 
 import os
 from tempfile import NamedTemporaryFile
-from typing import Iterable, Literal, NamedTuple, Optional
+from typing import Iterable, List, Literal, NamedTuple, Optional
 
 import smart_open
 from cached_path import cached_path
@@ -135,22 +135,45 @@ class BaseFastTextTagger(BaseTagger):
         model_performance = classifier.test(local_test_file)
         print(model_performance)
 
-    def predict(self, doc: Document) -> DocResult:
+    def get_units(self, doc: Document) -> List[TextSlice]:
+        """Split a document into the units (sentences, paragraphs, or whole document) the model classifies."""
         if self.mode == self.SENTENCE_LEVEL_TAGGER:
-            units = split_sentences(doc.text)
+            return split_sentences(doc.text)
         elif self.mode == self.PARAGRAPH_LEVEL_TAGGER:
-            units = split_paragraphs(doc.text)
+            return split_paragraphs(doc.text)
         elif self.mode == self.DOCUMENT_LEVEL_TAGGER:
-            units = [TextSlice(doc=doc.text, start=0, end=len(doc.text))]
+            return [TextSlice(doc=doc.text, start=0, end=len(doc.text))]
         else:
             raise ValueError(f"Unknown mode {self.mode}")
 
-        spans = []
-        for unit in units:
-            for prediction in self.predict_slice(unit):
-                spans.append(Span(start=unit.start, end=unit.end, type=prediction.label, score=prediction.score))
-
-        return DocResult(doc=doc, spans=spans)
+    def predict(self, doc: Document) -> DocResult:
+        return self._predict_docs([doc])[0]
+
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        if type(self).predict is not BaseFastTextTagger.predict:
+            # a subclass changes how documents are predicted (e.g., language taggers); we have to go through it.
+            return [self.predict(doc) for doc in docs]
+        return self._predict_docs(docs)
+
+    def _predict_docs(self, docs: List[Document]) -> List[DocResult]:
+        # units of all documents are classified together
+        docs_units = [self.get_units(doc) for doc in docs]
+        all_predictions = iter(self.predict_slices([unit for units in docs_units for unit in units]))
+
+        results: List[DocResult] = []
+        for doc, units in zip(docs, docs_units):
+            spans = []
+            for unit, predictions in zip(units, all_predictions):
+                for prediction in predictions:
+                    spans.append(
+                        Span(start=unit.start, end=unit.end, type=prediction.label, score=prediction.score)
+                    )
+            results.append(DocResult(doc=doc, spans=spans))
+        return results
 
     def predict_slice(self, text_slice: TextSlice) -> Iterable[Prediction]:
         raise NotImplementedError("Please implement the predict slice method")
+
+    def predict_slices(self, text_slices: List[TextSlice]) -> List[Iterable[Prediction]]:
+        """Predict on many slices at once; override to classify all of them with a single call to the model."""
+        return [self.predict_slice(text_slice) for text_slice in text_slices]
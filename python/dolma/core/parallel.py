@@ -6,6 +6,7 @@ import pickle
 import random
 import re
 import time
+from collections import deque
 from contextlib import ExitStack
 from datetime import datetime
 from functools import partial
@@ -17,7 +18,7 @@ import smart_open
 import tqdm
 from typing_extensions import TypeAlias
 
-from .errors import DolmaError, DolmaRetryableFailure
+from .errors import DolmaError, DolmaHandoff, DolmaRetryableFailure
 from .loggers import get_logger
 from .paths import (
     add_suffix,
@@ -58,8 +59,15 @@ class BaseParallelProcessor:
         - `increment_progressbar` method, which defines which units to keep track of in the progress bar.
 
     See documentation of both methods for more details on how to implement them correctly.
+
+    `process_single` can also raise `DolmaHandoff` to stop processing a file and continue in a new call, with
+    additional kwargs that describe where to resume; subclasses that do so to bound the lifetime of worker
+    processes should set `MAX_TASKS_PER_CHILD`, so that the new call runs in a new process.
     """
 
+    # number of calls to `process_single` a worker process runs before it is replaced; None to never replace it
+    MAX_TASKS_PER_CHILD: Optional[int] = None
+
     def __init__(
         self,
         source_prefix: Union[str, List[str]],
@@ -313,13 +321,19 @@ class BaseParallelProcessor:
         thread.start()
 
         for source_path, destination_path, metadata_path, process_kwargs in arguments_iterator:
-            self._process_single_and_save_status(
-                source_path=source_path,
-                destination_path=destination_path,
-                metadata_path=metadata_path,
-                queue=pbar_queue,
-                serialized_kwargs=pickle.dumps({**process_kwargs, **process_single_kwargs}),
-            )
+            while True:
+                try:
+                    self._process_single_and_save_status(
+                        source_path=source_path,
+                        destination_path=destination_path,
+                        metadata_path=metadata_path,
+                        queue=pbar_queue,
+                        serialized_kwargs=pickle.dumps({**process_kwargs, **process_single_kwargs}),
+                    )
+                    break
+                except DolmaHandoff as handoff:
+                    # there are no processes to replace in debug mode; continue in this one
+                    process_kwargs = {**process_kwargs, **handoff.kwargs}
 
         pbar_queue.put(None)
         thread.join()
@@ -411,15 +425,14 @@ class BaseParallelProcessor:
             len(all_process_kwargs),
         )
 
-        with multiprocessing.Pool(processes=num_processes) as pool:
+        with multiprocessing.Pool(processes=num_processes, maxtasksperchild=self.MAX_TASKS_PER_CHILD) as pool:
             pbar_queue: QueueType = (manager := multiprocessing.Manager()).Queue()
             thread = Thread(
                 target=self._run_threaded_progressbar, args=(pbar_queue, self.pbar_timeout), daemon=True
             )
             thread.start()
 
-            process_single_fn = partial(self.process_single, queue=pbar_queue)
-            results = []
+            results: deque = deque()
 
             for source_path, destination_path, metadata_path, process_kwargs in arguments_iterator:
                 process_single_fn = partial(
@@ -432,10 +445,20 @@ class BaseParallelProcessor:
                     serialized_kwargs=pickle.dumps({**process_kwargs, **process_single_kwargs}),
                 )
                 result = pool.apply_async(process_single_fn)
-                results.append(result)
-
-            for result in results:
-                result.get()
+                results.append((result, process_single_fn, process_kwargs))
+
+            while results:
+                result, process_single_fn, process_kwargs = results.popleft()
+                try:
+                    result.get()
+                except DolmaHandoff as handoff:
+                    # the file is not done yet: continue where the process stopped, in a new task
+                    process_kwargs = {**process_kwargs, **handoff.kwargs}
+                    process_single_fn = partial(
+                        process_single_fn,
+                        serialized_kwargs=pickle.dumps({**process_kwargs, **process_single_kwargs}),
+                    )
+                    results.append((pool.apply_async(process_single_fn), process_single_fn, process_kwargs))
 
             pool.close()
             pool.join()
@@ -453,9 +476,11 @@ class BaseParallelProcessor:
             return False
         return True
 
-    def _get_all_paths(self) -> AllPathsTuple:
-        """Get all paths to process using prefixes provided"""
+    def _get_all_paths(self, ignore_existing: Optional[bool] = None) -> AllPathsTuple:
+        """Get all paths to process using prefixes provided; paths whose metadata file exists are skipped unless
+        `ignore_existing` is true (defaults to the setting of the processor)."""
         all_paths = AllPathsTuple.empty()
+        ignore_existing = self.ignore_existing if ignore_existing is None else ignore_existing
 
         for src_prefix, dst_prefix, meta_prefix, kwargs_prefix in zip(
             self.src_prefixes, self.dst_prefixes, self.meta_prefixes, self.process_single_kwargs
@@ -484,7 +509,7 @@ class BaseParallelProcessor:
             )
 
             for path in rel_paths:
-                if not self.ignore_existing and path in existing_metadata_names:
+                if not ignore_existing and path in existing_metadata_names:
                     continue
 
                 if not self._valid_path(path):
@@ -152,6 +152,16 @@ def get_size(path) -> int:
     return fs.info(path)["size"]
 
 
+def get_fingerprint(path: str) -> str:
+    """Get a string that changes when the file at `path` changes: its ETag on object stores that provide one,
+    otherwise its size and modification time."""
+    info = _get_fs(path).info(path)
+    if etag := info.get("ETag") or info.get("etag"):
+        return str(etag).strip('"')
+    mtime = info.get("mtime") or info.get("LastModified") or info.get("updated")
+    return f"{info['size']}:{mtime}"
+
+
 def delete_dir(path: str, ignore_missing: bool = False) -> bool:
     """Delete a directory."""
 
@@ -1,4 +1,18 @@
-from typing import Callable, Dict, Generator, Generic, Tuple, Type, TypeVar
+import importlib
+import sys
+from importlib.metadata import EntryPoint, entry_points
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 from .taggers import BaseTagger
 
@@ -6,10 +20,27 @@ T = TypeVar("T", bound=Type)
 R = TypeVar("R", bound=Type)
 
 
+def _entry_points(group: str) -> Iterable[EntryPoint]:
+    """Get entry points installed for a group; `entry_points()` returns a dict in Python 3.9."""
+    if sys.version_info >= (3, 10):
+        return entry_points(group=group)
+    else:
+        return entry_points().get(group, [])
+
+
 class BaseRegistry(Generic[T]):
-    """A registry for objects."""
+    """A registry for objects.
+
+    Objects can be added with the `add` decorator, or lazily with `add_lazy`, in which case the module that
+    defines them is only imported the first time they are requested with `get`. If `ENTRY_POINTS_GROUP` is set,
+    objects that installed packages declare under that entry point group are also added lazily."""
 
     _registry_storage: Dict[str, T]
+    _lazy_storage: Dict[str, str]
+    _entry_points_loaded: bool
+
+    # name of the entry point group (e.g. "dolma.taggers") other packages can use to add objects to the registry
+    ENTRY_POINTS_GROUP: Optional[str] = None
 
     @classmethod
     def _get_storage(cls) -> Dict[str, T]:
@@ -17,10 +48,43 @@ class BaseRegistry(Generic[T]):
             cls._registry_storage = {}
         return cls._registry_storage  # pyright: ignore
 
+    @classmethod
+    def _get_lazy_storage(cls, load_entry_points: bool = True) -> Dict[str, str]:
+        if not hasattr(cls, "_lazy_storage"):
+            cls._lazy_storage = {}
+
+        if load_entry_points and cls.ENTRY_POINTS_GROUP and not getattr(cls, "_entry_points_loaded", False):
+            # entry points are only loaded when the registry is first queried, since finding them requires
+            # scanning the metadata of all installed packages; objects added with `add_lazy` take precedence.
+            cls._entry_points_loaded = True
+            for entry_point in _entry_points(cls.ENTRY_POINTS_GROUP):
+                cls._lazy_storage.setdefault(entry_point.name, entry_point.value)
+
+        return cls._lazy_storage  # pyright: ignore
+
+    @classmethod
+    def _import_lazy(cls, name: str) -> None:
+        """Import the module of a lazily added object; importing it usually adds the object to the registry."""
+        module_name, _, attr_name = cls._get_lazy_storage()[name].partition(":")
+        obj = importlib.import_module(module_name)
+
+        if name not in cls._get_storage():
+            # the module does not add the object to the registry itself (e.g., a class from a plugin package
+            # that is not decorated with `add`), so we add it here.
+            for part in attr_name.split("."):
+                obj = getattr(obj, part)
+            cls.add(name)(obj)  # type: ignore
+
+    @classmethod
+    def names(cls) -> List[str]:
+        """Return the names of all objects in the registry, without importing any lazily added object."""
+        return sorted(set(cls._get_storage()) | set(cls._get_lazy_storage()))
+
     @classmethod
     def items(cls) -> Generator[Tuple[str, T], None, None]:
-        """Yield all items in the registry."""
-        yield from sorted(cls._get_storage().items())
+        """Yield all items in the registry; lazily added objects are imported."""
+        for name in cls.names():
+            yield name, cls.get(name)
 
     @classmethod
     def add(cls, name: str) -> Callable[[R], R]:
@@ -38,27 +102,53 @@ class BaseRegistry(Generic[T]):
 
         return _add  # type: ignore
 
+    @classmethod
+    def add_lazy(cls, name: str, entry_point: str) -> None:
+        """Add a class to the registry without importing it.
+
+        Args:
+            name (str): Name of the class in the registry.
+            entry_point (str): Location of the class in the form `module:Class`; the module is imported the
+                first time the class is requested with `get`.
+        """
+        if ":" not in entry_point:
+            raise ValueError(f"Invalid entry point {entry_point} for {name}; expected `module:Class`")
+        cls._get_lazy_storage(load_entry_points=False)[name] = entry_point
+
+    @classmethod
+    def entry_point(cls, name: str) -> str:
+        """Return the location of a class in the registry as `module:Class` without importing it."""
+        if name in cls._get_storage():
+            obj = cls._get_storage()[name]
+            return f"{obj.__module__}:{obj.__qualname__}"
+        elif name in cls._get_lazy_storage():
+            return cls._get_lazy_storage()[name]
+        raise ValueError(f"Unknown tagger {name}; available taggers: {', '.join(cls.names())}")
+
     @classmethod
     def remove(cls, name: str) -> bool:
         """Remove a tagger from the registry."""
+        removed_lazy = cls._get_lazy_storage().pop(name, None) is not None
         if name in cls._get_storage():
             cls._get_storage().pop(name)
             return True
-        return False
+        return removed_lazy
 
     @classmethod
     def has(cls, name: str) -> bool:
         """Check if a tagger exists in the registry."""
-        return name in cls._get_storage()
+        return name in cls._get_storage() or name in cls._get_lazy_storage()
 
     @classmethod
     def get(cls, name: str) -> T:
         """Get a tagger from the registry; raise ValueError if it doesn't exist."""
+        if name not in cls._get_storage() and name in cls._get_lazy_storage():
+            cls._import_lazy(name)
+
         if name not in cls._get_storage():
-            tagger_names = ", ".join([tn for tn, _ in cls.items()])
-            raise ValueError(f"Unknown tagger {name}; available taggers: {tagger_names}")
+            raise ValueError(f"Unknown tagger {name}; available taggers: {', '.join(cls.names())}")
         return cls._get_storage()[name]
 
 
 class TaggerRegistry(BaseRegistry[Type[BaseTagger]]):
-    pass
+    ENTRY_POINTS_GROUP = "dolma.taggers"
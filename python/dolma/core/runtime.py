@@ -1,10 +1,14 @@
 import io
 import multiprocessing
+import shutil
 import tempfile
+from collections import deque
 from contextlib import ExitStack, contextmanager
+from multiprocessing.pool import AsyncResult
 from typing import (
     IO,
     Any,
+    Deque,
     Dict,
     Generator,
     Iterable,
@@ -12,30 +16,68 @@ from typing import (
     NamedTuple,
     Optional,
     Set,
+    Tuple,
     Union,
 )
 
 import msgspec
 import smart_open
 
-from dolma.core.taggers import BaseTaggerWithMetadata
+from dolma.core.taggers import BaseTagger, BaseTaggerWithMetadata
 
+from .caps import CAPPED_ATTRIBUTE, TaggerCap, validate_caps
+from .cascade import (
+    CASCADE_SKIPPED_ATTRIBUTE,
+    CascadeStage,
+    FilterSpec,
+    validate_cascade,
+)
 from .data_types import (
     InputSpec,
     InputSpecWithMetadata,
+    InputSpecWithMetadataAndAttributes,
     OutputSpec,
     TaggerOutputDictType,
+    TaggerOutputType,
+)
+from .errors import (
+    DolmaConfigError,
+    DolmaFatalError,
+    DolmaRetryableFailure,
+    DolmaShardError,
 )
-from .errors import DolmaFatalError, DolmaRetryableFailure, DolmaShardError
 from .parallel import BaseParallelProcessor, QueueType
-from .paths import delete_dir, join_path, make_relative, mkdir_p, split_glob, split_path
+from .paths import (
+    add_suffix,
+    delete_dir,
+    delete_file,
+    glob_path,
+    join_path,
+    make_relative,
+    mkdir_p,
+    parent,
+    split_glob,
+    split_path,
+    sub_prefix,
+)
 from .registry import TaggerRegistry
+from .sampling import (
+    SampleSpec,
+    remove_sample_spec,
+    sample_lines,
+    validate_sample_rate,
+    write_sample_spec,
+)
 from .utils import import_modules, make_variable_name
 
 # this placeholder gets used when a user has provided no experiment name, and we want to use taggers'
 # names as experiment names.
 EXPERIMENT_PLACEHOLDER_NAME = "_______EXPERIMENT_PLACEHOLDER_NAME_______"
 
+# documents deferred by a cap are saved next to the attributes of the file they come from, in a file with the
+# same name plus this suffix; it is deleted once the deferred taggers have run.
+DEFERRED_SUFFIX = ".deferred.jsonl.gz"
+
 
 def _make_paths_from_substitution(paths: List[str], find: str, replace: str) -> List[str]:
     """
@@ -120,6 +162,19 @@ class TaggerOutputLocation(NamedTuple):
     path: str
 
 
+def _make_attribute_name(location: TaggerOutputLocation, key: str) -> str:
+    """Name of an attribute in the output of a tagger, e.g. `{experiment}__{tagger}__{key}`."""
+    return f"{location.exp}__{location.name}__{make_variable_name(key)}"
+
+
+class DeferredRow(msgspec.Struct):
+    """A row deferred by the caps of some taggers, and its line in the file it comes from."""
+
+    line: int
+    taggers: List[str]
+    row: InputSpecWithMetadata
+
+
 class TaggerOutputIO(NamedTuple):
     exp: str
     taggers: Set[str]
@@ -212,7 +267,7 @@ def _write_sample_to_streams(
             attributes_by_stream[tagger_output.path] = {}
 
         for tagger_key, tagger_value in tagger_data.items():
-            tagger_key = f"{tagger_output.exp}__{tagger_output.name}__{make_variable_name(tagger_key)}"
+            tagger_key = _make_attribute_name(tagger_output, tagger_key)
             attributes_by_stream[tagger_output.path][tagger_key] = tagger_value
 
     for stream_path, attributes in attributes_by_stream.items():
@@ -221,6 +276,197 @@ def _write_sample_to_streams(
         output_streams[stream_path].write(output)
 
 
+def _batch_rows(
+    in_stream: Iterable[str],
+    decoder: msgspec.json.Decoder,
+    batch_size: int,
+    steps: Optional[int] = None,
+) -> Generator[List[InputSpec], None, None]:
+    """Utility function to decode rows from a stream and group them in batches of at most `batch_size` rows.
+    If `steps` is provided, stops after that many rows have been decoded."""
+    batch: List[InputSpec] = []
+    total_rows_cnt = 0
+    for raw in in_stream:
+        batch.append(decoder.decode(raw))
+        total_rows_cnt += 1
+
+        if steps is not None and total_rows_cnt >= steps:
+            # if we have reached the maximum number of steps, we break
+            break
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _keep_lines(lines: Iterable[str], buffer: Deque[str]) -> Generator[str, None, None]:
+    """Yield lines, after appending each to `buffer`."""
+    for line in lines:
+        buffer.append(line)
+        yield line
+
+
+def _tag_rows(tagger: BaseTagger, rows: List[InputSpec], batch_size: int) -> List[TaggerOutputDictType]:
+    """Run a tagger on rows; with the default batch size of 1, we use `tag` directly, so that taggers that
+    only override `tag` keep working."""
+    return tagger.tag_batch(rows) if batch_size > 1 else [tagger.tag(row) for row in rows]
+
+
+def _tag_rows_with_cap(
+    tagger: BaseTagger, rows: List[InputSpec], batch_size: int, cap: Optional[TaggerCap] = None
+) -> Tuple[List[TaggerOutputDictType], List[int]]:
+    """Run a tagger on rows, applying `cap` to rows that are over it; returns the output for each row, and the
+    indices of the rows that have been deferred. Deferred rows only get a `CAPPED_ATTRIBUTE` span with score 0;
+    rows that are truncated or sampled are tagged one window of text at a time, and spans are moved back to
+    their offsets in the full text."""
+    if cap is None:
+        return _tag_rows(tagger, rows, batch_size), []
+
+    outputs: List[TaggerOutputDictType] = [{} for _ in rows]
+    deferred: List[int] = []
+
+    # rows (or windows of rows) to tag, with the index of the row they come from and their offset in it
+    to_tag: List[InputSpec] = []
+    owners: List[Tuple[int, int]] = []
+
+    for i, row in enumerate(rows):
+        windows: Optional[List[Tuple[int, int]]]
+        if cap.policy == "defer":
+            windows = [] if cap.exceeds(row.text) else None
+        else:
+            windows = cap.windows(row.text)
+
+        if windows is None:
+            to_tag.append(row)
+            owners.append((i, 0))
+            continue
+
+        if not windows:
+            deferred.append(i)
+
+        tagged_fraction = sum(end - start for start, end in windows) / len(row.text)
+        outputs[i][CAPPED_ATTRIBUTE] = [(0, len(row.text), tagged_fraction)]
+        for start, end in windows:
+            to_tag.append(msgspec.structs.replace(row, text=row.text[start:end]))
+            owners.append((i, start))
+
+    for (i, offset), output in zip(owners, _tag_rows(tagger, to_tag, batch_size)):
+        for key, spans in output.items():
+            outputs[i].setdefault(key, []).extend(
+                (start + offset, end + offset, score) for start, end, score in spans
+            )
+
+    return outputs, deferred
+
+
+def _filter_rows(
+    doc_filter: Any,
+    rows: List[InputSpec],
+    indices: List[int],
+    taggers_outputs: Dict[str, List[TaggerOutputDictType]],
+    taggers_paths: Dict[str, TaggerOutputLocation],
+) -> List[int]:
+    """Return the indices (among `indices`) of the rows that pass `doc_filter`, which is evaluated on each row
+    together with its attributes from `taggers_outputs`, as the mixer would see them."""
+    encoder = msgspec.json.Encoder()
+    docs = []
+    for i in indices:
+        attributes = {
+            _make_attribute_name(taggers_paths[tagger_name], key): value
+            for tagger_name, tagger_outputs in taggers_outputs.items()
+            for key, value in tagger_outputs[i].items()
+        }
+        doc = InputSpecWithMetadataAndAttributes(
+            id=rows[i].id,
+            text=rows[i].text,
+            source=rows[i].source,
+            created=rows[i].created,
+            added=rows[i].added,
+            version=rows[i].version,
+            metadata=getattr(rows[i], "metadata", None),
+            attributes=attributes,
+        )
+        docs.append(encoder.encode(doc))
+    return [i for i, keep in zip(indices, doc_filter.should_keep_many(docs)) if keep]
+
+
+def _run_cascade(
+    rows: List[InputSpec],
+    taggers_outputs: Dict[str, List[TaggerOutputDictType]],
+    cascade: List[Tuple[Any, Dict[str, BaseTagger]]],
+    taggers_paths: Dict[str, TaggerOutputLocation],
+    batch_size: int,
+    caps: Dict[str, TaggerCap],
+    deferred: Dict[int, List[str]],
+) -> None:
+    """Run the taggers in each stage of a cascade on the rows that pass the filter of the stage and of all
+    stages before it; the filter of a stage sees the attributes from `taggers_outputs`, to which the output of
+    the stage is added. Taggers that are skipped for a row output a `CASCADE_SKIPPED_ATTRIBUTE` span instead.
+    Taggers in `caps` are run with their cap; rows they defer are added to `deferred`."""
+
+    # indices of the rows that passed all stages so far
+    active = list(range(len(rows)))
+
+    for doc_filter, stage_taggers in cascade:
+        if active:
+            active = _filter_rows(
+                doc_filter=doc_filter,
+                rows=rows,
+                indices=active,
+                taggers_outputs=taggers_outputs,
+                taggers_paths=taggers_paths,
+            )
+
+        for tagger_name, tagger in stage_taggers.items():
+            stage_outputs: List[TaggerOutputDictType] = [
+                {CASCADE_SKIPPED_ATTRIBUTE: [(0, len(row.text), 1.0)]} for row in rows
+            ]
+            outputs, deferred_rows = _tag_rows_with_cap(
+                tagger, [rows[i] for i in active], batch_size, caps.get(tagger_name)
+            )
+            for i, output in zip(active, outputs):
+                stage_outputs[i] = output
+            for j in deferred_rows:
+                deferred.setdefault(active[j], []).append(tagger_name)
+            taggers_outputs[tagger_name] = stage_outputs
+
+
+def _run_taggers(
+    rows: List[InputSpec],
+    taggers: Dict[str, BaseTagger],
+    cascade: List[Tuple[Any, Dict[str, BaseTagger]]],
+    caps: Dict[str, TaggerCap],
+    taggers_paths: Dict[str, TaggerOutputLocation],
+    batch_size: int,
+) -> Tuple[Dict[str, List[TaggerOutputDictType]], Dict[int, List[str]]]:
+    """Run taggers, then the stages of the cascade (if any) on rows; returns the output of each tagger for each
+    row, and the names of the taggers that deferred each row (if any)."""
+    taggers_outputs: Dict[str, List[TaggerOutputDictType]] = {}
+    deferred: Dict[int, List[str]] = {}
+    for tagger_name, tagger in taggers.items():
+        outputs, deferred_rows = _tag_rows_with_cap(tagger, rows, batch_size, caps.get(tagger_name))
+        taggers_outputs[tagger_name] = outputs
+        for i in deferred_rows:
+            deferred.setdefault(i, []).append(tagger_name)
+
+    if cascade:
+        # taggers in the cascade only run on rows that pass the filters
+        _run_cascade(
+            rows=rows,
+            taggers_outputs=taggers_outputs,
+            cascade=cascade,
+            taggers_paths=taggers_paths,
+            batch_size=batch_size,
+            caps=caps,
+            deferred=deferred,
+        )
+
+    return taggers_outputs, deferred
+
+
 class TaggerProcessor(BaseParallelProcessor):
     @classmethod
     def increment_progressbar(  # type: ignore
@@ -258,13 +504,37 @@ class TaggerProcessor(BaseParallelProcessor):
             raise RuntimeError("Taggers are in the wrong format, this is a bug! Please report it.")
         taggers = {make_variable_name(t): TaggerRegistry.get(t)() for t in taggers_names}
 
+        # stages of the cascade, if any: each is a filter, and the taggers that only run on rows that pass it
+        cascade_stages: List[CascadeStage] = kwargs.get("cascade", None) or []
+        cascade = [
+            (stage.make_filter(), {make_variable_name(t): TaggerRegistry.get(t)() for t in stage.taggers})
+            for stage in cascade_stages
+        ]
+        all_taggers = {**taggers, **{name: tagger for _, stage in cascade for name, tagger in stage.items()}}
+
+        # caps on the size of documents each tagger processes; see `dolma.core.caps`
+        caps_list: List[TaggerCap] = kwargs.get("caps", None) or []
+        caps = {make_variable_name(t): cap for cap in caps_list for t in cap.taggers}
+
         # get name of experiment
         if (experiment_name := kwargs.get("experiment_name", None)) is None:
             raise RuntimeError("Experiment name not in kwargs, this is a bug! Please report it.")
 
+        # if a filter is provided, documents that pass it are written to the destination path right after tagging;
+        # their attributes are only written if `filtered_attributes` is set, to the same relative path under
+        # `attributes_prefix` as the destination path under `documents_prefix`.
+        output_filter_spec: Optional[FilterSpec] = kwargs.get("output_filter", None)
+        output_filter = output_filter_spec.make_filter() if output_filter_spec is not None else None
+        attributes_path = destination_path
+        write_attributes = True
+        if output_filter is not None:
+            relative_path = sub_prefix(destination_path, kwargs["documents_prefix"])
+            attributes_path = add_suffix(kwargs["attributes_prefix"], relative_path)
+            write_attributes = bool(kwargs.get("filtered_attributes", False))
+
         # this is the dictionary that will hold the output of each tagger
         taggers_paths = _determine_output_paths_for_taggers(
-            experiment_name=experiment_name, destination=destination_path, taggers=taggers
+            experiment_name=experiment_name, destination=attributes_path, taggers=all_taggers
         )
 
         # skip on failure
@@ -280,44 +550,93 @@ class TaggerProcessor(BaseParallelProcessor):
         # running document count; gets reset every time we update the progress bar
         docs_cnt = 0
 
-        # total number of documents processed
-        total_docs_cnt = 0
+        # number of documents passed to each tagger at once; see `BaseTagger.predict_batch`
+        batch_size = max(int(kwargs.get("batch_size", None) or 1), 1)
+
+        # if set, only documents in the sample are tagged (and written to the output); see `dolma.core.sampling`
+        sample_rate: Optional[float] = kwargs.get("sample_rate", None)
+        sample_spec = SampleSpec(sample_rate=sample_rate) if sample_rate is not None else None
 
         # creating dedicated decoder speeds up the process
-        # if any of the taggers require metadata, we use a decoder that can handle it
-        # otherwise, we use a decoder that does not parse metadata, which is faster
-        if any(isinstance(tagger, BaseTaggerWithMetadata) for tagger in taggers.values()):
+        # if any of the taggers require metadata (or cascade filters, which see the whole document), we use a
+        # decoder that can handle it; otherwise, we use a decoder that does not parse metadata, which is faster
+        if (
+            cascade
+            or output_filter is not None
+            or any(isinstance(tagger, BaseTaggerWithMetadata) for tagger in all_taggers.values())
+        ):
             decoder = msgspec.json.Decoder(InputSpecWithMetadata)
         else:
             decoder = msgspec.json.Decoder(InputSpec)
 
         with ExitStack() as stack:
-            in_stream = stack.enter_context(smart_open.open(source_path, "rt", encoding="utf-8"))
-            output_streams = stack.enter_context(
-                _make_output_streams(taggers_paths=taggers_paths, mode="wt", encoding="utf-8")
-            )
-            try:
-                for raw in in_stream:
-                    row = decoder.decode(raw)
+            in_stream: Iterable[str] = stack.enter_context(smart_open.open(source_path, "rt", encoding="utf-8"))
+            if sample_spec is not None:
+                in_stream = sample_lines(in_stream, sample_spec)
+
+            output_streams: Dict[str, TaggerOutputIO] = {}
+            if write_attributes:
+                output_streams = stack.enter_context(
+                    _make_output_streams(taggers_paths=taggers_paths, mode="wt", encoding="utf-8")
+                )
 
-                    with _write_sample_to_streams(
+            # documents that pass the filter are written as they are in the source file, so we keep raw lines
+            documents_stream: Optional[IO] = None
+            raw_lines: Deque[str] = deque()
+            if output_filter is not None:
+                documents_stream = stack.enter_context(smart_open.open(destination_path, "wt", encoding="utf-8"))
+                in_stream = _keep_lines(in_stream, raw_lines)
+
+            # documents deferred by caps are saved to a side file; they are tagged after the main pass
+            deferred_stream: Optional[IO] = None
+            if any(cap.policy == "defer" for cap in caps.values()):
+                deferred_path = f"{destination_path}{DEFERRED_SUFFIX}"
+                deferred_stream = stack.enter_context(smart_open.open(deferred_path, "wt", encoding="utf-8"))
+            deferred_encoder = msgspec.json.Encoder()
+
+            # number of rows in previous batches, to find the line of each row in the file
+            rows_offset = 0
+
+            try:
+                for rows in _batch_rows(in_stream=in_stream, decoder=decoder, batch_size=batch_size, steps=steps):
+                    # run the taggers on all rows in the batch at once
+                    taggers_outputs, deferred = _run_taggers(
+                        rows=rows,
+                        taggers=taggers,
+                        cascade=cascade,
+                        caps=caps,
                         taggers_paths=taggers_paths,
-                        output_streams=output_streams,
-                        row=row,
-                    ) as samples_collectors:
-                        # we run the taggers; the context manager will write the output to the output streams
-                        for tagger_name, tagger in taggers.items():
-                            samples_collectors[tagger_name] = tagger.tag(row)
+                        batch_size=batch_size,
+                    )
+
+                    if deferred_stream is not None:
+                        for i, deferred_taggers in sorted(deferred.items()):
+                            deferred_row = DeferredRow(line=rows_offset + i, taggers=deferred_taggers, row=rows[i])
+                            deferred_stream.write(deferred_encoder.encode(deferred_row).decode("utf-8") + "\n")
+
+                    # in fused mode, only documents that pass the filter (and their attributes) are written
+                    kept_rows = list(range(len(rows)))
+                    if documents_stream is not None:
+                        batch_lines = [raw_lines.popleft() for _ in rows]
+                        kept_rows = _filter_rows(output_filter, rows, kept_rows, taggers_outputs, taggers_paths)
+                        for i in kept_rows:
+                            documents_stream.write(batch_lines[i].rstrip("\n") + "\n")
+
+                    for i in kept_rows if write_attributes else []:
+                        with _write_sample_to_streams(
+                            taggers_paths=taggers_paths,
+                            output_streams=output_streams,
+                            row=rows[i],
+                        ) as samples_collectors:
+                            # the context manager will write the output to the output streams
+                            for tagger_name, tagger_outputs in taggers_outputs.items():
+                                samples_collectors[tagger_name] = tagger_outputs[i]
 
                     # increment the number of documents processed so far
-                    docs_cnt += 1
-                    total_docs_cnt += 1
+                    docs_cnt += len(rows)
+                    rows_offset += len(rows)
 
-                    if steps is not None and total_docs_cnt >= steps:
-                        # if we have reached the maximum number of steps, we break
-                        break
-
-                    if docs_cnt % update_interval == 0:
+                    if docs_cnt >= update_interval:
                         # update the progress bar every 1000 documents to prevent
                         # buffering
                         cls.increment_progressbar(queue, documents=docs_cnt)
@@ -339,10 +658,121 @@ class TaggerProcessor(BaseParallelProcessor):
                     else:
                         raise DolmaFatalError(msg) from exp
 
+        if write_attributes:
+            # record how many documents were sampled next to each attributes file, for extrapolation; attributes
+            # of all documents must not keep the sidecar of an earlier sampled run
+            for path in set(location.path for location in taggers_paths.values()):
+                if sample_spec is not None:
+                    write_sample_spec(path, sample_spec)
+                else:
+                    remove_sample_spec(path)
+
         # increment the files progress bar
         cls.increment_progressbar(queue, files=1, documents=docs_cnt)
 
 
+def _update_attributes(
+    path: str,
+    taggers_outputs: Dict[str, Dict[int, TaggerOutputDictType]],
+    taggers_paths: Dict[str, TaggerOutputLocation],
+) -> None:
+    """Replace the attributes of taggers in an attributes file with their output for some of the lines of the file;
+    `taggers_outputs` maps the name of each tagger to its output for each line it should replace."""
+    decoder = msgspec.json.Decoder(OutputSpec)
+    encoder = msgspec.json.Encoder()
+
+    with tempfile.TemporaryFile(mode="w+t", encoding="utf-8") as tmp:
+        with smart_open.open(path, "rt", encoding="utf-8") as f:
+            for line, raw in enumerate(f):
+                updates = {name: outputs[line] for name, outputs in taggers_outputs.items() if line in outputs}
+                if updates:
+                    output_spec = decoder.decode(raw)
+                    for tagger_name, tagger_output in updates.items():
+                        location = taggers_paths[tagger_name]
+                        prefix = f"{location.exp}__{location.name}__"
+                        output_spec.attributes = {
+                            **{k: v for k, v in output_spec.attributes.items() if not k.startswith(prefix)},
+                            **{_make_attribute_name(location, k): v for k, v in tagger_output.items()},
+                        }
+                    raw = encoder.encode(output_spec).decode("utf-8") + "\n"
+                tmp.write(raw)
+
+        tmp.seek(0)
+        with smart_open.open(path, "wt", encoding="utf-8") as f:
+            shutil.copyfileobj(tmp, f)
+
+
+class DeferredTaggerProcessor(BaseParallelProcessor):
+    """Runs taggers on the documents they deferred during the main pass (see `TaggerProcessor`), and replaces
+    the placeholder attributes written for those documents with their output. The source paths are the files
+    of deferred rows; attributes are found next to them."""
+
+    @classmethod
+    def increment_progressbar(  # type: ignore
+        cls,
+        queue: QueueType,  # queue must be the first argument, and it should be a positional-only argument
+        /,
+        files: int = 0,
+        documents: int = 0,
+    ) -> Dict[str, int]:
+        return super().increment_progressbar(queue, files=files, documents=documents)
+
+    @classmethod
+    def process_single(
+        cls,
+        source_path: str,
+        destination_path: str,
+        queue: QueueType,
+        **kwargs,
+    ):
+        taggers_modules = kwargs.get("taggers_modules", None)
+        if taggers_modules is not None:
+            import_modules(taggers_modules)
+
+        # names of the taggers with a `defer` cap; they are only instantiated if they deferred any row
+        taggers_names = {make_variable_name(t): t for t in kwargs.get("taggers_names", None) or []}
+        taggers: Dict[str, BaseTagger] = {}
+
+        if (experiment_name := kwargs.get("experiment_name", None)) is None:
+            raise RuntimeError("Experiment name not in kwargs, this is a bug! Please report it.")
+        batch_size = max(int(kwargs.get("batch_size", None) or 1), 1)
+
+        # for each tagger, its output for each line of the attributes file it deferred
+        taggers_outputs: Dict[str, Dict[int, TaggerOutputDictType]] = {}
+
+        decoder = msgspec.json.Decoder(DeferredRow)
+        with smart_open.open(source_path, "rt", encoding="utf-8") as f:
+            for deferred_rows in _batch_rows(in_stream=f, decoder=decoder, batch_size=batch_size):
+                for tagger_name in sorted(set(t for deferred_row in deferred_rows for t in deferred_row.taggers)):
+                    if tagger_name not in taggers:
+                        taggers[tagger_name] = TaggerRegistry.get(taggers_names[tagger_name])()
+
+                    tagger_rows = [d for d in deferred_rows if tagger_name in d.taggers]
+                    outputs = _tag_rows(taggers[tagger_name], [d.row for d in tagger_rows], batch_size)
+                    for deferred_row, output in zip(tagger_rows, outputs):
+                        # the whole document has been tagged, so the fraction in the capped attribute is 1
+                        output = {**output, CAPPED_ATTRIBUTE: [(0, len(deferred_row.row.text), 1.0)]}
+                        taggers_outputs.setdefault(tagger_name, {})[deferred_row.line] = output
+
+                cls.increment_progressbar(queue, documents=len(deferred_rows))
+
+        taggers_paths = _determine_output_paths_for_taggers(
+            experiment_name=experiment_name,
+            destination=source_path[: -len(DEFERRED_SUFFIX)],
+            taggers=taggers_outputs,
+        )
+        for path in sorted(set(location.path for location in taggers_paths.values())):
+            _update_attributes(
+                path=path,
+                taggers_outputs={t: o for t, o in taggers_outputs.items() if taggers_paths[t].path == path},
+                taggers_paths=taggers_paths,
+            )
+
+        # attributes are complete, so the deferred rows are not needed anymore
+        delete_file(source_path)
+        cls.increment_progressbar(queue, files=1)
+
+
 @contextmanager
 def profiler(
     output: Optional[str] = None,
@@ -387,6 +817,14 @@ def create_and_run_tagger(
     skip_on_failure: bool = False,
     retries_on_error: int = 0,
     num_processes: int = 1,
+    batch_size: int = 1,
+    cascade: Optional[List[CascadeStage]] = None,
+    caps: Optional[List[TaggerCap]] = None,
+    deferred_processes: int = 1,
+    sample_rate: Optional[float] = None,
+    output_filter: Optional[FilterSpec] = None,
+    filtered_destination: Optional[str] = None,
+    filtered_attributes: bool = False,
     profile_enable: bool = False,
     profile_output: Optional[str] = None,
     profile_steps: Optional[int] = None,
@@ -417,6 +855,28 @@ def create_and_run_tagger(
         retries_on_error (int, optional): Number of times to retry processing a document if it fails.
             Defaults to 0 (fail immediately)
         num_processes (int, optional): Number of processes to use. Defaults to 1.
+        batch_size (int, optional): Number of documents to pass to each tagger at once. Taggers that support
+            batching (e.g., by tokenizing many documents in one call) are faster with larger batches; other
+            taggers process documents one at a time regardless. Defaults to 1.
+        cascade (Optional[List[CascadeStage]], optional): Stages of taggers that only run on documents that pass
+            a filter on the attributes computed by `taggers` and by previous stages; see `dolma.core.cascade`.
+            Defaults to None (no cascade).
+        caps (Optional[List[TaggerCap]], optional): Limits on the size of documents some taggers process, and
+            what to do with documents over them; see `dolma.core.caps`. Defaults to None (no caps).
+        deferred_processes (int, optional): Number of processes to use to tag documents deferred by caps, after
+            all documents have been processed. Defaults to 1.
+        sample_rate (Optional[float], optional): If provided, only tag the fraction of documents selected by a
+            hash of their id, and write attributes for those documents only; a sidecar file next to each
+            attributes file records the number of documents sampled. Defaults to None (tag all documents).
+        output_filter (Optional[FilterSpec], optional): If provided, documents are filtered right after tagging,
+            using the same syntax as the filter of mixer streams, instead of writing attributes files to
+            `destination`. Documents that pass the filter are written as they are to `filtered_destination`.
+            Defaults to None (no filtering).
+        filtered_destination (Optional[str], optional): With `output_filter`, prefix where to write documents
+            that pass the filter (in `documents/`) and, if `filtered_attributes`, their attributes (in
+            `attributes/<experiment>/`). Required if `output_filter` is provided.
+        filtered_attributes (bool, optional): With `output_filter`, whether to also write the attributes of
+            documents that pass the filter. Defaults to False.
         profile_enable (bool, optional): Whether to enable profiling. Defaults to False.
         profile_output (Optional[str], optional): Path to save the profiling output; if not provided, the
             output will be printed to stdout. Defaults to None.
@@ -429,7 +889,28 @@ def create_and_run_tagger(
     if taggers_modules is not None:
         import_modules(taggers_modules)
 
-    for tagger_name in taggers:
+    cascade = cascade or []
+    validate_cascade(taggers=taggers, cascade=cascade)
+
+    validate_sample_rate(sample_rate)
+
+    caps = caps or []
+    validate_caps(taggers=taggers, cascade_taggers=[stage.taggers for stage in cascade], caps=caps)
+
+    if output_filter is not None:
+        if filtered_destination is None:
+            raise DolmaConfigError("`filtered_destination` is required to filter documents after tagging.")
+        if destination is not None:
+            raise DolmaConfigError("`destination` can't be used with `output_filter`; use `filtered_destination`.")
+        if any(cap.policy == "defer" for cap in caps):
+            raise DolmaConfigError("Documents can't be deferred when filtering documents after tagging.")
+        if not output_filter.include and not output_filter.exclude:
+            raise DolmaConfigError("Either `include` or `exclude` must be specified to filter documents.")
+        output_filter.make_filter()
+    elif filtered_destination is not None:
+        raise DolmaConfigError("`filtered_destination` requires `output_filter`.")
+
+    for tagger_name in taggers + [tagger_name for stage in cascade for tagger_name in stage.taggers]:
         # instantiate the taggers here to make sure they are all valid + download any necessary resources
         tagger = TaggerRegistry.get(tagger_name)
 
@@ -442,6 +923,19 @@ def create_and_run_tagger(
     elif experiment is None:
         experiment = EXPERIMENT_PLACEHOLDER_NAME
 
+    # in fused mode, the processor writes documents that pass the filter; attributes have their own prefixes
+    documents_destination: Optional[List[str]] = None
+    if filtered_destination is not None:
+        try:
+            documents_destination = _make_paths_from_prefix(
+                documents, join_path(None, filtered_destination, "documents")
+            )
+            destination = _make_paths_from_prefix(
+                documents, join_path(None, filtered_destination, "attributes", experiment)
+            )
+        except Exception as exp:
+            raise RuntimeError(f"Could not make destination paths from prefix {filtered_destination}") from exp
+
     if destination is None:
         try:
             destination = _make_paths_from_substitution(documents, "documents", f"attributes/{experiment}")
@@ -462,13 +956,21 @@ def create_and_run_tagger(
 
         tagger_processor = TaggerProcessor(
             source_prefix=documents,
-            destination_prefix=destination,
+            destination_prefix=documents_destination or destination,
             metadata_prefix=metadata,
             debug=debug or profile_enable,  # if profile is true, debug must be true
             seed=seed,
             ignore_existing=ignore_existing,
             retries_on_error=retries_on_error,
             num_processes=num_processes,
+            process_single_kwargs=(
+                [
+                    {"documents_prefix": d, "attributes_prefix": a}
+                    for d, a in zip(documents_destination, destination)
+                ]
+                if documents_destination is not None
+                else None
+            ),
         )
 
         with ExitStack() as stack:
@@ -486,4 +988,196 @@ def create_and_run_tagger(
                 taggers_modules=taggers_modules,
                 skip_on_failure=skip_on_failure,
                 steps=profile_steps,
+                batch_size=batch_size,
+                cascade=cascade,
+                caps=caps,
+                sample_rate=sample_rate,
+                output_filter=output_filter,
+                filtered_attributes=filtered_attributes,
+            )
+
+            # documents deferred by caps are tagged after the main pass, with fewer processes; we only pick up the
+            # deferred files of this run's destinations, not those other runs left under the same prefixes.
+            deferred_paths: List[str] = []
+            if any(cap.policy == "defer" for cap in caps):
+                run_destinations = set(tagger_processor._get_all_paths(ignore_existing=True).dst)
+                deferred_paths = sorted(
+                    set(
+                        path
+                        for prefix in destination
+                        for path in glob_path(prefix, recursive_dirs=True, yield_dirs=False)
+                        if path.endswith(DEFERRED_SUFFIX) and path[: -len(DEFERRED_SUFFIX)] in run_destinations
+                    )
+                )
+            if deferred_paths:
+                deferred_processor = DeferredTaggerProcessor(
+                    source_prefix=deferred_paths,
+                    destination_prefix=[parent(path) for path in deferred_paths],
+                    metadata_prefix=[tempfile.mkdtemp()] * len(deferred_paths),
+                    debug=debug or profile_enable,
+                    seed=seed,
+                    ignore_existing=True,
+                    retries_on_error=retries_on_error,
+                    num_processes=deferred_processes,
+                )
+                deferred_processor(
+                    experiment_name=experiment,
+                    taggers_names=[t for cap in caps if cap.policy == "defer" for t in cap.taggers],
+                    taggers_modules=taggers_modules,
+                    batch_size=batch_size,
+                )
+
+
+class _StreamTagger:
+    """Taggers (and cascade) to tag batches of documents in memory; see `tag_stream`."""
+
+    def __init__(
+        self,
+        taggers_names: List[str],
+        taggers_modules: Optional[List[str]],
+        experiment: Optional[str],
+        cascade: List[CascadeStage],
+        caps: List[TaggerCap],
+        batch_size: int,
+    ):
+        if taggers_modules is not None:
+            import_modules(taggers_modules)
+
+        self.taggers = {make_variable_name(t): TaggerRegistry.get(t)() for t in taggers_names}
+        self.cascade = [
+            (stage.make_filter(), {make_variable_name(t): TaggerRegistry.get(t)() for t in stage.taggers})
+            for stage in cascade
+        ]
+        self.caps = {make_variable_name(t): cap for cap in caps for t in cap.taggers}
+        self.batch_size = batch_size
+
+        # attributes are named as they would be in attributes files; there are no paths, so destination is empty
+        all_taggers = [*self.taggers, *(name for _, stage in self.cascade for name in stage)]
+        self.taggers_paths = _determine_output_paths_for_taggers(
+            experiment_name=experiment or EXPERIMENT_PLACEHOLDER_NAME, destination="", taggers=all_taggers
+        )
+
+    def __call__(self, rows: List[InputSpec]) -> List[Tuple[str, Dict[str, TaggerOutputType]]]:
+        taggers_outputs, _ = _run_taggers(
+            rows=rows,
+            taggers=self.taggers,
+            cascade=self.cascade,
+            caps=self.caps,
+            taggers_paths=self.taggers_paths,
+            batch_size=self.batch_size,
+        )
+        return [
+            (
+                row.id,
+                {
+                    _make_attribute_name(self.taggers_paths[tagger_name], key): value
+                    for tagger_name, tagger_outputs in taggers_outputs.items()
+                    for key, value in tagger_outputs[i].items()
+                },
             )
+            for i, row in enumerate(rows)
+        ]
+
+
+# taggers of the current `tag_stream` worker process; they are created once, when the worker starts.
+_stream_tagger: Optional[_StreamTagger] = None
+
+
+def _init_stream_worker(*args: Any) -> None:
+    global _stream_tagger
+    _stream_tagger = _StreamTagger(*args)
+
+
+def _tag_stream_batch(rows: List[InputSpec]) -> List[Tuple[str, Dict[str, TaggerOutputType]]]:
+    assert _stream_tagger is not None, "Stream worker has not been initialized, this is a bug! Please report it."
+    return _stream_tagger(rows)
+
+
+def _make_input_spec(doc: Union[InputSpec, Dict[str, Any]]) -> InputSpec:
+    if isinstance(doc, InputSpec):
+        return doc
+    return InputSpecWithMetadata(**{k: doc[k] for k in InputSpecWithMetadata.__struct_fields__ if k in doc})
+
+
+def tag_stream(
+    documents: Iterable[Union[InputSpec, Dict[str, Any]]],
+    taggers: List[str],
+    taggers_modules: Optional[List[str]] = None,
+    experiment: Optional[str] = None,
+    num_workers: int = 1,
+    batch_size: int = 1,
+    max_in_flight: Optional[int] = None,
+    cascade: Optional[List[CascadeStage]] = None,
+    caps: Optional[List[TaggerCap]] = None,
+) -> Generator[Tuple[str, Dict[str, TaggerOutputType]], None, None]:
+    """Tag documents in memory, without reading or writing files; yields the id and attributes of each document,
+    in the same order as `documents`.
+
+    Args:
+        documents (Iterable[Union[InputSpec, Dict[str, Any]]]): Documents to tag, either as `InputSpec` or as
+            dictionaries with the same fields (e.g., rows of a documents file); documents are only read as
+            results are consumed, so this can be an unbounded stream.
+        taggers (List[str]): List of taggers to run. Each element of the list is the name of a tagger.
+        taggers_modules (Optional[List[str]], optional): Additional modules to import taggers from.
+        experiment (Optional[str], optional): Name of the experiment, used to prefix the names of attributes as in
+            attributes files. If not provided, the name of each tagger is used.
+        num_workers (int, optional): Number of worker processes; each creates the taggers once, when it starts.
+            If 0, documents are tagged in the current process. Defaults to 1.
+        batch_size (int, optional): Number of documents sent to a worker, and passed to each tagger, at once.
+            Defaults to 1.
+        max_in_flight (Optional[int], optional): Maximum number of batches being tagged at once; reading of
+            `documents` pauses when this many batches have not been consumed yet. Defaults to twice the number
+            of workers.
+        cascade (Optional[List[CascadeStage]], optional): Stages of taggers that only run on documents that
+            pass a filter; see `create_and_run_tagger`. Defaults to None (no cascade).
+        caps (Optional[List[TaggerCap]], optional): Limits on the size of documents some taggers process; the
+            `defer` policy is not supported. Defaults to None (no caps).
+    """
+    if taggers_modules is not None:
+        import_modules(taggers_modules)
+
+    cascade = cascade or []
+    validate_cascade(taggers=taggers, cascade=cascade)
+
+    caps = caps or []
+    validate_caps(taggers=taggers, cascade_taggers=[stage.taggers for stage in cascade], caps=caps)
+    if any(cap.policy == "defer" for cap in caps):
+        raise DolmaConfigError("Documents cannot be deferred when tagging a stream; use `truncate` or `sample`")
+
+    # workers create the taggers when they start; if that fails, the pool keeps starting new workers forever,
+    # so we make sure all taggers exist before starting any.
+    for tagger_name in taggers + [tagger_name for stage in cascade for tagger_name in stage.taggers]:
+        TaggerRegistry.get(tagger_name)
+
+    batch_size = max(batch_size, 1)
+    worker_args = (taggers, taggers_modules, experiment, cascade, caps, batch_size)
+
+    def _make_batches() -> Generator[List[InputSpec], None, None]:
+        batch: List[InputSpec] = []
+        for doc in documents:
+            batch.append(_make_input_spec(doc))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if num_workers < 1:
+        stream_tagger = _StreamTagger(*worker_args)
+        for batch in _make_batches():
+            yield from stream_tagger(batch)
+        return
+
+    max_in_flight = max(max_in_flight or 2 * num_workers, 1)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=num_workers, initializer=_init_stream_worker, initargs=worker_args) as pool:
+        # results of batches sent to workers, in order; when there are `max_in_flight` of them, we wait for the
+        # oldest one before reading more documents, so that slow consumers don't cause unbounded memory use
+        in_flight: Deque[AsyncResult] = deque()
+        for batch in _make_batches():
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().get()
+            in_flight.append(pool.apply_async(_tag_stream_batch, (batch,)))
+
+        while in_flight:
+            yield from in_flight.popleft().get()
@@ -0,0 +1,90 @@
+"""
+Deterministic sampling of documents by id, used to tag a fraction of a corpus to get quick estimates of the
+distribution of attributes. Documents are selected using a hash of their id, so the same documents are selected
+across runs and taggers. Attributes files written for a sample have a sidecar file (same name, plus
+`SAMPLE_SUFFIX`) that records how many documents were sampled; `dolma stat` uses it to extrapolate counts.
+"""
+
+import hashlib
+from typing import Generator, Iterable, Optional
+
+import msgspec
+import smart_open
+
+from .errors import DolmaConfigError
+from .paths import delete_file, exists
+
+__all__ = [
+    "SAMPLE_SUFFIX",
+    "SampleSpec",
+    "is_sampled",
+    "read_sample_spec",
+    "remove_sample_spec",
+    "sample_lines",
+    "validate_sample_rate",
+    "write_sample_spec",
+]
+
+
+SAMPLE_SUFFIX = ".sample.json"
+
+
+class SampleSpec(msgspec.Struct):
+    """Sidecar of an attributes file written for a sample: the sampling rate, the number of documents in the
+    source file, and the number of documents sampled (i.e., the rows in the attributes file)."""
+
+    sample_rate: float
+    documents: int = 0
+    sampled: int = 0
+
+    @property
+    def weight(self) -> float:
+        """How many documents in the source file each sampled document accounts for."""
+        return self.documents / self.sampled if self.sampled else 1.0
+
+
+class _IdSpec(msgspec.Struct):
+    id: str
+
+
+def validate_sample_rate(sample_rate: Optional[float]) -> None:
+    if sample_rate is not None and not 0.0 < sample_rate <= 1.0:
+        raise DolmaConfigError(f"Sample rate must be in (0, 1], got {sample_rate}")
+
+
+def is_sampled(doc_id: str, sample_rate: float) -> bool:
+    """Whether a document is in the sample: the first 8 bytes of the md5 of its id, as a fraction of 2**64, are
+    less than `sample_rate`. Unlike `hash`, this is stable across processes and Python versions."""
+    digest = hashlib.md5(doc_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") < sample_rate * 2**64
+
+
+def sample_lines(lines: Iterable[str], spec: SampleSpec) -> Generator[str, None, None]:
+    """Yield the lines of a documents file that are in the sample; only the id of each line is decoded, so lines
+    that are not sampled are cheap to skip. `spec` is updated with the number of documents seen and sampled."""
+    decoder = msgspec.json.Decoder(_IdSpec)
+    for line in lines:
+        spec.documents += 1
+        if is_sampled(decoder.decode(line).id, spec.sample_rate):
+            spec.sampled += 1
+            yield line
+
+
+def write_sample_spec(path: str, spec: SampleSpec) -> None:
+    """Write the sidecar of the attributes file at `path`."""
+    with smart_open.open(f"{path}{SAMPLE_SUFFIX}", "wt", encoding="utf-8") as f:
+        f.write(msgspec.json.encode(spec).decode("utf-8") + "\n")
+
+
+def remove_sample_spec(path: str) -> None:
+    """Remove the sidecar of the attributes file at `path`, if any; used when the file is written for all
+    documents, so counts of an earlier sample are not extrapolated."""
+    delete_file(f"{path}{SAMPLE_SUFFIX}", ignore_missing=True)
+
+
+def read_sample_spec(path: str) -> Optional[SampleSpec]:
+    """Read the sidecar of the attributes file at `path`, if the file was written for a sample."""
+    if not exists(sidecar_path := f"{path}{SAMPLE_SUFFIX}"):
+        return None
+    with smart_open.open(sidecar_path, "rt", encoding="utf-8") as f:
+        return msgspec.json.decode(f.read(), type=SampleSpec)
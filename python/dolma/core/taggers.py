@@ -50,20 +50,38 @@ class BaseTagger:
             tagger_output.setdefault(span.type, []).append(output)
         return tagger_output
 
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        """Predict on a batch of documents; results must be in the same order as `docs`.
+        Taggers that can share work across documents (e.g., batched tokenization) should override this."""
+        return [self.predict(doc) for doc in docs]
+
     def tag(self, row: InputSpec) -> TaggerOutputDictType:
         """Internal function that is used by the tagger to get data"""
         doc = Document.from_spec(row)
         doc_result = self.predict(doc)
         return self.group_output(doc_result)
 
+    def tag_batch(self, rows: List[InputSpec]) -> List[TaggerOutputDictType]:
+        """Internal function that is used by the tagger to get data for a batch of rows"""
+        docs = [Document.from_spec(row) for row in rows]
+        return [self.group_output(doc_result) for doc_result in self.predict_batch(docs)]
+
 
 class BaseTaggerWithMetadata(BaseTagger):
     @abstractmethod
     def predict(self, doc: DocumentWithMetadata) -> DocResult:  # type: ignore
         raise NotImplementedError
 
+    def predict_batch(self, docs: List[DocumentWithMetadata]) -> List[DocResult]:  # type: ignore
+        return [self.predict(doc) for doc in docs]
+
     def tag(self, row: InputSpecWithMetadata) -> TaggerOutputDictType:
         """Internal function that is used by the tagger to get data"""
         doc = DocumentWithMetadata.from_spec(row)
         doc_result = self.predict(doc)
         return self.group_output(doc_result)
+
+    def tag_batch(self, rows: List[InputSpecWithMetadata]) -> List[TaggerOutputDictType]:
+        """Internal function that is used by the tagger to get data for a batch of rows"""
+        docs = [DocumentWithMetadata.from_spec(row) for row in rows]
+        return [self.group_output(doc_result) for doc_result in self.predict_batch(docs)]
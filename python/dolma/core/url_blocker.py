@@ -1,10 +1,19 @@
+import os
+import tempfile
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import List, Optional, Sequence, Union
 
 import smart_open
-import urllib3.util
 
 from .. import dolma as _dolma  # type: ignore   # noqa: E402
+from .blocklist import make_index_key
+from .loggers import get_logger
+from .paths import exists, get_cache_dir, join_path, mkdir_p
+
+LOGGER = get_logger(__name__)
+
+# name of the directory (inside the dolma cache directory) where compiled engines are stored
+ADBLOCK_ENGINE_DIR = "adblock"
 
 
 class UrlBlocker:
@@ -19,7 +28,9 @@ class UrlBlocker:
 
     Methods:
         from_adblockplus_filepath: Create an instance of UrlBlocker from an AdBlock Plus file.
+        from_serialized: Create an instance of UrlBlocker from a previously serialized engine.
         check_network_urls: Check if a given URL should be blocked based on the rules.
+        check_many: Check if each URL in a list should be blocked based on the rules.
 
     """
 
@@ -36,26 +47,78 @@ class UrlBlocker:
         """
         self.engine = _dolma.UrlBlocker(rules=rules)
 
+    @classmethod
+    def from_serialized(cls, data: bytes) -> "UrlBlocker":
+        """
+        Create an instance of UrlBlocker from an engine serialized with `serialize`.
+
+        Args:
+            data (bytes): The serialized engine.
+
+        Returns:
+            UrlBlocker: An instance of UrlBlocker; rules are not parsed again.
+
+        """
+        blocker = cls.__new__(cls)
+        blocker.engine = _dolma.UrlBlocker.deserialize(data)
+        return blocker
+
+    def serialize(self) -> bytes:
+        """
+        Serialize the compiled engine to bytes.
+
+        Returns:
+            bytes: The serialized engine; use `from_serialized` to load it.
+
+        """
+        return self.engine.serialize()
+
     @classmethod
     def from_adb_paths(
         cls,
         *file_paths: Union[str, Path],
+        cache: bool = True,
     ) -> "UrlBlocker":
         """
         Create an instance of UrlBlocker from one or more AdBlock Plus files.
 
         Args:
             file_paths (Union[str, Path]): The filepath of the AdBlock Plus file.
+            cache (bool): Whether to cache the compiled engine in the dolma cache directory. If a cached engine
+                is found, it is deserialized instead of compiling the rules again. Defaults to True.
 
         Returns:
             UrlBlocker: An instance of UrlBlocker created from the AdBlock Plus file.
 
         """
+        cache_path: Optional[str] = None
+        if cache:
+            key = make_index_key(name=cls.__name__, paths=[str(fp) for fp in file_paths])
+            cache_path = join_path("", get_cache_dir(), ADBLOCK_ENGINE_DIR, f"{key}.dat")
+
+        if cache_path is not None and exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    LOGGER.info(f"Using cached adblock engine {cache_path}")
+                    return cls.from_serialized(f.read())
+            except ValueError:
+                # this happens if the engine was serialized by a different version of the adblock library
+                LOGGER.warning(f"Could not load cached adblock engine {cache_path}; rebuilding it")
+
         rules = []
         for fp in file_paths:
             with smart_open.open(fp, "rt") as adb_file:
                 rules.extend([ln.strip() for ln in adb_file if not ln.startswith("!")])
-        return cls(sorted(set(rules)))
+        blocker = cls(sorted(set(rules)))
+
+        if cache_path is not None:
+            # write to a temporary file first, so that workers never read a partially written engine
+            mkdir_p(os.path.dirname(cache_path))
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), delete=False) as tmp:
+                tmp.write(blocker.serialize())
+            os.replace(tmp.name, cache_path)
+
+        return blocker
 
     def check_network_urls(
         self,
@@ -67,7 +130,7 @@ class UrlBlocker:
         Check if a given URL should be blocked based on the rules.
 
         Args:
-            url (str): The URL to be checked.
+            url (str): The URL to be checked. If the URL does not have a scheme, it is assumed to be an HTTP URL.
             source_url (str): The source URL of the request. If not provided, the host from the URL will be used.
             request_type (str): The type of the request. For a list of valid request types, see the adblockplus
                 documentation: https://help.adblockplus.org/hc/en-us/articles/360062733293-How-to-write-filters
@@ -76,17 +139,35 @@ class UrlBlocker:
             bool: True if the URL should be blocked, False otherwise.
 
         """
-        parsed = urllib3.util.parse_url(url)
-        if parsed.scheme is None:
-            # if the URL does not have a scheme, we assume it is an HTTP URL
-            url = f"http://{url}"
-
-        if source_url is None:
-            # if the source URL is not provided, we use the host from the URL
-            source_url = ""
-
         return self.engine.check_network_urls(
             url=str(url),
-            source_url=str(source_url),
+            source_url=str(source_url or ""),
+            request_type=request_type,
+        )
+
+    def check_many(
+        self,
+        urls: Sequence[str],
+        source_urls: Optional[Sequence[str]] = None,
+        request_type: str = "",
+    ) -> List[bool]:
+        """
+        Check if each URL in a list should be blocked based on the rules. URL parsing happens in Rust, and
+        the whole list is checked in a single call.
+
+        Args:
+            urls (Sequence[str]): The URLs to be checked. URLs without a scheme are assumed to be HTTP URLs.
+            source_urls (Sequence[str], optional): The source URL for each of the URLs. If not provided, the
+                host from each URL will be used.
+            request_type (str): The type of the requests; see `check_network_urls`.
+
+        Returns:
+            List[bool]: For each URL, True if it should be blocked, False otherwise. URLs that cannot be parsed
+                are never blocked.
+
+        """
+        return self.engine.check_many(
+            urls=[str(url) for url in urls],
+            source_urls=None if source_urls is None else [str(u or "") for u in source_urls],
             request_type=request_type,
         )
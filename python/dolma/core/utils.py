@@ -4,7 +4,7 @@ import os
 import re
 import string
 import sys
-from typing import List, Union, cast
+from typing import List, Optional, Sequence, Tuple, Union, cast
 
 try:
     import blingfire
@@ -27,6 +27,7 @@ except LookupError:
     nltk.download("punkt")
 
 
+from .. import dolma as _dolma  # type: ignore   # noqa: E402
 from .data_types import TextSlice
 from .loggers import get_logger
 
@@ -62,6 +63,39 @@ def split_words(text: str, remove_empty: bool = True) -> List[TextSlice]:
     return text_slices
 
 
+def count_words(
+    text: str,
+    ranges: Optional[Sequence[Tuple[int, int]]] = None,
+    skip_whitespace: bool = False,
+) -> Tuple[int, List[int]]:
+    """
+    Count words in a string, and in ranges of the same string, as defined by the unicode standard.
+    For more info, see https://www.unicode.org/reports/tr29/
+
+    Words are counted by the native extension, which is much faster than iterating over `uniseg.wordbreak.words`;
+    counts are the same as uniseg's, except for rare sequences of punctuation followed by a zero-width joiner and
+    an emoji. The text and each range are stripped of leading and trailing whitespace before counting, like
+    `str.strip()` does.
+
+    Args:
+        text (str): The text to count words in.
+        ranges (Sequence[Tuple[int, int]], optional): Start and end character offsets of spans of `text`
+            (e.g., paragraphs) to count words in. Defaults to None.
+        skip_whitespace (bool): Whether to ignore words that only contain whitespace. Defaults to False.
+
+    Returns:
+        Tuple[int, List[int]]: The number of words in `text`, and the number of words in each range.
+    """
+    try:
+        return _dolma.count_words(text, ranges, skip_whitespace)
+    except UnicodeEncodeError:
+        # text contains lone surrogates, which cannot be passed to the native extension
+        def _count(t: str) -> int:
+            return sum(1 for w in uniseg.wordbreak.words(t.strip()) if not skip_whitespace or w.strip())
+
+        return _count(text), [_count(text[start:end]) for start, end in ranges or []]
+
+
 def split_paragraphs(text: str, remove_empty: bool = True) -> List[TextSlice]:
     """
     Split a string into paragraphs. A paragraph is defined as a sequence of zero or more characters, followed
@@ -1,16 +1,125 @@
-from . import (
-    c4,
-    code,
-    gopher,
-    jigsaw,
-    language,
-    length,
-    licenses,
-    pii,
-    punctuation,
-    quality,
-    repetitions,
-    sampling,
-    tokenizers,
-    url,
-)
+"""
+Built-in taggers.
+
+Taggers are added to the registry lazily: importing this package only records the name of each tagger and
+the module and class implementing it; the module is imported the first time the tagger is requested with
+`TaggerRegistry.get`. This way, running a tagger does not require importing the dependencies of all others
+(fastText, presidio, detect-secrets, etc.).
+
+When adding a new tagger to one of the modules in this package, also add it to `BUILTIN_TAGGERS` below;
+`tests/python/test_registry.py` checks that the two are in sync.
+
+Taggers from other packages can be added to the registry via the `dolma.taggers` entry point group, e.g.:
+
+    [project.entry-points."dolma.taggers"]
+    my_tagger_v1 = "my_package.taggers:MyTagger"
+"""
+
+from typing import Dict
+
+from ..core.registry import TaggerRegistry
+
+# name of each tagger -> module:Class implementing it
+BUILTIN_TAGGERS: Dict[str, str] = {
+    "allowlist_wikidata_cleaned_v1": "dolma.taggers.url:AllowlistWikidataCleanedTagger",
+    "allowlist_wikidata_v1": "dolma.taggers.url:AllowlistWikidataTagger",
+    "blocklist_firebog_ads_v1": "dolma.taggers.url:BlocklistFirebogAdsTagger",
+    "blocklist_firebog_crypto_v1": "dolma.taggers.url:BlocklistFirebogCryptoTagger",
+    "blocklist_firebog_malicious_v1": "dolma.taggers.url:BlocklistFirebogMaliciousTagger",
+    "blocklist_firebog_nsfw_v1": "dolma.taggers.url:BlocklistFirebogNsfwTagger",
+    "blocklist_firebog_social_v1": "dolma.taggers.url:BlocklistFirebogSocialTagger",
+    "blocklist_firebog_suspicious_v1": "dolma.taggers.url:BlocklistFirebogSuspiciousTagger",
+    "blocklist_firebog_trackers_v1": "dolma.taggers.url:BlocklistFirebogTrackersTagger",
+    "blocklist_hosts_adware_malware_v1": "dolma.taggers.url:BlocklistHostsAdwareMalwareTagger",
+    "blocklist_hosts_fakenews_v1": "dolma.taggers.url:BlocklistHostsFakenewsTagger",
+    "blocklist_hosts_gambling_v1": "dolma.taggers.url:BlocklistHostsGamblingTagger",
+    "blocklist_hosts_porn_v1": "dolma.taggers.url:BlocklistHostsPornTagger",
+    "blocklist_hosts_social_v1": "dolma.taggers.url:BlocklistHostsSocialTagger",
+    "blocklist_project_ads_v1": "dolma.taggers.url:BlocklistProjectAdsTagger",
+    "blocklist_project_crime_v1": "dolma.taggers.url:BlocklistProjectCrimeTagger",
+    "blocklist_project_nsfw_v1": "dolma.taggers.url:BlocklistProjectNsfwTagger",
+    "blocklist_project_social_v1": "dolma.taggers.url:BlocklistProjectSocialTagger",
+    "blocklist_project_vice_v1": "dolma.taggers.url:BlocklistProjectViceTagger",
+    "brave_core_abp_v1": "dolma.taggers.url:BraveCoreAdblockPlusTagger",
+    "brave_nsfw_abp_v1": "dolma.taggers.url:BraveNSFWAdblockPlusTagger",
+    "bytes_length_v1": "dolma.taggers.length:BytesLengthV1",
+    "c4_v1": "dolma.taggers.c4:C4Tagger",
+    "c4_v2": "dolma.taggers.c4:FasterC4Tagger",
+    "cc_re": "dolma.taggers.licenses:CreativeCommonsRegexLicenseExtractor",
+    "cc_re_fast": "dolma.taggers.licenses:CreativeCommonsFastRegexHtmlExtractor",
+    "char_length_strip_ws_v1": "dolma.taggers.length:CharLengthStripWsV1",
+    "char_length_v1": "dolma.taggers.length:CharLengthV1",
+    "char_length_with_paragraphs_v1": "dolma.taggers.length:CharLengthWithParagraphsV1",
+    "cld2_doc_v2": "dolma.taggers.language:Cld2LanguageTagger",
+    "cld2_en_doc_v2": "dolma.taggers.language:Cld2EnglishLanguageTagger",
+    "cld2_en_paragraph_v2": "dolma.taggers.language:Cld2EnglishLanguageParagraphTagger",
+    "cld2_en_paragraph_with_doc_score_v2": "dolma.taggers.language:Cld2LanguageFilterParagraphWithDocScoreTagger",
+    "cld2_paragraph_v2": "dolma.taggers.language:Cld2LanguageTaggerParagraph",
+    "cld3_en_doc_v2": "dolma.taggers.language:Cld3LanguageTagger",
+    "cld3_en_paragraph_v2": "dolma.taggers.language:Cld3LanguageTaggerParagraph",
+    "cld3_en_paragraph_with_doc_score_v2": "dolma.taggers.language:Cld3LanguageFilterParagraphWithDocScoreTagger",
+    "code_copyright_comments_v1": "dolma.taggers.code.code_taggers:CodeCopyrightTagger",
+    "code_redpajama_taggers_v1": "dolma.taggers.code.code_taggers:CodeRedPajamaTaggers",
+    "code_secrets_v1": "dolma.taggers.code.code_taggers:CodeSecretsTagger",
+    "code_starcoder_taggers_v1": "dolma.taggers.code.code_taggers:CodeStarCoderTaggers",
+    "code_starcoder_taggers_v2": "dolma.taggers.code.code_taggers:CodeStarCoderTaggers2",
+    "dclm-oh-eli5": "dolma.taggers.quality:DclmQualityClassifier",
+    "doc_count_v1": "dolma.taggers.length:DocCountLengthV1",
+    "dolma17-quality": "dolma.taggers.quality:Dolma17QualityClassifier",
+    "dolma_v1_tokenizer": "dolma.taggers.length:DolmaV1Tokenizer",
+    "dolma_v2_tokenizer": "dolma.taggers.length:DolmaV2Tokenizer",
+    "domain_blocklist_phishing_v1": "dolma.taggers.url:DomainBlocklistPhishingTagger",
+    "domain_blocklist_utp_v1": "dolma.taggers.url:DomainBlocklistUniversiteToulouseCapitoleTagger",
+    "ft_lang_id_1e2": "dolma.taggers.language:FastTextAllLanguagesDocumentMinScoreTagger",
+    "ft_lang_id_doc_v1": "dolma.taggers.language:FastTextAllLanguagesDocumentTagger",
+    "ft_lang_id_en_doc_v2": "dolma.taggers.language:FastTextEnglishLanguageDocumentTagger",
+    "ft_lang_id_en_only_v2": "dolma.taggers.language:FastTextEnglishOnlyLanguageDocumentTagger",
+    "ft_lang_id_en_paragraph_v2": "dolma.taggers.language:FastTextEnglishLanguageParagraphTagger",
+    "ft_lang_id_en_paragraph_with_doc_score_v2": "dolma.taggers.language:FastTextEnglishLanguageParagraphWithDocScoreTagger",
+    "ft_lang_id_paragraph_v1": "dolma.taggers.language:FastTextAllLanguageParagraphTagger",
+    "gopher_v1": "dolma.taggers.gopher:GopherTagger",
+    "gopher_v2": "dolma.taggers.gopher:GopherTaggerV2",
+    "jigsaw_hatespeech_document_v2": "dolma.taggers.jigsaw:FastTextJigsawHatespeechDocumentTagger",
+    "jigsaw_hatespeech_sentence_v2": "dolma.taggers.jigsaw:FastTextJigsawHatespeechSentenceTagger",
+    "jigsaw_nsfw_document_v1": "dolma.taggers.jigsaw:FastTextJigsawNsfwDocumentTagger",
+    "jigsaw_nsfw_sencence_v2": "dolma.taggers.jigsaw:FastTextJigsawNsfwSentenceTagger",
+    "langdetect_doc_en_v1": "dolma.taggers.language:LangdetectEnglishTagger",
+    "langdetect_doc_v1": "dolma.taggers.language:LangdetectTagger",
+    "langdetect_en_paragraph_v1": "dolma.taggers.language:LangdetectEnglishTaggerParagraph",
+    "langdetect_paragraph_v1": "dolma.taggers.language:LangdetectTaggerParagraph",
+    "lingua_1e2": "dolma.taggers.language:LinguaMinScoreTagger",
+    "lingua_doc_en_v1": "dolma.taggers.language:LinguaEnglishTagger",
+    "lingua_doc_v1": "dolma.taggers.language:LinguaTagger",
+    "lingua_en_only_v1": "dolma.taggers.language:LinguaEnglishOnlyTagger",
+    "lingua_en_par_v1": "dolma.taggers.language:LinguaEnglishTaggerParagraph",
+    "lingua_par_v1": "dolma.taggers.language:LinguaTaggerParagraph",
+    "link_blocklist_phishing_v1": "dolma.taggers.url:LinkBlocklistPhishingTagger",
+    "not_alphanum_paragraph_v1": "dolma.taggers.punctuation:NotAlphanumParagraphV1",
+    "oisd_big_abp_v1": "dolma.taggers.url:OISDBigAdblockPlusTagger",
+    "oisd_nsfw_abp_v1": "dolma.taggers.url:OISDNSFWAdblockPlusTagger",
+    "oisd_small_abp_v1": "dolma.taggers.url:OISDSmallAdblockPlusTagger",
+    "olmo_pretokenizer_v1": "dolma.taggers.length:OlmoPreTokenizerV1",
+    "olmo_pretokenizer_with_paragraphs_v1": "dolma.taggers.length:OlmoPreTokenizerParagraphsV1",
+    "paragraph_repetitions_v1": "dolma.taggers.repetitions.repetitions_taggers:ParagraphRepetitionsTagger",
+    "paragraph_tokenizer_repetitions_v1": "dolma.taggers.repetitions.repetitions_taggers:ParagraphTokenizerRepetitionsTagger",
+    "pii_presidio_v1": "dolma.taggers.pii:PiiPresidioV1",
+    "pii_regex_v1": "dolma.taggers.pii:PiiRegexV1",
+    "pii_regex_v2": "dolma.taggers.pii:PiiRegexV2",
+    "pii_regex_with_counts_fast_v2": "dolma.taggers.pii:FastPiiRegex",
+    "pii_regex_with_counts_v2": "dolma.taggers.pii:PiiRegexWithCountV2",
+    "random_number_v1": "dolma.taggers.sampling:RandomNumberTagger",
+    "repetitions_v1": "dolma.taggers.repetitions.repetitions_taggers:RepetitionsTagger",
+    "tokenizer_repetitions_v1": "dolma.taggers.repetitions.repetitions_taggers:TokenizerRepetitionsTagger",
+    "tokenizer_repetitions_v2r2": "dolma.taggers.repetitions.repetitions_taggers:TokenizerRepetitionsSkipEmptyTagger",
+    "tokenizers_AI2_OLMo_v1": "dolma.taggers.tokenizers:OLMoV1Tokenizer",
+    "tokenizers_EleutherAI_GPT_NeoX_20B": "dolma.taggers.tokenizers:GPTNeoX20BTokenizer",
+    "uniseg_length_paragraphs_v1": "dolma.taggers.length:UnisegParagraphsV1",
+    "uniseg_length_paragraphs_with_doc_length_v1": "dolma.taggers.length:UnisegParagraphsWithDocLengthV1",
+    "uniseg_length_paragraphs_with_empty_v1": "dolma.taggers.length:UnisegParagraphsWithEmptyV1",
+    "uniseg_length_v1": "dolma.taggers.length:UnisegLengthV1",
+    "whitespace_tokenizer_v1": "dolma.taggers.length:WhitespaceLengthV1",
+    "whitespace_tokenizer_with_paragraphs_v1": "dolma.taggers.length:WhitespaceLengthParagraphsV1",
+}
+
+for _name, _entry_point in BUILTIN_TAGGERS.items():
+    TaggerRegistry.add_lazy(_name, _entry_point)
@@ -8,48 +8,134 @@ Utilities for code-related taggers.
 
 import json
 import logging
+import re
 from pathlib import Path
-from typing import Dict, Generator
+from typing import Dict, Generator, Iterable, List, Set
 
+import numpy as np
 import regex
 import smart_open
 from bs4 import BeautifulSoup  # pylint: disable=import-error
 from detect_secrets.core.potential_secret import PotentialSecret
-from detect_secrets.core.scan import _process_line_based_plugins
+from detect_secrets.core.scan import _is_filtered_out, _scan_line
 from detect_secrets.core.secrets_collection import SecretsCollection
 from detect_secrets.settings import default_settings, get_plugins
+from detect_secrets.util.code_snippet import get_code_snippet
 
 logger = logging.getLogger(__name__)
 
-
-def scan_code(code: str) -> Generator["PotentialSecret", None, None]:
+# Every secret reported by the default detect-secrets plugins, except for high entropy strings, is on a line that
+# contains one of these keywords (KeywordDetector, AWS, Azure, Cloudant, IBM, Softlayer, NPM, private keys, Slack)
+# or token prefixes (Artifactory, AWS, Basic Auth, Discord, GitHub, JWT, Mailchimp, SendGrid, Square, Stripe,
+# Twilio). The keywords part is case insensitive, like the plugins that use it.
+SECRETS_PREFILTER_REGEX = re.compile(
+    r"(?i:key|pass|pw|secret|token|contrase|aws|cloudant|softlayer|xox)"
+    r"|://|eyJ|AKIA|AKC|AP[\dA-F]|gh[pousr]_|SG\.|sq0csp|[rs]k_live_|-us\d"
+    r"|[MN][a-zA-Z\d_-]{23}\.|(?:AC|SK)[a-z0-9]{32}"
+)
+
+# High entropy strings are quoted runs of base64 or hex characters (hex is a subset of base64). A hex string needs
+# at least 9 distinct characters to have entropy above 3.0, the lowest limit of the default high entropy plugins.
+HIGH_ENTROPY_TOKEN_REGEX = re.compile(r"[A-Za-z0-9+/\\\-_=]{9,}")
+HIGH_ENTROPY_PREFILTER_LIMIT = 3.0
+
+
+def find_high_entropy_lines(lines: List[str], limit: float = HIGH_ENTROPY_PREFILTER_LIMIT) -> Set[int]:
+    """Find indices of lines with at least one token whose Shannon entropy is above `limit`.
+
+    Entropy of all tokens in all lines is computed at once: characters of each token are counted with a
+    single `np.unique` over (token, character) pairs."""
+    tokens: List[str] = []
+    tokens_lines: List[int] = []
+    for i, line in enumerate(lines):
+        if "'" not in line and '"' not in line:
+            # the high entropy plugins only look at quoted strings
+            continue
+        for token in HIGH_ENTROPY_TOKEN_REGEX.findall(line):
+            tokens.append(token)
+            tokens_lines.append(i)
+
+    if not tokens:
+        return set()
+
+    lengths = np.array([len(token) for token in tokens])
+    chars = np.frombuffer("".join(tokens).encode("ascii"), dtype=np.uint8).astype(np.int64)
+    tokens_ids = np.repeat(np.arange(len(tokens)), lengths)
+
+    pairs, counts = np.unique(tokens_ids * 128 + chars, return_counts=True)
+    pairs_tokens = pairs // 128
+    probs = counts / lengths[pairs_tokens]
+    entropy = np.bincount(pairs_tokens, weights=-probs * np.log2(probs), minlength=len(tokens))
+
+    # small tolerance, since the plugins sum probabilities in a different order
+    return {tokens_lines[i] for i in np.flatnonzero(entropy > limit - 1e-9)}
+
+
+def find_candidate_secrets_lines(lines: List[str]) -> List[int]:
+    """Find indices of lines that could contain a secret according to the default detect-secrets plugins;
+    all other lines are guaranteed to produce no secrets."""
+    candidates = find_high_entropy_lines(lines)
+    candidates.update(i for i, line in enumerate(lines) if SECRETS_PREFILTER_REGEX.search(line))
+    return sorted(candidates)
+
+
+def _process_lines(
+    lines: List[str], line_numbers: Iterable[int], filename: str
+) -> Generator["PotentialSecret", None, None]:
+    """Same as `detect_secrets.core.scan._process_line_based_plugins`, but only scans lines in `line_numbers`
+    (1-indexed). Code snippets are still built from all lines, so filters that look at context (e.g., allowlist
+    comments on the previous line) behave as if all lines were scanned."""
+    for line_number in line_numbers:
+        line = lines[line_number - 1].rstrip()
+        code_snippet = get_code_snippet(lines=lines, line_number=line_number)
+
+        if _is_filtered_out(
+            required_filter_parameters=["line"], filename=filename, line=line, context=code_snippet
+        ):
+            continue
+
+        yield from (
+            secret
+            for plugin in get_plugins()
+            for secret in _scan_line(
+                plugin=plugin, filename=filename, line=line, line_number=line_number, context=code_snippet
+            )
+            if not _is_filtered_out(
+                required_filter_parameters=["context"],
+                filename=secret.filename,
+                secret=secret.secret_value,
+                plugin=plugin,
+                line=line,
+                context=code_snippet,
+            )
+        )
+
+
+def scan_code(code: str, prefilter: bool = True) -> Generator["PotentialSecret", None, None]:
     if not get_plugins():
         logger.error("No plugins to scan with!")
         return
 
-    has_secret = False
-    for lines in [code.splitlines()]:
-        for secret in _process_line_based_plugins(
-            lines=list(enumerate(lines, start=1)),
-            filename="code_str.yml",
-        ):
-            has_secret = True
-            yield secret
+    lines = code.splitlines()
+    if prefilter:
+        # only lines that could contain a secret are scanned by the (slow) detect-secrets plugins
+        line_numbers = [i + 1 for i in find_candidate_secrets_lines(lines)]
+    else:
+        line_numbers = list(range(1, len(lines) + 1))
 
-        if has_secret:
-            break
+    yield from _process_lines(lines=lines, line_numbers=line_numbers, filename="code_str.yml")
 
 
 class SecretsCollectionForStringInput(SecretsCollection):
-    def scan_str(self, code_str: str):
-        for secret in scan_code(code_str):
+    def scan_str(self, code_str: str, prefilter: bool = True):
+        for secret in scan_code(code_str, prefilter=prefilter):
             self["code_str.yml"].add(secret)
 
 
-def get_secrets(code: str):
+def get_secrets(code: str, prefilter: bool = True):
     secrets = SecretsCollectionForStringInput()
     with default_settings():
-        secrets.scan_str(code)
+        secrets.scan_str(code, prefilter=prefilter)
 
     return secrets
 
@@ -6,16 +6,25 @@ Filters.
 
 """
 
-from typing import Generator
+import os
+from typing import Generator, List
 
 import regex
 import uniseg.wordbreak
-from tokenizers import Regex, Tokenizer, pre_tokenizers
+from tokenizers import Regex, Tokenizer, models, pre_tokenizers
 
 from ..core.data_types import DocResult, Document, Span, TextSlice
 from ..core.registry import TaggerRegistry
 from ..core.taggers import BaseTagger
-from ..core.utils import split_paragraphs
+from ..core.utils import count_words, split_paragraphs
+
+# set this environment variable to "1" to count words in the uniseg taggers with the native word counter, which
+# is much faster than iterating over `uniseg.wordbreak.words`; see `dolma.core.utils.count_words`.
+NATIVE_WORD_COUNTER_ENV_VAR = "DOLMA_NATIVE_WORD_COUNTER"
+
+
+def use_native_word_counter() -> bool:
+    return os.environ.get(NATIVE_WORD_COUNTER_ENV_VAR, "").lower() in {"1", "true", "yes"}
 
 
 @TaggerRegistry.add("bytes_length_v1")
@@ -77,23 +86,41 @@ class WhitespaceLengthParagraphsV1(WhitespaceLengthV1):
 
 @TaggerRegistry.add("uniseg_length_v1")
 class UnisegLengthV1(BaseTagger):
+    def __init__(self) -> None:
+        self.native_word_counter = use_native_word_counter()
+
     def predict(self, doc: Document) -> DocResult:
-        score = sum(1 for _ in uniseg.wordbreak.words(text)) if (text := doc.text.strip()) else 0
+        if self.native_word_counter:
+            score, _ = count_words(doc.text)
+        else:
+            score = sum(1 for _ in uniseg.wordbreak.words(text)) if (text := doc.text.strip()) else 0
         return DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="length", score=score)])
 
 
 @TaggerRegistry.add("uniseg_length_paragraphs_v1")
 class UnisegParagraphsV1(BaseTagger):
+    def __init__(self) -> None:
+        self.native_word_counter = use_native_word_counter()
+
     def do_split_paragraphs(self, text: str) -> Generator[TextSlice, None, None]:
         for paragraph in split_paragraphs(text, remove_empty=True):
             yield paragraph
 
     def predict(self, doc: Document) -> DocResult:
         spans = []
+        paragraphs = list(self.do_split_paragraphs(doc.text))
 
-        for para in self.do_split_paragraphs(doc.text):
-            # we ignore whitespace-only tokens when counting words
-            para_length = sum(1 for w in uniseg.wordbreak.words(para.text.strip()) if w.strip())
+        # we ignore whitespace-only tokens when counting words
+        if self.native_word_counter:
+            _, paras_lengths = count_words(
+                doc.text, ranges=[(para.start, para.end) for para in paragraphs], skip_whitespace=True
+            )
+        else:
+            paras_lengths = [
+                sum(1 for w in uniseg.wordbreak.words(p.text.strip()) if w.strip()) for p in paragraphs
+            ]
+
+        for para, para_length in zip(paragraphs, paras_lengths):
             spans.append(Span(start=para.start, end=para.end, type="paragraph", score=para_length))
 
             # we have to record negative length because mixer can only work on greater than operations,
@@ -142,22 +169,38 @@ class OlmoPreTokenizerV1(BaseTagger):
             ]
         )
 
+        # maps every pre-token to a single (unknown) token; this way, we can count pre-tokens of many texts
+        # with `encode_batch`, which runs in parallel and does not create a python string for each pre-token.
+        self.pre_token_counter = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+        self.pre_token_counter.pre_tokenizer = self.pre_tokenizer
+
+    def count_pre_tokens(self, texts: List[str]) -> List[int]:
+        """Count pre-tokens in each text; same as `len(self.pre_tokenizer.pre_tokenize_str(text))`."""
+        return [len(encoding) for encoding in self.pre_token_counter.encode_batch(texts, add_special_tokens=False)]
+
     def predict(self, doc: Document) -> DocResult:
-        score = len(self.pre_tokenizer.pre_tokenize_str(doc.text))
-        return DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="length", score=score)])
+        return self.predict_batch([doc])[0]
+
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        return [
+            DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="length", score=score)])
+            for doc, score in zip(docs, self.count_pre_tokens([doc.text for doc in docs]))
+        ]
 
 
 @TaggerRegistry.add("olmo_pretokenizer_with_paragraphs_v1")
 class OlmoPreTokenizerParagraphsV1(OlmoPreTokenizerV1):
-    def predict(self, doc: Document) -> DocResult:
-        spans = [
-            Span(
-                start=p.start, end=p.end, type="paragraph", score=len(self.pre_tokenizer.pre_tokenize_str(p.text))
-            )
-            for p in split_paragraphs(doc.text)
-        ]
-        spans.append(Span(start=0, end=len(doc.text), type="document", score=sum(s.score for s in spans)))
-        return DocResult(doc=doc, spans=spans)
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        # paragraphs of all documents are counted together
+        docs_paragraphs = [split_paragraphs(doc.text) for doc in docs]
+        scores = iter(self.count_pre_tokens([p.text for paragraphs in docs_paragraphs for p in paragraphs]))
+
+        results: List[DocResult] = []
+        for doc, paragraphs in zip(docs, docs_paragraphs):
+            spans = [Span(start=p.start, end=p.end, type="paragraph", score=next(scores)) for p in paragraphs]
+            spans.append(Span(start=0, end=len(doc.text), type="document", score=sum(s.score for s in spans)))
+            results.append(DocResult(doc=doc, spans=spans))
+        return results
 
 
 @TaggerRegistry.add("dolma_v1_tokenizer")
@@ -172,6 +215,16 @@ class DolmaV1Tokenizer(BaseTagger):
         score = len(self.tokenizer.encode(text)) if (text := doc.text.strip()) else 0
         return DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="length", score=score)])
 
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        # only non-empty documents are tokenized; empty ones have a score of 0, like in `predict`.
+        texts = [doc.text.strip() for doc in docs]
+        encodings = iter(self.tokenizer.encode_batch([text for text in texts if text]))
+        scores = [len(next(encodings)) if text else 0 for text in texts]
+        return [
+            DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="length", score=score)])
+            for doc, score in zip(docs, scores)
+        ]
+
 
 @TaggerRegistry.add("dolma_v2_tokenizer")
 class DolmaV2Tokenizer(DolmaV1Tokenizer):
@@ -6,6 +6,7 @@ Filters.
 
 """
 
+import re
 from typing import Iterable, List, Tuple
 
 from tokenizers import normalizers, pre_tokenizers
@@ -14,6 +15,9 @@ from ..core.data_types import TextSlice
 from ..core.ft_tagger import BaseFastTextTagger, Prediction
 from ..core.registry import TaggerRegistry
 
+# characters that python's `str.split()` treats as whitespace, but `pre_tokenizers.WhitespaceSplit` does not
+INFO_SEPARATORS_REGEX = re.compile("[\x1c-\x1f]")
+
 
 @TaggerRegistry.add("dclm-oh-eli5")
 class DclmQualityClassifier(BaseFastTextTagger):
@@ -22,25 +26,31 @@ class DclmQualityClassifier(BaseFastTextTagger):
     def __init__(self):
         super().__init__(model_path=self.MODEL_PATH, model_mode=self.DOCUMENT_LEVEL_TAGGER)
 
-    def predict_slice(self, text_slice: TextSlice) -> Iterable[Prediction]:
-        # Note: This slice should always be the entire document
+    def preprocess(self, text: str) -> str:
+        """Clean the input text by joining all lines into a single string"""
+        return " ".join(text.strip().splitlines())
 
-        # Clean the input text by joining all lines into a single string
-        text = " ".join(text_slice.doc.strip().splitlines())
-        pred = self.classifier.predict(text)
+    def predict_slice(self, text_slice: TextSlice) -> Iterable[Prediction]:
+        return self.predict_slices([text_slice])[0]
 
-        # Extract the predicted label and its probability
-        (pred_label, pred_prob) = pred
-        pred_label = pred_label[0]
-        probability_score = pred_prob[0]
+    def predict_slices(self, text_slices: List[TextSlice]) -> List[Iterable[Prediction]]:
+        # batched predictions return float32 probabilities, which we convert to python floats.
+        # Note: These slices should always be entire documents
+        all_labels, all_probs = self.classifier.predict([self.preprocess(s.doc) for s in text_slices])
 
-        # If the predicted label is 'CC', adjust the probability of it being 'Wikipedia'
-        if pred_label == "__label__cc":
-            probability_score = 1 - probability_score
+        out: List[Iterable[Prediction]] = []
+        for pred_labels, pred_probs in zip(all_labels, all_probs):
+            # Extract the predicted label and its probability
+            pred_label = pred_labels[0]
+            probability_score = float(pred_probs[0])
 
-        label = pred_label.replace("__label__", "").replace("cc", "score").replace("hq", "score")
+            # If the predicted label is 'CC', adjust the probability of it being 'Wikipedia'
+            if pred_label == "__label__cc":
+                probability_score = 1 - probability_score
 
-        return [Prediction(label=label, score=probability_score)]
+            label = pred_label.replace("__label__", "").replace("cc", "score").replace("hq", "score")
+            out.append([Prediction(label=label, score=probability_score)])
+        return out
 
 
 @TaggerRegistry.add("dolma17-quality")
@@ -58,11 +68,24 @@ class Dolma17QualityClassifier(BaseFastTextTagger):
         tokens = self._splitter.pre_tokenize_str(normalized_text)
         return tokens
 
+    def preprocess_text(self, text: str) -> str:
+        """Return the tokens from `preprocess` joined by spaces, which is the input of the classifier."""
+        if INFO_SEPARATORS_REGEX.search(text):
+            # rare; `str.split()` would split on these characters too, so we have to use the tokenizer
+            return " ".join(token for token, _ in self.preprocess(text))
+
+        # same as above, but much faster since it does not create a tuple of token and offsets for each token.
+        return " ".join(text.split())
+
     def predict_slice(self, text_slice: TextSlice) -> Iterable[Prediction]:
-        tokens, _ = zip(*self.preprocess(text_slice.text))
-        preds = self.classifier.predict(" ".join(tokens), k=-1)
-        out = [
-            Prediction(label=label.replace("__label__", ""), score=score)
-            for label, score in sorted(zip(*preds), key=lambda x: x[1], reverse=True)
+        return self.predict_slices([text_slice])[0]
+
+    def predict_slices(self, text_slices: List[TextSlice]) -> List[Iterable[Prediction]]:
+        all_labels, all_probs = self.classifier.predict([self.preprocess_text(s.text) for s in text_slices], k=-1)
+        return [
+            [
+                Prediction(label=label.replace("__label__", ""), score=float(score))
+                for label, score in sorted(zip(labels, probs), key=lambda x: x[1], reverse=True)
+            ]
+            for labels, probs in zip(all_labels, all_probs)
         ]
-        return out
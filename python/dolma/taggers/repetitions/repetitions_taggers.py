@@ -4,18 +4,22 @@ Taggers to detect repetitions in the text.
 @soldni
 """
 
-import re
 from abc import abstractmethod
-from typing import Generator, List
+from typing import Generator, Iterable, List, Tuple
 
 import numpy as np
-from tokenizers import Tokenizer
+from tokenizers import Encoding, Tokenizer
 
 from ...core.data_types import DocResult, Document, Span
 from ...core.registry import TaggerRegistry
 from ...core.taggers import BaseTagger
 from ...core.utils import split_paragraphs
-from .utils import find_periodic_sequences
+from .utils import (
+    RepetitionTuple,
+    find_char_repetitions,
+    find_periodic_sequences,
+    find_periodic_sequences_batch,
+)
 
 
 class BaseRepetitionsTagger(BaseTagger):
@@ -25,8 +29,20 @@ class BaseRepetitionsTagger(BaseTagger):
     def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
         raise NotImplementedError()
 
+    def _extract_from_texts(self, texts: List[str]) -> List[List[Span]]:
+        """Extract spans from many texts at once; override to share work across texts."""
+        return [list(self._extract_from_text(text)) for text in texts]
+
+    def _split_doc(self, doc: Document) -> List[Tuple[int, str]]:
+        """Split a document into (offset, text) pieces; spans found in each piece are shifted by offset."""
+        return [(0, doc.text)]
+
     def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
-        yield from self._extract_from_text(doc.text)
+        for offset, text in self._split_doc(doc):
+            for span in self._extract_from_text(text):
+                span.start += offset
+                span.end += offset
+                yield span
 
     def _compute_document_stats(self, spans: List[Span], doc: Document) -> List[Span]:
         doc_max_span = Span(
@@ -49,34 +65,51 @@ class BaseRepetitionsTagger(BaseTagger):
         )
         return [doc_max_span, doc_mean_reps_span, doc_frac_reps_span]
 
-    def predict(self, doc: Document) -> DocResult:
-        """Predict method for the tagger."""
-        span_reps = list(self._extract_from_doc(doc))
+    def _make_result(self, doc: Document, span_reps: List[Span]) -> DocResult:
         if self.keep_stats_when_empty or span_reps:
             span_reps += self._compute_document_stats(spans=span_reps, doc=doc)
 
         return DocResult(doc=doc, spans=span_reps)
 
+    def predict(self, doc: Document) -> DocResult:
+        """Predict method for the tagger."""
+        return self._make_result(doc=doc, span_reps=list(self._extract_from_doc(doc)))
+
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        """Predict method for a batch of documents; pieces of all documents are processed together."""
+        docs_pieces = [self._split_doc(doc) for doc in docs]
+        texts_spans = iter(self._extract_from_texts([text for pieces in docs_pieces for _, text in pieces]))
+
+        results: List[DocResult] = []
+        for doc, pieces in zip(docs, docs_pieces):
+            span_reps: List[Span] = []
+            for (offset, _), spans in zip(pieces, texts_spans):
+                for span in spans:
+                    span.start += offset
+                    span.end += offset
+                    span_reps.append(span)
+            results.append(self._make_result(doc=doc, span_reps=span_reps))
+        return results
+
 
 @TaggerRegistry.add("repetitions_v1")
 class RepetitionsTagger(BaseRepetitionsTagger):
     """Tagger to detect repetitions of of groups of characters.
-    Only repetitions that occur at least 4 times are detected."""
+    Only repetitions that occur at least 4 times are detected.
 
-    def __init__(self) -> None:
-        self.re_char_repetitions = re.compile(r"(.+?)(\s?\1){3,}")
-        super().__init__()
+    Spans are the same as the ones matched by the regex `(.+?)(\\s?\\1){3,}`, but repeated groups are capped
+    at MAX_PERIOD characters; see `find_char_repetitions` for details."""
+
+    MAX_PERIOD = 256
 
     def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
         """Extract repetitions of characters in the text."""
-        for match in self.re_char_repetitions.finditer(text):
-            repeated_text = match.group(1)
+        for seq in find_char_repetitions(text=text, max_period=self.MAX_PERIOD):
             span = Span(
-                start=match.start(),
-                end=match.end(),
+                start=seq.start,
+                end=seq.end,
                 type="repetition",
-                # score=float(end - start) // len(repeated_text),
-                score=match.group(0).count(repeated_text),
+                score=seq.times,
             )
             yield span
 
@@ -87,14 +120,13 @@ class ParagraphRepetitionsTagger(RepetitionsTagger):
     It's faster than the char repetition tagger, but it does not account for
     repetitions of characters that span multiple paragraphs."""
 
-    def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
+    def _split_doc(self, doc: Document) -> List[Tuple[int, str]]:
+        pieces: List[Tuple[int, str]] = []
         offset = 0
         for paragraph in split_paragraphs(doc.text, remove_empty=False):
-            for span in self._extract_from_text(paragraph.text):
-                span.start += offset
-                span.end += offset
-                yield span
+            pieces.append((offset, paragraph.text))
             offset += len(paragraph.text)
+        return pieces
 
 
 @TaggerRegistry.add("tokenizer_repetitions_v1")
@@ -111,12 +143,9 @@ class TokenizerRepetitionsTagger(BaseRepetitionsTagger):
     def __init__(self) -> None:
         self.tokenizer = Tokenizer.from_pretrained(self.TOKENIZER_IDENTIFIER)
 
-    def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
-        tokens = self.tokenizer.encode(text, add_special_tokens=False)
-        sequences_iter = find_periodic_sequences(
-            arr=np.array(tokens.ids), min_period=self.MIN_PERIOD, max_period=self.MAX_PERIOD
-        )
-        for seq in sequences_iter:
+    def _make_spans(self, tokens: Encoding, sequences: Iterable[RepetitionTuple]) -> Generator[Span, None, None]:
+        """Map sequences of repeated tokens back to character spans in the text."""
+        for seq in sequences:
             out = Span(
                 start=tokens.offsets[seq.start][0],
                 end=tokens.offsets[seq.end - 1][1],
@@ -125,6 +154,26 @@ class TokenizerRepetitionsTagger(BaseRepetitionsTagger):
             )
             yield out
 
+    def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
+        tokens = self.tokenizer.encode(text, add_special_tokens=False)
+        sequences_iter = find_periodic_sequences(
+            arr=np.array(tokens.ids), min_period=self.MIN_PERIOD, max_period=self.MAX_PERIOD
+        )
+        yield from self._make_spans(tokens=tokens, sequences=sequences_iter)
+
+    def _extract_from_texts(self, texts: List[str]) -> List[List[Span]]:
+        """Tokenize all texts in one call, and find repeated sequences in all of them with a single sweep."""
+        all_tokens = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        all_sequences = find_periodic_sequences_batch(
+            arrs=[np.array(tokens.ids, dtype=np.int64) for tokens in all_tokens],
+            min_period=self.MIN_PERIOD,
+            max_period=self.MAX_PERIOD,
+        )
+        return [
+            list(self._make_spans(tokens=tokens, sequences=sequences))
+            for tokens, sequences in zip(all_tokens, all_sequences)
+        ]
+
 
 @TaggerRegistry.add("paragraph_tokenizer_repetitions_v1")
 class ParagraphTokenizerRepetitionsTagger(TokenizerRepetitionsTagger):
@@ -132,16 +181,15 @@ class ParagraphTokenizerRepetitionsTagger(TokenizerRepetitionsTagger):
     It's faster than the tokenizer repetition tagger, but it does not account
     for repetitions of tokens that span multiple paragraphs."""
 
-    def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
+    def _split_doc(self, doc: Document) -> List[Tuple[int, str]]:
+        pieces: List[Tuple[int, str]] = []
         offset = 0
         for paragraph in split_paragraphs(doc.text, remove_empty=False):
             # space is required to avoid first symbol in the paragraph to be
             # tokenized as a different token.
-            for span in self._extract_from_text(" " + paragraph.text):
-                span.start += offset - 1
-                span.end += offset - 1
-                yield span
+            pieces.append((offset - 1, " " + paragraph.text))
             offset += len(paragraph.text)
+        return pieces
 
 
 @TaggerRegistry.add("tokenizer_repetitions_v2r2")
@@ -149,9 +197,10 @@ class TokenizerRepetitionsSkipEmptyTagger(TokenizerRepetitionsTagger):
     keep_stats_when_empty: bool = False
     max_length: int = 100_000
 
-    def _extract_from_text(self, text: str) -> Generator[Span, None, None]:
+    def _make_spans(self, tokens: Encoding, sequences: Iterable[RepetitionTuple]) -> Generator[Span, None, None]:
         sorted_spans = sorted(
-            super()._extract_from_text(text), key=lambda span: (span.start, -span.end, -span.score)
+            super()._make_spans(tokens=tokens, sequences=sequences),
+            key=lambda span: (span.start, -span.end, -span.score),
         )
         prev_start = prev_end = -1
         for span in sorted_spans:
@@ -163,12 +212,5 @@ class TokenizerRepetitionsSkipEmptyTagger(TokenizerRepetitionsTagger):
             prev_end = span.end
             yield span
 
-    def _extract_from_doc(self, doc: Document) -> Generator[Span, None, None]:
-        offset = 0
-        for i in range(0, len(doc.text), self.max_length):
-            text = doc.text[i : i + self.max_length]
-            for span in self._extract_from_text(text):
-                span.start += offset
-                span.end += offset
-                yield span
-            offset += len(text)
+    def _split_doc(self, doc: Document) -> List[Tuple[int, str]]:
+        return [(i, doc.text[i : i + self.max_length]) for i in range(0, len(doc.text), self.max_length)]
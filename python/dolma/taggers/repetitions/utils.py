@@ -1,4 +1,5 @@
-from typing import Generator, List, NamedTuple
+from functools import lru_cache
+from typing import Generator, List, NamedTuple, Tuple
 
 import numpy as np
 
@@ -116,3 +117,226 @@ def find_periodic_sequences(
                 # cannot accurately determine the period of a sequence that repeats
                 # less than 3 times with this algorithm
                 yield out
+
+
+# base for the polynomial rolling hash used to find candidate repetitions; arithmetic is modulo 2**64
+ROLLING_HASH_BASE = np.uint64(0x100000001B3)
+
+
+def find_periodic_sequences_batch(
+    arrs: List[np.ndarray], max_period: int, min_period: int = 1, mask_value: int = -1
+) -> List[List[RepetitionTuple]]:
+    """Function to find periodic sequences in a batch of arrays at once.
+
+    Returns the same sequences as calling `find_periodic_sequences` on each array, in the same order.
+    Rather than reshaping each array once per period, all arrays are concatenated (separated by `max_period`
+    copies of `mask_value`, so that no window spans two arrays), and for each period we compute a mask of
+    positions that are equal to the position `period` steps ahead. Runs of at least `2 * period` consecutive
+    equal positions are periodic sequences that repeat at least 3 times; run boundaries are found with a
+    single diff over the mask of the entire batch.
+
+    Args:
+        arrs (List[np.ndarray]): The arrays to search for periodic sequences.
+        max_period (int): The maximum period to check for.
+        min_period (int, optional): The minimum period to check for. Defaults to 1.
+        mask_value (int, optional): The value to use to separate arrays. Defaults to -1.
+    """
+    results: List[List[RepetitionTuple]] = [[] for _ in arrs]
+    if not arrs or max_period < min_period:
+        return results
+
+    separator = np.full(max_period, mask_value)
+    pieces: List[np.ndarray] = []
+    for arr in arrs:
+        pieces.extend((arr, separator))
+    concat = np.concatenate(pieces)
+    if (concat == mask_value).sum() > len(arrs) * max_period:
+        raise ValueError("`mask_value` is in the array")
+
+    # position at which each array starts in the concatenated array
+    lengths = np.array([len(arr) + max_period for arr in arrs])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    is_valid = concat != mask_value
+
+    for period in range(min_period, max_period + 1):
+        # is_equal[i] is true if concat[i] == concat[i + period]; we pad with false on both sides so that
+        # every run of true values has a start and an end in the diff below.
+        is_equal = np.zeros(len(concat) + 1, dtype=np.int8)
+        is_equal[1 : len(concat) - period + 1] = (concat[:-period] == concat[period:]) & is_valid[:-period]
+        boundaries = np.diff(is_equal)
+        run_starts = np.flatnonzero(boundaries == 1)
+        run_ends = np.flatnonzero(boundaries == -1)
+
+        # a run of r equal positions is a sequence of length r + period; it repeats (r + period) // period times
+        is_long_enough = (run_ends - run_starts) >= 2 * period
+        run_starts, run_ends = run_starts[is_long_enough], run_ends[is_long_enough]
+        arr_ids = np.searchsorted(offsets, run_starts, side="right") - 1
+
+        for arr_id, start, end in zip(arr_ids.tolist(), run_starts.tolist(), run_ends.tolist()):
+            local_start = start - int(offsets[arr_id])
+            local_end = end - int(offsets[arr_id]) + period
+            results[arr_id].append(
+                RepetitionTuple(
+                    start=local_start,
+                    end=local_end,
+                    period=period,
+                    times=(local_end - local_start) // period,
+                )
+            )
+
+    return results
+
+
+@lru_cache(maxsize=1)
+def _whitespace_code_points() -> np.ndarray:
+    """Code points for which `str.isspace()` is true; these are the characters matched by `\\s` in regexes."""
+    return np.array([c for c in range(0x110000) if chr(c).isspace()], dtype=np.uint32)
+
+
+def _match_char_repetition(text: str, start: int, period: int, min_times: int) -> int:
+    """Try to match `min_times` or more repetitions of `text[start:start + period]`, each optionally
+    preceded by a single whitespace character, after the unit itself. Returns the end of the match, or -1.
+
+    This reproduces the backtracking order of the regex `(.+?)(\\s?\\1){3,}` for a fixed unit: the first
+    `min_times` repetitions are matched depth first (trying the whitespace-prefixed variant first), after
+    which the match is extended greedily."""
+    unit = text[start : start + period]
+
+    def _first_repetitions(pos: int, count: int) -> int:
+        if count == min_times:
+            return pos
+        if pos < len(text) and text[pos].isspace() and text.startswith(unit, pos + 1):
+            if (end := _first_repetitions(pos + 1 + period, count + 1)) >= 0:
+                return end
+        if text.startswith(unit, pos):
+            return _first_repetitions(pos + period, count + 1)
+        return -1
+
+    if (pos := _first_repetitions(start + period, 0)) < 0:
+        return -1
+
+    while True:
+        if pos < len(text) and text[pos].isspace() and text.startswith(unit, pos + 1):
+            pos += 1 + period
+        elif text.startswith(unit, pos):
+            pos += period
+        else:
+            return pos
+
+
+def find_char_repetitions(
+    text: str, max_period: int, min_times: int = 3, window_size: int = 65_536
+) -> Generator[RepetitionTuple, None, None]:
+    """Function to find repetitions of groups of characters in a string with bounded cost.
+
+    Matches are the same as the ones returned by `re.finditer(r"(.+?)(\\s?\\1){3,}", text)`, as long as the
+    repeated unit is at most `max_period` characters long; longer units are not detected. The regex is
+    super-linear on long lines without repetitions, since it tries every unit length up to the end of the
+    line at every position.
+
+    Instead, for each period up to `max_period`, we use vectorized numpy operations to find positions where
+    the unit is followed by `min_times` copies of itself, comparing first characters and then rolling
+    hashes. Only these candidates are verified exactly, so the overall cost is O(len(text) * max_period).
+    Positions are processed in windows of at most `window_size` characters to bound memory usage.
+
+    Args:
+        text (str): The text to search for repetitions.
+        max_period (int): The maximum length of the repeated unit.
+        min_times (int, optional): The minimum number of times the unit must be repeated after its first
+            occurrence. Defaults to 3, which matches the `{3,}` quantifier in the regex.
+        window_size (int, optional): Number of start positions processed at once. Defaults to 65,536.
+    """
+    if not text:
+        return
+
+    # a unit cannot span multiple lines, so there is no point in checking periods longer than the longest line
+    max_period = min(max_period, max(len(line) for line in text.split("\n")))
+    if max_period < 1:
+        return
+
+    # we pad the text with a code point that is not valid unicode; this way, windows that go past the end
+    # of the text never match a unit, and we don't have to check bounds when computing hashes.
+    padding = (min_times + 1) * (max_period + 1) + 1
+    chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    is_space = np.concatenate((np.isin(chars, _whitespace_code_points()), np.zeros(padding, dtype=bool)))
+    chars = np.concatenate((chars, np.full(padding, 0x110000, dtype=np.uint32)))
+    spaces_before = np.concatenate(([0], np.cumsum(is_space)))
+
+    # prefix sums of chars[i] * base**i; the difference prefix[i + p] - prefix[i] is the hash of the window
+    # text[i:i + p] multiplied by base**i, so windows at different offsets are compared after multiplying
+    # by the right power of the base.
+    powers = np.cumprod(np.full(len(chars) + 1, ROLLING_HASH_BASE, dtype=np.uint64))
+    powers = np.concatenate(([np.uint64(1)], powers[:-1]))
+    prefix = np.concatenate(([np.uint64(0)], np.cumsum(chars.astype(np.uint64) * powers[:-1], dtype=np.uint64)))
+
+    # windows start small and double in size up to `window_size`; in highly repetitive text, almost every
+    # position is a candidate, but a single match usually covers the rest of the window.
+    pos, current_window_size = 0, min(1024, window_size)
+    while pos < len(text):
+        window_start, window_end = pos, min(pos + current_window_size, len(text))
+        window_chars = chars[window_start:window_end]
+
+        # positions and periods of units that might repeat
+        candidates: List[Tuple[np.ndarray, np.ndarray]] = []
+
+        for period in range(1, max_period + 1):
+            # cheap check first: the first character of the unit must appear where the first repetition
+            # starts, either immediately after the unit or after a whitespace character.
+            after = slice(window_start + period, window_end + period)
+            after_ws = slice(window_start + period + 1, window_end + period + 1)
+            is_candidate = (window_chars == chars[after]) | (is_space[after] & (window_chars == chars[after_ws]))
+            found = np.flatnonzero(is_candidate) + window_start
+
+            # then we compare the hash of the unit with the hash of each of the following repetitions; the
+            # k-th repetition starts between k * period and k * (period + 1) characters after the unit, but
+            # only if there are enough whitespace characters to account for the extra characters.
+            unit_hash = prefix[found + period] - prefix[found]
+            for k in range(1, min_times + 1):
+                if len(found) == 0:
+                    break
+                is_candidate = np.zeros(len(found), dtype=bool)
+                for extra in range(k + 1):
+                    offset = k * period + extra
+                    if extra > 0:
+                        has_spaces = spaces_before[found + offset] - spaces_before[found + period] >= extra
+                        sel, sel_hash = found[has_spaces], unit_hash[has_spaces]
+                    else:
+                        has_spaces, sel, sel_hash = slice(None), found, unit_hash
+                    rep_hash = prefix[sel + offset + period] - prefix[sel + offset]
+                    is_candidate[has_spaces] |= sel_hash * powers[offset] == rep_hash
+                found, unit_hash = found[is_candidate], unit_hash[is_candidate]
+
+            if len(found):
+                candidates.append((found, np.full(len(found), period)))
+
+        # we scan candidates by position first, then by period; this mirrors the leftmost, shortest unit
+        # semantics of the lazy regex. After a match, we skip to the first candidate after its end.
+        next_pos = window_end
+        candidate_starts = np.concatenate([c[0] for c in candidates]) if candidates else np.array([], dtype=int)
+        candidate_periods = np.concatenate([c[1] for c in candidates]) if candidates else np.array([], dtype=int)
+        order = np.lexsort((candidate_periods, candidate_starts))
+        candidate_starts, candidate_periods = candidate_starts[order], candidate_periods[order]
+        i = 0
+        while i < len(candidate_starts):
+            start, period = int(candidate_starts[i]), int(candidate_periods[i])
+            if "\n" in text[start : start + period]:
+                # units cannot contain newlines; longer units at the same position would contain it too
+                i = int(np.searchsorted(candidate_starts, start + 1))
+            elif (match_end := _match_char_repetition(text, start, period, min_times)) < 0:
+                i += 1
+            else:
+                yield RepetitionTuple(
+                    start=start,
+                    end=match_end,
+                    period=period,
+                    times=text[start:match_end].count(text[start : start + period]),
+                )
+                if match_end >= window_end:
+                    next_pos = match_end
+                    break
+                i = int(np.searchsorted(candidate_starts, match_end))
+
+        current_window_size = (
+            min(1024, window_size) if next_pos > window_end else min(2 * current_window_size, window_size)
+        )
+        pos = next_pos
@@ -6,6 +6,8 @@ Filters.
 
 """
 
+from typing import List
+
 from tokenizers import Tokenizer
 
 from ..core.data_types import DocResult, Document, Span
@@ -26,6 +28,14 @@ class BaseTokenizer(BaseTagger):
         tokens = self.tokenizer.encode(sequence=doc.text, add_special_tokens=False)
         return DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="tokens", score=len(tokens))])
 
+    def predict_batch(self, docs: List[Document]) -> List[DocResult]:
+        # `encode_batch` tokenizes documents in parallel
+        all_tokens = self.tokenizer.encode_batch([doc.text for doc in docs], add_special_tokens=False)
+        return [
+            DocResult(doc=doc, spans=[Span(start=0, end=len(doc.text), type="tokens", score=len(tokens))])
+            for doc, tokens in zip(docs, all_tokens)
+        ]
+
 
 @TaggerRegistry.add("tokenizers_EleutherAI_GPT_NeoX_20B")
 class GPTNeoX20BTokenizer(BaseTokenizer):
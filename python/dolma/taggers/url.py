@@ -1,11 +1,12 @@
 import json
 import re
 import socket
-from typing import Generator, List, Set
+from typing import Generator, Iterator, List
 
 import smart_open
 import urllib3.util
 
+from ..core.blocklist import BlocklistIndex, make_index_key
 from ..core.data_types import DocResult, DocumentWithMetadata, Span
 from ..core.loggers import get_logger
 from ..core.paths import cached_path
@@ -66,21 +67,28 @@ class BaseUrlTagger(BaseTaggerWithMetadata):
     MAYBE_IP_AND_URL_REGEX = re.compile(f"{MAYBE_IP_REGEX.pattern}\\s+{URL_REGEX.pattern}")
 
     def __init__(self) -> None:
-        self.blocklist: Set[str] = set()
+        # the parsed blocklist is compiled into a hash index that is cached on disk and memory-mapped,
+        # so that it is only built once and shared by all workers on the same machine.
+        local_paths = [cached_path(p) for p in self.BLOCKLIST_PATHS]
+        parser_name = f"{self.__class__.__module__}.{self.__class__.__qualname__}"
+        self.blocklist = BlocklistIndex.get_or_build(
+            key=make_index_key(name=parser_name, paths=local_paths),
+            entries_fn=lambda: self.iter_blocklist(local_paths),
+        )
 
-        # doing the loading here
-        for blocklist_path in self.BLOCKLIST_PATHS:
-            with smart_open.open(cached_path(blocklist_path)) as blocklist_file:
+        assert len(self.blocklist) > 0, f"Blocklist is empty for {self.__class__.__name__} tagger"
+
+    def iter_blocklist(self, paths: List[str]) -> Iterator[str]:
+        """Parse the blocklists at the given paths and yield all their entries."""
+        for blocklist_path in paths:
+            with smart_open.open(blocklist_path) as blocklist_file:
                 for i, ln in enumerate(blocklist_file):
                     try:
-                        for url in self.parse_line(ln):
-                            self.blocklist.add(url)
+                        yield from self.parse_line(ln)
                     except UrlNotParsedError:
                         message = f"Invalid line {i} in {blocklist_path}: '{ln}'"
                         LOGGER.info(message)
 
-        assert len(self.blocklist) > 0, f"Blocklist is empty for {self.__class__.__name__} tagger"
-
     def parse_line(self, ln: str) -> Generator[str, None, None]:
         if not (ln := ln.strip().lower()) or ln.startswith("#") or ln.startswith(";") or ln.startswith("!"):
             # either empty or a comment
@@ -179,6 +187,23 @@ class AdbUrlTagger(BaseUrlTagger):
     def check_url(self, url: str) -> bool:
         return self.engine.check_network_urls(url)
 
+    def predict(self, doc: DocumentWithMetadata) -> DocResult:  # type: ignore
+        return self.predict_batch([doc])[0]
+
+    def predict_batch(self, docs: List[DocumentWithMetadata]) -> List[DocResult]:  # type: ignore
+        # check the cleaned urls of all documents in a single call to the engine, then split results by document
+        urls = [list(self.clean_url(doc.metadata.get(self.URL_METADATA_KEY) or "")) for doc in docs]
+        all_urls = [url for doc_urls in urls for url in doc_urls]
+        blocked = iter(self.engine.check_many(all_urls) if all_urls else [])
+
+        results = []
+        for doc, doc_urls in zip(docs, urls):
+            spans = []
+            if any([next(blocked) for _ in doc_urls]):
+                spans = [Span(start=0, end=len(doc.text), type=self.URL_METADATA_KEY, score=1.0)]
+            results.append(DocResult(doc=doc, spans=spans))
+        return results
+
 
 @TaggerRegistry.add("oisd_small_abp_v1")
 class OISDSmallAdblockPlusTagger(AdbUrlTagger):
@@ -1,5 +1,6 @@
 from .data_types import TokenizerOutput
 from .executor import tokenize_in_parallel
+from .memmap_reader import MemmapDataset, MemmapReader
 from .tokenizer import Tokenizer, tokenize_file
 
 __all__ = [
@@ -7,4 +8,6 @@ __all__ = [
     "tokenize_file",
     "tokenize_in_parallel",
     "TokenizerOutput",
+    "MemmapDataset",
+    "MemmapReader",
 ]
@@ -0,0 +1,132 @@
+"""
+Incremental tokenization. Each source file is tokenized into a memmap of its own in a cache directory, named
+after a key that changes when either the file (its ETag, or its size and modification time) or the tokenizer
+configuration changes. Running again with the same cache only tokenizes files that are new or have changed;
+the destination is then assembled from the cached memmaps of all source files by the same pass that shuffles
+documents globally (see `reshard_memmaps`).
+"""
+
+import json
+import os
+import sys
+from hashlib import sha256
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ..core.parallel import BaseParallelProcessor, QueueType
+from ..core.paths import exists, get_fingerprint, join_path, mkdir_p
+from .data_types import TokenizerOutput
+from .memmap_writer import MemmapWriter
+from .tokenizer import set_tokenizer_threads, tokenize_file
+
+__all__ = ["MemMapCacheWriter", "get_cache_paths", "get_tokenizer_fingerprint"]
+
+
+DONE_EXTENSION = ".done"
+
+
+def get_tokenizer_fingerprint(
+    tokenizer_name_or_path: str,
+    dtype: str,
+    bos_token_id: Optional[int] = None,
+    eos_token_id: Optional[int] = None,
+    segment_before_tokenization: bool = False,
+    encode_special_tokens: bool = False,
+    use_fast_tokenizer: bool = True,
+) -> str:
+    """Hash of everything that changes the tokens of a document. If the tokenizer is a local file, its
+    fingerprint is included, so editing the file invalidates the cache."""
+    config: Dict[str, Any] = {
+        "tokenizer_name_or_path": tokenizer_name_or_path,
+        "dtype": np.dtype(dtype).name,
+        "bos_token_id": bos_token_id,
+        "eos_token_id": eos_token_id,
+        "segment_before_tokenization": segment_before_tokenization,
+        "encode_special_tokens": encode_special_tokens,
+        "use_fast_tokenizer": use_fast_tokenizer,
+    }
+    if os.path.exists(tokenizer_name_or_path):
+        config["tokenizer_fingerprint"] = get_fingerprint(tokenizer_name_or_path)
+    return sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_cache_paths(source_paths: List[str], cache_dir: str, tokenizer_fingerprint: str) -> List[str]:
+    """Location in `cache_dir` of the memmap of each source file (without extension)."""
+    cache_paths = []
+    for path in source_paths:
+        key = f"{path}:{get_fingerprint(path)}:{tokenizer_fingerprint}"
+        cache_paths.append(join_path(None, cache_dir, sha256(key.encode("utf-8")).hexdigest()))
+    return cache_paths
+
+
+class MemMapCacheWriter(BaseParallelProcessor):
+    """Tokenize each source file into its own memmap in the cache. A memmap is only used once the file that
+    marks it as done is written, so memmaps of runs that were interrupted are tokenized again."""
+
+    WRITE_BATCH_SIZE = 1000
+
+    @classmethod
+    def increment_progressbar(  # type: ignore[override]    # pylint: disable=arguments-differ
+        cls,
+        queue: QueueType,
+        /,
+        files: int = 0,
+        documents: int = 0,
+        tokens: int = 0,
+    ) -> Dict[str, int]:
+        return super().increment_progressbar(queue, files=files, documents=documents, tokens=tokens)
+
+    @classmethod
+    def process_single(cls, source_path: str, destination_path: str, queue: QueueType, **kwargs: Any):
+        set_tokenizer_threads(kwargs.pop("tokenizer_threads", None) or 1)
+
+        dtype: np.dtype = np.dtype(kwargs.pop("dtype", None) or "uint16")
+        tokenizer_name_or_path = kwargs.pop("tokenizer_name_or_path", None)
+        if tokenizer_name_or_path is None:
+            raise RuntimeError("tokenizer_name_or_path not provided")
+
+        documents = tokenize_file(
+            tokenizer_name_or_path=tokenizer_name_or_path,
+            path=source_path,
+            refresh_tokenizer_every=kwargs.pop("refresh_tokenizer", None) or 0,
+            batch_size=kwargs.pop("encode_batch_size", None) or 1,
+            bos_token_id=kwargs.pop("bos_token_id", None),
+            eos_token_id=kwargs.pop("eos_token_id", None),
+            pad_token_id=kwargs.pop("pad_token_id", None),
+            segment_before_tokenization=kwargs.pop("segment_before_tokenization", None) or False,
+            encode_special_tokens=kwargs.pop("encode_special_tokens", None) or False,
+            use_fast=bool(kwargs.pop("use_fast_tokenizer", True)),
+        )
+
+        # the memmap of a source file holds all of its documents, however many tokens they are
+        batch: List[TokenizerOutput] = []
+        with MemmapWriter(path=destination_path, dtype=dtype, max_tokens=sys.maxsize) as writer:
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= cls.WRITE_BATCH_SIZE:
+                    writer.write_many(outputs=batch)
+                    cls.increment_progressbar(queue, documents=len(batch), tokens=sum(d.end for d in batch))
+                    batch = []
+
+            writer.write_many(outputs=batch)
+
+        cls.increment_progressbar(queue, files=1, documents=len(batch), tokens=sum(d.end for d in batch))
+
+    def __call__(  # type: ignore[override]    # pylint: disable=arguments-differ
+        self, source_paths: List[str], cache_paths: List[str], **process_single_kwargs: Any
+    ):
+        """Tokenize the source files whose memmap is not in the cache yet."""
+        missing = [(s, c) for s, c in zip(source_paths, cache_paths) if not exists(f"{c}{DONE_EXTENSION}")]
+        print(f"Tokenizing {len(missing):,} source files; {len(source_paths) - len(missing):,} are cached.")
+        if not missing:
+            return
+
+        mkdir_p(self.dst_prefixes[0])
+        fn = self._debug_run_all if self.debug else self._multiprocessing_run_all
+        fn(
+            all_source_paths=[s for s, _ in missing],
+            all_destination_paths=[c for _, c in missing],
+            all_metadata_paths=[f"{c}{DONE_EXTENSION}" for _, c in missing],
+            **process_single_kwargs,
+        )
@@ -0,0 +1,83 @@
+"""
+Exact deduplication of tokenized documents. Documents that survive earlier dedupe (e.g., because they have
+different ids) but have the same tokens are detected with a bloom filter of hashes of their tokens. The bloom
+filter is a local file that every writer process maps in memory, so duplicates are detected across writers
+without sending hashes between them.
+"""
+
+import fcntl
+import os
+from hashlib import blake2b
+from typing import Sequence, Union
+
+import numpy as np
+
+__all__ = ["DEDUPE_MODES", "TokensBloomFilter"]
+
+
+# "drop" does not write duplicates; "count" writes them, but still counts them in the progress bar.
+DEDUPE_MODES = ("drop", "count")
+
+
+class TokensBloomFilter:
+    """A bloom filter of documents, keyed by a hash of their tokens. Processes that share the filter take a lock
+    on its file to check and set the bits of a document, so two copies of a document are never both missed."""
+
+    # optimal for ~10 bits per document, which gives ~1% false positives
+    NUM_HASHES = 7
+
+    def __init__(self, path: str, num_hashes: int = NUM_HASHES):
+        """Open a bloom filter created with `TokensBloomFilter.create`.
+
+        Args:
+            path (str): Location of the bloom filter file; must be local.
+            num_hashes (int, optional): Number of bits set for each document. Defaults to 7.
+        """
+        self.path = path
+        self.num_hashes = num_hashes
+        self.bits = np.memmap(path, dtype=np.uint8, mode="r+")
+        self.num_bits = len(self.bits) * 8
+        self._lock_fd = os.open(path, os.O_RDONLY)
+
+    def __del__(self):
+        if (lock_fd := getattr(self, "_lock_fd", None)) is not None:
+            os.close(lock_fd)
+
+    @classmethod
+    def create(cls, path: str, size_in_bytes: int) -> "TokensBloomFilter":
+        """Create an empty bloom filter of `size_in_bytes` bytes at `path`; the file is sparse, so disk space
+        is only used as bits are set."""
+        if size_in_bytes <= 0:
+            raise ValueError(f"Size of the bloom filter must be positive, got {size_in_bytes}")
+        with open(path, "wb"):
+            pass
+        os.truncate(path, size_in_bytes)
+        return cls(path)
+
+    def _positions(self, tokens: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        """Bits of a document: `num_hashes` positions derived from a 128-bit hash of the bytes of its tokens, by
+        double hashing. Tokens are hashed as 32-bit integers, so the hash does not depend on the output dtype."""
+        digest = blake2b(np.asarray(tokens, dtype=np.uint32).tobytes(), digest_size=16).digest()
+        h1, h2 = np.frombuffer(digest, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return (h1 + np.arange(self.num_hashes, dtype=np.uint64) * (h2 | np.uint64(1))) % np.uint64(
+                self.num_bits
+            )
+
+    def add(self, tokens: Union[Sequence[int], np.ndarray]) -> bool:
+        """Add a document to the filter; return whether it was (probably) added before."""
+        positions = self._positions(tokens)
+        index, masks = positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            if np.all(self.bits[index] & masks):
+                return True
+            np.bitwise_or.at(self.bits, index, masks)
+            return False
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def __contains__(self, tokens: Union[Sequence[int], np.ndarray]) -> bool:
+        positions = self._positions(tokens)
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return bool(np.all(self.bits[positions >> np.uint64(3)] & masks))
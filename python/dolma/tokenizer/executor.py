@@ -2,6 +2,8 @@ import hashlib
 import multiprocessing
 import os
 import random
+import resource
+import sys
 import tempfile
 from contextlib import ExitStack
 from math import ceil, log10
@@ -11,12 +13,17 @@ from typing import Any, Dict, Generator, List, Optional
 import numpy as np
 from typing_extensions import TypeAlias
 
+from ..core.errors import DolmaHandoff
 from ..core.loggers import get_logger
 from ..core.parallel import BaseParallelProcessor, QueueType
-from ..core.paths import get_size, glob_path, join_path, mkdir_p
+from ..core.paths import get_size, glob_path, is_local, join_path, mkdir_p
+from .cache import MemMapCacheWriter, get_cache_paths, get_tokenizer_fingerprint
 from .data_types import TokenizerOutput  # pylint: disable=unused-import
-from .memmap_writer import MemmapWriter
-from .tokenizer import Tokenizer, tokenize_file
+from .dedupe import DEDUPE_MODES, TokensBloomFilter
+from .memmap_reader import find_memmap_paths
+from .memmap_writer import MemmapWriter, make_memmap_writer
+from .shuffle import reshard_memmaps
+from .tokenizer import Tokenizer, set_tokenizer_threads, tokenize_file
 
 TokenizedSeqsQueueType: TypeAlias = "Queue[List[TokenizerOutput]]"
 PathsQueueType: TypeAlias = "Queue[str]"
@@ -26,6 +33,13 @@ def sizes_to_probs(sizes: List[int]) -> np.ndarray:
     return np.array(sizes) / sum(sizes)
 
 
+def get_peak_rss() -> int:
+    """Peak resident memory of this process, in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS, and in kilobytes everywhere else
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
 class MemMapParallelWriter(BaseParallelProcessor):
     @classmethod
     def increment_progressbar(  # type: ignore[override]    # pylint: disable=arguments-differ
@@ -36,14 +50,16 @@ class MemMapParallelWriter(BaseParallelProcessor):
         documents: int = 0,
         tokens: int = 0,
         memmaps: int = 0,
+        duplicates: int = 0,
     ) -> Dict[str, int]:
         return super().increment_progressbar(
-            queue, files=files, documents=documents, tokens=tokens, memmaps=memmaps
+            queue, files=files, documents=documents, tokens=tokens, memmaps=memmaps, duplicates=duplicates
         )
 
     @classmethod
     def process_single(cls, source_path: str, destination_path: str, queue: QueueType, **kwargs: Any):
-        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        # each writer gets its own budget of threads to encode batches with
+        set_tokenizer_threads(kwargs.pop("tokenizer_threads", None) or 1)
 
         logger = get_logger(__name__)
 
@@ -75,6 +91,9 @@ class MemMapParallelWriter(BaseParallelProcessor):
         # Controls whether to refresh the tokenizer at the end of each batch
         refresh_tokenizer = kwargs.pop("refresh_tokenizer", None) or -1
 
+        # Number of documents of a file to encode at once
+        encode_batch_size: int = kwargs.pop("encode_batch_size", None) or 1
+
         # Controls whether to use the fast tokenizer or not
         tokenizer_kwargs["use_fast"] = bool(kwargs.pop("use_fast_tokenizer", True))
 
@@ -89,27 +108,64 @@ class MemMapParallelWriter(BaseParallelProcessor):
         # whether to split the special tokens into separate tokens, e.g. <s> -> < s >
         tokenizer_kwargs["encode_special_tokens"] = kwargs.pop("encode_special_tokens", None) or False
 
+        # documents are packed into sequences of fixed length if sequence_length is provided
+        writer_kwargs: Dict[str, Any] = {
+            "dtype": dtype,
+            "max_tokens": max_size,
+            "sequence_length": kwargs.pop("sequence_length", None),
+            "pad_token_id": tokenizer_kwargs["pad_token_id"],
+            "packing_policy": kwargs.pop("packing_policy", None) or "best_fit",
+        }
+
+        # documents with the same tokens as a document seen before by any writer are dropped or counted
+        dedupe: Optional[str] = kwargs.pop("dedupe", None)
+        dedupe_bloom_path: Optional[str] = kwargs.pop("dedupe_bloom_path", None)
+        bloom_filter = TokensBloomFilter(dedupe_bloom_path) if dedupe and dedupe_bloom_path else None
+
+        # a process that has read `recycle_after_documents` documents, or whose memory grew past
+        # `recycle_above_rss` bytes, stops and hands off the files it has not finished to a new process.
+        recycle_after_documents: Optional[int] = kwargs.pop("recycle_after_documents", None)
+        recycle_above_rss: Optional[int] = kwargs.pop("recycle_above_rss", None)
+        handoff: Dict[str, Any] = kwargs.pop("handoff", None) or {}
+        next_handoff: Optional[Dict[str, Any]] = None
+
         # this is useful for making sure the queue does not grows too much
         cpu_count = multiprocessing.cpu_count()
 
         # these are used to keep track of the progress
-        documents_cnt = tokens_cnt = 0
+        documents_cnt = tokens_cnt = duplicates_cnt = 0
         update_interval = 1
-        mm_cnt = 0
+        process_documents_cnt = 0
+        mm_cnt = handoff.get("memmap", 0)
+        if handoff:
+            source_paths = list(handoff["sources"])
 
+        # for each file in the ring, we keep its path and the line of the last document read from it
         tokenizer_ring: List[Generator[TokenizerOutput, None, None]] = []
         tokenizer_sizes: List[int] = []
-        for _ in range(min(ring_size, len(source_paths))):
-            path = source_paths.pop()
+        tokenizer_paths: List[str] = []
+        tokenizer_locs: List[int] = []
+
+        def add_to_ring(path: str, start_line: int = 0):
             tokenizer_ring.append(
                 tokenize_file(
                     tokenizer_name_or_path=tokenizer_name_or_path,
                     path=path,
                     refresh_tokenizer_every=refresh_tokenizer,
+                    batch_size=encode_batch_size,
+                    start_line=start_line,
                     **tokenizer_kwargs,
                 )
             )
             tokenizer_sizes.append(get_size(path))
+            tokenizer_paths.append(path)
+            tokenizer_locs.append(start_line)
+
+        # files a previous process handed off resume where it stopped reading them
+        for path, start_line in handoff.get("ring", []):
+            add_to_ring(path, start_line)
+        while len(tokenizer_ring) < ring_size and len(source_paths) > 0:
+            add_to_ring(source_paths.pop())
 
         # this is the probabilities with which we sample from the ring buffer if sample_ring_prop is True
         tokenizer_probs = sizes_to_probs(tokenizer_sizes)
@@ -118,7 +174,7 @@ class MemMapParallelWriter(BaseParallelProcessor):
 
         with ExitStack() as stack:
             memwriter = stack.enter_context(
-                MemmapWriter(path=destination_path + f"-{mm_cnt:05d}", dtype=dtype, max_tokens=max_size)
+                make_memmap_writer(path=destination_path + f"-{mm_cnt:05d}", **writer_kwargs)
             )
             cls.increment_progressbar(queue, memmaps=1)
 
@@ -134,6 +190,13 @@ class MemMapParallelWriter(BaseParallelProcessor):
                     try:
                         # trying to read the next sequence of tokens (might fail if end of file)
                         content = next(tokenizer_ring[j])
+                        tokenizer_locs[j] = content.loc
+                        process_documents_cnt += 1
+
+                        if bloom_filter is not None and bloom_filter.add(content.tokens):
+                            duplicates_cnt += 1
+                            if dedupe == "drop":
+                                continue
 
                         # added to the accumulator, we will shuffle this later
                         accumulator.append(content)
@@ -146,29 +209,24 @@ class MemMapParallelWriter(BaseParallelProcessor):
                         cls.increment_progressbar(queue, files=1)
                         tokenizer_ring.pop(j)
                         tokenizer_sizes.pop(j)
+                        tokenizer_paths.pop(j)
+                        tokenizer_locs.pop(j)
 
                         if len(tokenizer_ring) == 0:
                             # break if no more files to tokenize
                             break
                         if len(source_paths) > 0:
-                            path = source_paths.pop()
-                            tokenizer_ring.append(
-                                tokenize_file(
-                                    tokenizer_name_or_path=tokenizer_name_or_path,
-                                    path=path,
-                                    refresh_tokenizer_every=refresh_tokenizer,
-                                    **tokenizer_kwargs,
-                                )
-                            )
-                            tokenizer_sizes.append(get_size(path))
+                            add_to_ring(source_paths.pop())
 
                         # wether a file is added or not to the ring, we must re-balance probabilities
                         tokenizer_probs = sizes_to_probs(tokenizer_sizes)
 
                     # check if it time to update the progress bar!
                     if documents_cnt >= update_interval:
-                        cls.increment_progressbar(queue, documents=documents_cnt, tokens=tokens_cnt)
-                        tokens_cnt = documents_cnt = 0
+                        cls.increment_progressbar(
+                            queue, documents=documents_cnt, tokens=tokens_cnt, duplicates=duplicates_cnt
+                        )
+                        tokens_cnt = documents_cnt = duplicates_cnt = 0
 
                         if queue.qsize() >= cpu_count:
                             # double the update interval if the queue is full
@@ -180,31 +238,56 @@ class MemMapParallelWriter(BaseParallelProcessor):
                 # try to write all the sequences, collect the ones that don't fit in remaining
                 remaining = memwriter.write_many(outputs=accumulator, flush=documents_cnt == 0)
 
-                if remaining:
+                while remaining:
+                    if len(memwriter) == 0:
+                        # not even an empty memmap can fit this sequence, so we have to skip it
+                        logger.warning(
+                            "Skipping %s: it has more tokens than fit in a memmap (%d)", remaining[0].id, max_size
+                        )
+                        remaining = memwriter.write_many(outputs=remaining[1:], flush=True)
+                        continue
+
                     # if we have remaining sequences, we need to close the current memwriter and open a new one
                     mm_cnt += 1
                     stack.pop_all().close()
                     memwriter = stack.enter_context(
-                        MemmapWriter(
-                            path=destination_path + f"-{mm_cnt:05d}",
-                            dtype=dtype,
-                            max_tokens=max_size,
-                        )
+                        make_memmap_writer(path=destination_path + f"-{mm_cnt:05d}", **writer_kwargs)
                     )
                     cls.increment_progressbar(queue, memmaps=1)
 
-                    # finally, write the remaining sequences
-                    memwriter.write_many(outputs=remaining, flush=True)
+                    # finally, write the remaining sequences; if they don't all fit, we repeat
+                    remaining = memwriter.write_many(outputs=remaining, flush=True)
 
                 accumulator = []
 
                 memwriter.flush()
 
-        cls.increment_progressbar(queue, documents=documents_cnt, tokens=tokens_cnt)
+                # the accumulator is empty here, so the files in the ring and the ones left are all the state
+                # a new process needs to continue; the current memmap is closed, and the new process starts
+                # the next one.
+                if (len(source_paths) > 0 or len(tokenizer_ring) > 0) and (
+                    (recycle_after_documents and process_documents_cnt >= recycle_after_documents)
+                    or (recycle_above_rss and get_peak_rss() >= recycle_above_rss)
+                ):
+                    next_handoff = {
+                        "sources": source_paths,
+                        "ring": list(zip(tokenizer_paths, tokenizer_locs)),
+                        "memmap": mm_cnt + 1,
+                    }
+                    break
+
+        cls.increment_progressbar(queue, documents=documents_cnt, tokens=tokens_cnt, duplicates=duplicates_cnt)
+
+        if next_handoff is not None:
+            raise DolmaHandoff({"handoff": next_handoff})
 
     def __call__(self, num_readers: Optional[int] = None, **process_single_kwargs: Any):
         """Run the processor."""
 
+        # processes that hand off their files must exit, so that the files continue in a new process
+        if process_single_kwargs.get("recycle_after_documents") or process_single_kwargs.get("recycle_above_rss"):
+            self.MAX_TASKS_PER_CHILD = 1
+
         # get all source paths; shuffle them well
         all_source_paths = [p for source in self.src_prefixes for p in glob_path(source)]
         random.shuffle(all_source_paths)
@@ -305,6 +388,18 @@ def tokenize_in_parallel(
     sample_ring_prop: bool = False,
     refresh_tokenizer: int = 0,
     use_fast_tokenizer: bool = True,
+    encode_batch_size: int = 64,
+    tokenizer_threads: Optional[int] = None,
+    global_shuffle: bool = False,
+    shuffle_dir: Optional[str] = None,
+    sequence_length: Optional[int] = None,
+    packing_policy: str = "best_fit",
+    dedupe: Optional[str] = None,
+    dedupe_dir: Optional[str] = None,
+    dedupe_bloom_size: int = 1024 * 1024 * 1024,
+    cache_dir: Optional[str] = None,
+    recycle_after_documents: Optional[int] = None,
+    recycle_above_rss: Optional[int] = None,
 ):
     """
     Tokenizes the input sources in parallel using multiple writers and readers.
@@ -334,10 +429,45 @@ def tokenize_in_parallel(
         refresh_tokenizer (int, optional): Number of batches after which to refresh the tokenizer.
             Defaults to 0, which means the tokenizer will not be refreshed.
         use_fast_tokenizer (bool, optional): Whether to use the fast tokenizer. Defaults to True.
+        encode_batch_size (int, optional): Number of documents of a file to encode with a single call to the
+            tokenizer. Defaults to 64.
+        tokenizer_threads (int, optional): Number of threads each writer process uses to encode a batch.
+            Defaults to None, which splits the available cores evenly across writers.
+        global_shuffle (bool, optional): Whether to shuffle documents across all files rather than within
+            `local_shuffle` documents. Documents are first tokenized to `shuffle_dir`, then permuted and gathered
+            into `destination`. Defaults to False.
+        shuffle_dir (str, optional): Local directory for the first pass of a global shuffle; it needs room for
+            all tokens. Defaults to None, which uses a temporary directory.
+        sequence_length (int, optional): If provided, documents are packed into sequences of this many tokens,
+            and a `.boundaries.npy` index of the documents in each sequence is written next to each memmap.
+            Defaults to None, which writes documents back to back.
+        packing_policy (str, optional): How to pack documents into sequences: "best_fit" only splits documents
+            longer than a sequence and pads the rest, "concat" splits documents at sequence boundaries.
+            Defaults to "best_fit".
+        dedupe (str, optional): If provided, documents with the same tokens as a document written before are
+            detected using a bloom filter shared by all writers; "drop" skips them, "count" only counts them.
+            Defaults to None, which does not check for duplicates.
+        dedupe_dir (str, optional): Local directory for the bloom filter. Defaults to None, which uses a
+            temporary directory.
+        dedupe_bloom_size (int, optional): Size of the bloom filter in bytes; about 10 bits per document keep
+            false positives around 1%. Defaults to 1024 * 1024 * 1024.
+        cache_dir (str, optional): If provided, each source file is tokenized into its own memmap in this local
+            directory, keyed by the fingerprint of the file and the tokenizer configuration; files that are
+            already in the cache are not tokenized again. The destination is assembled from the memmaps of all
+            source files, which also shuffles documents globally. Defaults to None, which disables the cache.
+        recycle_after_documents (int, optional): If provided, a writer process that has read this many
+            documents hands off the files it has not finished to a new process, which continues where it
+            stopped; this bounds memory leaks in the tokenizer without the stalls of `refresh_tokenizer`.
+            Defaults to None, which keeps processes until they are done.
+        recycle_above_rss (int, optional): If provided, a writer process whose peak memory exceeds this many
+            bytes hands off its files to a new process, as for `recycle_after_documents`. Defaults to None.
     """
     # variables to avoid issues with parallelism
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+    # threads and writer processes should not oversubscribe the cores
+    tokenizer_threads = tokenizer_threads or max(1, multiprocessing.cpu_count() // max(1, num_writers))
+
     # do it once so it gets cached (unless it's local path, so no need)
     if not os.path.exists(tokenizer_name_or_path):
         Tokenizer.from_pretrained(
@@ -352,32 +482,131 @@ def tokenize_in_parallel(
     run_hash = hashlib.sha256(("".join(sources) + tokenizer_name_or_path).encode("utf-8")).hexdigest()[:8]
     metadata_dir = metadata_dir or join_path(None, tempfile.gettempdir(), f"dolma-{run_hash}")
 
-    parallel_writer = MemMapParallelWriter(
-        source_prefix=sources,
-        # the call action will actually get the first destination and
-        # make relative paths from there. Unfortunately, BaseParallelProcessor
-        # expects as many destinations as there are sources, so we employ
-        # this "hack" (that is, repeating destination len(sources) times)
-        # to get around that. Same thing applies to metadata_dir.
-        destination_prefix=[destination for _ in sources],
-        metadata_prefix=[metadata_dir for _ in sources],
-        num_processes=num_writers,
-        seed=seed,
-        debug=debug,
-    )
-    parallel_writer(
-        num_readers=num_readers,
-        local_shuffle=local_shuffle,
-        ring_size=ring_size,
-        max_size=max_size,
-        dtype=dtype,
-        bos_token_id=bos_token_id,
-        pad_token_id=pad_token_id,
-        eos_token_id=eos_token_id,
-        segment_before_tokenization=segment_before_tokenization,
-        encode_special_tokens=encode_special_tokens,
-        tokenizer_name_or_path=tokenizer_name_or_path,
-        sample_ring_prop=sample_ring_prop,
-        use_fast_tokenizer=use_fast_tokenizer,
-        refresh_tokenizer=refresh_tokenizer,
-    )
+    if cache_dir is not None and dedupe is not None:
+        raise ValueError("Dedupe is not supported when tokenizing incrementally")
+
+    with ExitStack() as stack:
+        dedupe_bloom_path: Optional[str] = None
+        if dedupe is not None:
+            if dedupe not in DEDUPE_MODES:
+                raise ValueError(f"Invalid dedupe mode {dedupe}; must be one of {', '.join(DEDUPE_MODES)}")
+            dedupe_dir = dedupe_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="dolma-dedupe-"))
+            if not is_local(dedupe_dir):
+                raise ValueError(f"Directory for dedupe must be local, got {dedupe_dir}")
+            mkdir_p(dedupe_dir)
+            dedupe_bloom_path = join_path(None, dedupe_dir, f"dolma-{run_hash}.bloom")
+            TokensBloomFilter.create(path=dedupe_bloom_path, size_in_bytes=dedupe_bloom_size)
+
+        if global_shuffle or cache_dir is not None:
+            # documents are tokenized first, then permuted and gathered into destination; plans of the output
+            # files are written to a local scratch directory.
+            scratch_dir: str = shuffle_dir or stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="dolma-shuffle-")
+            )
+            if not is_local(scratch_dir):
+                raise ValueError(f"Directory for global shuffle must be local, got {scratch_dir}")
+
+        if cache_dir is not None:
+            # incremental: only source files that are not in the cache are tokenized, each to its own memmap
+            if not is_local(cache_dir):
+                raise ValueError(f"Directory for the tokenization cache must be local, got {cache_dir}")
+
+            tokenizer_kwargs: Dict[str, Any] = {
+                "tokenizer_name_or_path": tokenizer_name_or_path,
+                "bos_token_id": bos_token_id,
+                "eos_token_id": eos_token_id,
+                "segment_before_tokenization": segment_before_tokenization,
+                "encode_special_tokens": encode_special_tokens,
+                "use_fast_tokenizer": use_fast_tokenizer,
+            }
+
+            source_paths = sorted(p for source in sources for p in glob_path(source))
+            cache_paths = get_cache_paths(
+                source_paths=source_paths,
+                cache_dir=cache_dir,
+                tokenizer_fingerprint=get_tokenizer_fingerprint(dtype=dtype, **tokenizer_kwargs),
+            )
+            cache_writer = MemMapCacheWriter(
+                source_prefix=sources,
+                destination_prefix=[cache_dir for _ in sources],
+                metadata_prefix=[cache_dir for _ in sources],
+                num_processes=num_writers,
+                seed=seed,
+                debug=debug,
+            )
+            cache_writer(
+                source_paths=source_paths,
+                cache_paths=cache_paths,
+                dtype=dtype,
+                pad_token_id=pad_token_id,
+                refresh_tokenizer=refresh_tokenizer,
+                encode_batch_size=encode_batch_size,
+                tokenizer_threads=tokenizer_threads,
+                **tokenizer_kwargs,
+            )
+            memmap_paths = [f"{path}{MemmapWriter.MEMMAP_EXTENSION}" for path in cache_paths]
+        else:
+            if global_shuffle:
+                tokens_destination = join_path(None, scratch_dir, "tokens")
+                tokens_metadata_dir = join_path(None, metadata_dir, "tokenize")
+            else:
+                tokens_destination, tokens_metadata_dir = destination, metadata_dir
+
+            parallel_writer = MemMapParallelWriter(
+                source_prefix=sources,
+                # the call action will actually get the first destination and
+                # make relative paths from there. Unfortunately, BaseParallelProcessor
+                # expects as many destinations as there are sources, so we employ
+                # this "hack" (that is, repeating destination len(sources) times)
+                # to get around that. Same thing applies to metadata_dir.
+                destination_prefix=[tokens_destination for _ in sources],
+                metadata_prefix=[tokens_metadata_dir for _ in sources],
+                num_processes=num_writers,
+                seed=seed,
+                debug=debug,
+            )
+            parallel_writer(
+                num_readers=num_readers,
+                local_shuffle=local_shuffle,
+                ring_size=ring_size,
+                max_size=max_size,
+                dtype=dtype,
+                bos_token_id=bos_token_id,
+                pad_token_id=pad_token_id,
+                eos_token_id=eos_token_id,
+                segment_before_tokenization=segment_before_tokenization,
+                encode_special_tokens=encode_special_tokens,
+                tokenizer_name_or_path=tokenizer_name_or_path,
+                sample_ring_prop=sample_ring_prop,
+                use_fast_tokenizer=use_fast_tokenizer,
+                refresh_tokenizer=refresh_tokenizer,
+                encode_batch_size=encode_batch_size,
+                tokenizer_threads=tokenizer_threads,
+                # when shuffling globally, documents are packed in the second pass
+                sequence_length=None if global_shuffle else sequence_length,
+                packing_policy=packing_policy,
+                dedupe=dedupe,
+                dedupe_bloom_path=dedupe_bloom_path,
+                recycle_after_documents=recycle_after_documents,
+                recycle_above_rss=recycle_above_rss,
+            )
+
+            if not global_shuffle:
+                return
+            memmap_paths = find_memmap_paths(tokens_destination)
+
+        reshard_memmaps(
+            memmap_paths=memmap_paths,
+            destination=destination,
+            scratch_dir=scratch_dir,
+            metadata_dir=join_path(None, metadata_dir, "shuffle"),
+            max_tokens=max_size,
+            dtype=dtype,
+            shuffle=True,
+            num_processes=num_writers,
+            seed=seed,
+            debug=debug,
+            sequence_length=sequence_length,
+            pad_token_id=pad_token_id if pad_token_id is not None else eos_token_id,
+            packing_policy=packing_policy,
+        )
@@ -0,0 +1,215 @@
+"""
+Random access to the output of `dolma tokens`. A `MemmapReader` opens one memmap and its metadata, and a
+`MemmapDataset` opens all the memmaps in a directory as a single sequence of documents. The metadata of each
+memmap is parsed once into a binary index (start and end offsets, and a hash of the id of each document), which
+is cached, so that opening a dataset again does not parse any CSV.
+"""
+
+import csv
+import os
+from hashlib import blake2b
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import smart_open
+
+from ..core.paths import (
+    get_cache_dir,
+    glob_path,
+    is_local,
+    join_path,
+    mkdir_p,
+    resource_to_filename,
+)
+from .memmap_writer import MemmapWriter, PackedMemmapWriter
+from .tokenizer import Tokenizer
+
+__all__ = ["MemmapDataset", "MemmapReader", "find_memmap_paths"]
+
+
+def find_memmap_paths(paths: Union[str, List[str]]) -> List[str]:
+    """Memmap files in one or more directories, or matching one or more globs of memmap files. Files of each
+    directory or glob are sorted; boundaries of packed memmaps are skipped."""
+    memmap_paths: List[str] = []
+    for path in [paths] if isinstance(paths, str) else paths:
+        pattern = path if path.endswith(MemmapWriter.MEMMAP_EXTENSION) else f"{path.rstrip('/')}/*.npy"
+        memmap_paths.extend(
+            sorted(p for p in glob_path(pattern) if not p.endswith(PackedMemmapWriter.BOUNDARIES_EXTENSION))
+        )
+    return memmap_paths
+
+
+def _hash_id(doc_id: str) -> int:
+    return int.from_bytes(blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MemmapReader:
+    """Read-only access to the documents in a memmap written by `MemmapWriter`. Documents are in the order of
+    the rows of the metadata file; for packed memmaps, each piece of a split document is a document."""
+
+    def __init__(self, path: str, dtype: Union[str, np.dtype] = "uint16", cache_dir: Optional[str] = None):
+        """Open a memmap file.
+
+        Args:
+            path (str): Location of the memmap file; must be local.
+            dtype (Union[str, np.dtype], optional): Data type of the memmap file. Defaults to "uint16".
+            cache_dir (str, optional): Directory where to cache the index of the metadata. Defaults to a
+                directory in the dolma cache.
+        """
+        if not is_local(path):
+            raise ValueError(f"Memmap files must be local, got {path}")
+
+        self.memmap_path = path
+        self.metadata_path = path[: -len(MemmapWriter.MEMMAP_EXTENSION)] + MemmapWriter.METADATA_EXTENSION
+        self.dtype = np.dtype(dtype)
+        self.cache_dir = cache_dir or join_path(None, get_cache_dir(), "memmap-index")
+
+        self.offsets, self.id_hashes = self._load_index()
+        size = os.path.getsize(self.memmap_path) // self.dtype.itemsize
+        self.tokens = np.memmap(self.memmap_path, dtype=self.dtype, mode="r") if size else np.empty(0, self.dtype)
+
+    def _load_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Offsets (shape (num_documents, 2)) and id hashes of the documents, from the cache if the metadata
+        has not changed since it was indexed, otherwise from the metadata."""
+        stat = os.stat(self.metadata_path)
+        key = f"{os.path.abspath(self.metadata_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        cache_path = join_path(None, self.cache_dir, f"{resource_to_filename(key)}.npz")
+
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as index:
+                return index["offsets"], index["id_hashes"]
+
+        offsets, id_hashes = [], []
+        with smart_open.open(self.metadata_path, "rt") as f:
+            for start, end, doc_id, *_ in csv.reader(f):
+                offsets.append((int(start), int(end)))
+                id_hashes.append(_hash_id(doc_id))
+
+        offsets_array = np.array(offsets, dtype=np.int64).reshape(-1, 2)
+        id_hashes_array = np.array(id_hashes, dtype=np.uint64)
+
+        # write to a temporary file first, so that readers in other processes never see a partial index
+        mkdir_p(self.cache_dir)
+        with open(tmp_path := f"{cache_path}.{os.getpid()}.tmp", "wb") as f:
+            np.savez(f, offsets=offsets_array, id_hashes=id_hashes_array)
+        os.replace(tmp_path, cache_path)
+
+        return offsets_array, id_hashes_array
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, index: int) -> np.ndarray:
+        """Tokens of the document at `index`; this is a view of the memmap, not a copy."""
+        start, end = self.offsets[index]
+        return self.tokens[start:end]
+
+
+class MemmapDataset:
+    """Read-only access to all documents in a directory of memmaps (e.g., the destination of `dolma tokens`),
+    in the order of the memmap files and of the documents in each. Supports constant-time access by position,
+    lookup by id, iteration, and gathering of batches of documents.
+
+    Example:
+
+    ```python
+    dataset = MemmapDataset("tokenized/", tokenizer=Tokenizer.from_file("tokenizer.json", eos_token_id=0))
+    tokens = dataset.get(1000)
+    text = dataset.decode(dataset.find("doc-42"))
+    tokens, offsets = dataset.gather([1, 5, 7])
+    ```
+    """
+
+    def __init__(
+        self,
+        paths: Union[str, List[str]],
+        dtype: Union[None, str, np.dtype] = None,
+        tokenizer: Optional[Tokenizer] = None,
+        cache_dir: Optional[str] = None,
+    ):
+        """Open a tokenized dataset.
+
+        Args:
+            paths (Union[str, List[str]]): One or more directories containing memmap files, or globs of memmap
+                files; memmap files must be local.
+            dtype (Union[None, str, np.dtype], optional): Data type of the memmap files. Defaults to the dtype of
+                the tokenizer if one is provided, otherwise "uint16".
+            tokenizer (Tokenizer, optional): Tokenizer used to decode documents.
+            cache_dir (str, optional): Directory where to cache the index of each memmap; see `MemmapReader`.
+        """
+        self.tokenizer = tokenizer
+        self.dtype = np.dtype(dtype or (tokenizer.dtype if tokenizer is not None else "uint16"))
+
+        memmap_paths = find_memmap_paths(paths)
+        if not memmap_paths:
+            raise FileNotFoundError(f"No memmap files found in {paths}")
+
+        self.readers = [MemmapReader(path=p, dtype=self.dtype, cache_dir=cache_dir) for p in memmap_paths]
+
+        # position of the first document of each reader, and the global index of the offsets of all documents
+        self._firsts = np.cumsum([0] + [len(reader) for reader in self.readers])
+        self._offsets = np.concatenate([reader.offsets for reader in self.readers])
+
+        # lookup by id: sorted hashes of the ids, and the position of the document each hash belongs to
+        id_hashes = np.concatenate([reader.id_hashes for reader in self.readers])
+        self._id_order = np.argsort(id_hashes, kind="stable")
+        self._sorted_id_hashes = id_hashes[self._id_order]
+
+    def __len__(self) -> int:
+        return int(self._firsts[-1])
+
+    def _locate(self, indices: np.ndarray) -> np.ndarray:
+        """Reader that holds each of `indices`."""
+        if len(indices) and (indices.min() < -len(self) or indices.max() >= len(self)):
+            raise IndexError(f"Document index out of range for dataset of {len(self)} documents")
+        return np.searchsorted(self._firsts, indices % max(len(self), 1), side="right") - 1
+
+    def get(self, index: int) -> np.ndarray:
+        """Tokens of the document at `index`; this is a view of a memmap, not a copy."""
+        (reader,) = self._locate(np.array([index]))
+        start, end = self._offsets[index]
+        return self.readers[reader].tokens[start:end]
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.get(index)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for reader in self.readers:
+            for start, end in reader.offsets.tolist():
+                yield reader.tokens[start:end]
+
+    def find(self, doc_id: str) -> Optional[int]:
+        """Position of the document with id `doc_id`, or None if there is no such document. Lookup uses a 64-bit
+        hash of the id; if more than one document has the same id, the first one is returned."""
+        id_hash = np.uint64(_hash_id(doc_id))
+        i = int(np.searchsorted(self._sorted_id_hashes, id_hash, side="left"))
+        if i < len(self._sorted_id_hashes) and self._sorted_id_hashes[i] == id_hash:
+            return int(self._id_order[i])
+        return None
+
+    def gather(self, indices: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Tokens of the documents at `indices`, concatenated in the order of `indices`, and the offsets of each
+        document in them (document `i` is `tokens[offsets[i]:offsets[i + 1]]`). Tokens are read with one fancy
+        index per memmap file, rather than one slice per document."""
+        indices_array = np.asarray(indices, dtype=np.int64)
+        readers = self._locate(indices_array)
+        starts, ends = self._offsets[indices_array, 0], self._offsets[indices_array, 1]
+
+        lengths = ends - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        tokens = np.empty(int(offsets[-1]), dtype=self.dtype)
+
+        # position of each output token in its memmap: start of its document plus its position in the document
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(len(tokens))
+        token_readers = np.repeat(readers, lengths)
+        for reader in np.unique(readers).tolist():
+            mask = token_readers == reader
+            tokens[mask] = self.readers[reader].tokens[positions[mask]]
+
+        return tokens, offsets
+
+    def decode(self, index: int, skip_special_tokens: bool = True) -> str:
+        """Text of the document at `index`; requires a tokenizer."""
+        if self.tokenizer is None:
+            raise ValueError("A tokenizer is required to decode documents")
+        return self.tokenizer.decode(self.get(index).tolist(), skip_special_tokens=skip_special_tokens)
@@ -1,11 +1,14 @@
 import functools
+import io
 import os
 import re
+import shutil
+from bisect import bisect_left, insort
 from contextlib import ExitStack
 from csv import writer
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List, Optional, TextIO
+from typing import List, Optional, TextIO, Tuple
 
 import numpy as np
 import smart_open
@@ -17,9 +20,15 @@ log = get_logger(__name__)
 
 
 class MemmapWriter:
-    """Context manager responsible for writing, resizing, and closing / uploading a memmap file."""
+    """Context manager responsible for writing, resizing, and closing / uploading a memmap file.
+
+    The memmap file starts small and grows in chunks as tokens are written, up to `max_tokens`; on close, it is
+    truncated in place to the number of tokens written, so the file is never preallocated to its maximum size
+    nor copied to shrink it."""
 
     DEFAULT_MAX_TOKENS = 512 * 1024 * 1024  # 500M tokens / 1GB
+    GROWTH_CHUNK_TOKENS = 32 * 1024 * 1024  # 32M tokens / 64MB
+    UPLOAD_CHUNK_BYTES = 64 * 1024 * 1024  # 64MB
     MEMMAP_EXTENSION = ".npy"
     METADATA_EXTENSION = ".csv.gz"
 
@@ -40,12 +49,13 @@ class MemmapWriter:
         base_path = re.sub(r"(\.npy?)?(\.[a-zA-Z]+)*$", "", path)
         self.memmap_path = f"{base_path}{self.MEMMAP_EXTENSION}"
         self.metadata_path = f"{base_path}{self.METADATA_EXTENSION}"
-        self.dtype = dtype
+        self.dtype = np.dtype(dtype)
         self.max_tokens = max_tokens
 
         self._local_memmap_path: Optional[Path] = None
         self._local_metadata_path: Optional[Path] = None
         self._written_tokens = 0
+        self._capacity = 0
         self._memmap_file: Optional[np.memmap] = None
         self._metadata_file: Optional[TextIO] = None
 
@@ -59,6 +69,31 @@ class MemmapWriter:
         """Length of the memmap file in tokens that have been written."""
         return self._written_tokens
 
+    def _open_memmap(self, capacity: int):
+        """(Re)map the local memmap file with room for `capacity` tokens, growing the file if needed;
+        tokens already written are preserved, since the file is extended in place rather than copied."""
+        assert self._local_memmap_path is not None, "Local Memmap path is not provided"
+
+        if self._memmap_file is not None:
+            self._memmap_file.flush()
+            self._memmap_file = None
+
+        # extending the file with truncate leaves a sparse tail, so growing is cheap.
+        os.truncate(self._local_memmap_path, capacity * self.dtype.itemsize)
+        self._memmap_file = np.memmap(
+            mode="r+", filename=self._local_memmap_path, dtype=self.dtype, shape=(capacity,)
+        )
+        self._capacity = capacity
+
+    def _ensure_capacity(self, num_tokens: int):
+        """Make sure the memmap file can hold `num_tokens` tokens; capacity grows geometrically, in multiples
+        of `GROWTH_CHUNK_TOKENS`, and never past `max_tokens`."""
+        if self._memmap_file is not None and num_tokens <= self._capacity:
+            return
+        capacity = max(num_tokens, 2 * self._capacity, self.GROWTH_CHUNK_TOKENS)
+        capacity = -(-capacity // self.GROWTH_CHUNK_TOKENS) * self.GROWTH_CHUNK_TOKENS
+        self._open_memmap(min(capacity, max(num_tokens, self.max_tokens)))
+
     def write(self, output: TokenizerOutput, flush: bool = False) -> bool:
         """Write a list of token IDs to the memmap file; if only a subset of the values can be written,
         return the rest.
@@ -68,7 +103,7 @@ class MemmapWriter:
             flush (bool, optional): Whether to flush the memmap file after writing. Defaults to False.
         """
 
-        if self._memmap_file is None:
+        if self._local_memmap_path is None:
             raise RuntimeError("MemmapFile is not open")
 
         if self._metadata_file is None:
@@ -85,6 +120,8 @@ class MemmapWriter:
             start=self._written_tokens,
             end=self._written_tokens + output.end,
         )
+        self._ensure_capacity(self._written_tokens + output.end)
+        assert self._memmap_file is not None
         self._memmap_file[self._written_tokens : self._written_tokens + output.end] = output.tokens
         self._written_tokens += output.end
 
@@ -97,17 +134,48 @@ class MemmapWriter:
         return True
 
     def write_many(self, outputs: List[TokenizerOutput], flush: bool = False) -> List[TokenizerOutput]:
-        remaining: List[TokenizerOutput] = []
+        """Write a batch of tokenized documents to the memmap file in one go; documents are written in order
+        until one does not fit (see `write`), and the ones that were not written are returned.
 
-        for i, output in enumerate(outputs):
-            if not self.write(output=output):
-                remaining = outputs[i:]
-                break
+        Args:
+            outputs (List[TokenizerOutput]): Tokenized documents to write.
+            flush (bool, optional): Whether to flush the memmap file after writing. Defaults to False.
+        """
+        if self._local_memmap_path is None:
+            raise RuntimeError("MemmapFile is not open")
+
+        if self._metadata_file is None:
+            raise RuntimeError("Metadata file is not open")
+
+        # offsets of the end of each document if they were all written; the ones that would end at or past
+        # `max_tokens` don't fit, and neither do any that follow them.
+        ends = self._written_tokens + np.cumsum([len(output.tokens) for output in outputs], dtype=np.int64)
+        fit = int(np.searchsorted(ends, self.max_tokens, side="left"))
+
+        if fit > 0:
+            starts = np.concatenate(([self._written_tokens], ends[: fit - 1]))
+            last = int(ends[fit - 1])
+
+            # unsafe casting matches what assigning each document to a slice of the memmap would do
+            self._ensure_capacity(last)
+            assert self._memmap_file is not None
+            tokens = np.concatenate(
+                [output.tokens for output in outputs[:fit]], dtype=self.dtype, casting="unsafe"
+            )
+            self._memmap_file[self._written_tokens : last] = tokens
+            self._written_tokens = last
+
+            buffer = io.StringIO()
+            writer(buffer).writerows(
+                MemmapMetadata(id=output.id, src=output.src, loc=output.loc, start=start, end=end)
+                for output, start, end in zip(outputs, starts.tolist(), ends[:fit].tolist())
+            )
+            self._metadata_file.write(buffer.getvalue())
 
         if flush:
             self.flush()
 
-        return remaining
+        return outputs[fit:]
 
     def flush(self):
         """Flush the memmap file."""
@@ -150,12 +218,12 @@ class MemmapWriter:
         assert self._local_memmap_path is not None
         assert self._local_metadata_path is not None
 
-        self._memmap_file = np.memmap(
-            mode="w+", filename=self._local_memmap_path, dtype=self.dtype, shape=(self.max_tokens,)
-        )
+        # the file is created empty; `_ensure_capacity` grows it as tokens are written.
+        self._local_memmap_path.touch()
+        self._written_tokens = self._capacity = 0
         self._metadata_file = smart_open.open(self._local_metadata_path, mode="wt")
 
-        log.info(f"Created memmap file at {self._local_memmap_path} of size {self._memmap_file.nbytes:,} bytes")
+        log.info(f"Created memmap file at {self._local_memmap_path}")
 
         return self
 
@@ -167,7 +235,6 @@ class MemmapWriter:
         """Close the memmap file and optionally upload it to the destination (in the case of a remote path)."""
         assert self._local_memmap_path is not None, "Local Memmap path is not provided"
         assert self._local_metadata_path is not None, "Local Metadata path is not provided"
-        assert self._memmap_file is not None, "Memmap file is not open"
         assert self._metadata_file is not None, "Metadata file is not open"
 
         try:
@@ -175,28 +242,21 @@ class MemmapWriter:
             self.flush()
             self._metadata_file.close()
 
-            # we resize the memmap to the number of tokens actually written
-            if self._written_tokens < self.max_tokens and self._written_tokens > 0:
-                del self._memmap_file
-                os.rename(self._local_memmap_path, (temp_path := self._local_memmap_path.with_suffix(".tmp")))
-                new_memmap = np.memmap(
-                    mode="w+", filename=self._local_memmap_path, dtype=self.dtype, shape=(self._written_tokens,)
-                )
-                old_memmap = np.memmap(mode="r", filename=temp_path, dtype=self.dtype, shape=(self.max_tokens,))
-                new_memmap[:] = old_memmap[: self._written_tokens]
-                new_memmap.flush()
-                log.info(f"Resized memmap file from {old_memmap.nbytes:,} to {new_memmap.nbytes:,} bytes")
-                os.remove(temp_path)
+            # the memmap might be larger than the tokens actually written; truncate it in place.
+            self._memmap_file = None
+            os.truncate(self._local_memmap_path, self._written_tokens * self.dtype.itemsize)
+            log.info(f"Closed memmap file with {self._written_tokens * self.dtype.itemsize:,} bytes")
 
             if self.is_remote_path:
                 with ExitStack() as stack:
+                    # stream in chunks, so the file is uploaded in parts rather than read into memory
                     f = stack.enter_context(smart_open.open(self._local_memmap_path, "rb"))
                     g = stack.enter_context(smart_open.open(self.memmap_path, mode="wb"))
-                    g.write(f.read())
+                    shutil.copyfileobj(f, g, length=self.UPLOAD_CHUNK_BYTES)
 
                     f = stack.enter_context(smart_open.open(self._local_metadata_path, "rb"))
                     g = stack.enter_context(smart_open.open(self.metadata_path, mode="wb"))
-                    g.write(f.read())
+                    shutil.copyfileobj(f, g, length=self.UPLOAD_CHUNK_BYTES)
 
                 log.info(f"Written memmap file to {self.memmap_path}")
         finally:
@@ -207,9 +267,197 @@ class MemmapWriter:
         # reset to none, clear cache
         self._local_memmap_path = self._memmap_file = None
         self._local_metadata_path = self._metadata_file = None
+        self._capacity = 0
 
         try:
             del self.metadata_writer
         except AttributeError:
             # this is in case the metadata file was never opened
             pass
+
+
+PACKING_POLICIES = ("best_fit", "concat")
+
+
+class PackedMemmapWriter(MemmapWriter):
+    """A memmap writer that packs documents into sequences of exactly `sequence_length` tokens, so that the memmap
+    can be read as an array of shape (-1, sequence_length). Space left in a sequence is filled with `pad_token_id`.
+
+    Documents are packed as they are written, using one of two policies:
+        - `best_fit`: a document goes in the open sequence with the least space that fits it, or in a new
+          sequence if none does; documents are only split if they are longer than `sequence_length`.
+        - `concat`: documents are concatenated and split at sequence boundaries, so there is no padding.
+
+    Alongside the memmap and its metadata (one row per piece of document), the writer saves the boundaries of
+    the pieces in each sequence to a `.boundaries.npy` file, an array of shape (num_pieces, 4) with rows
+    (sequence, start, end, metadata row), sorted by sequence and start; data loaders can load it with
+    `np.load(..., mmap_mode="r")` instead of parsing the metadata. Pieces of a split document have consecutive
+    metadata rows, in the order of their tokens."""
+
+    BOUNDARIES_EXTENSION = ".boundaries.npy"
+    MAX_OPEN_SEQUENCES = 1024
+
+    def __init__(
+        self,
+        path: str,
+        dtype: np.dtype,
+        sequence_length: int,
+        pad_token_id: int,
+        max_tokens: int = MemmapWriter.DEFAULT_MAX_TOKENS,
+        policy: str = "best_fit",
+    ):
+        """Create a new packed memmap file.
+
+        Args:
+            path (str): Location for the memmap file; see `MemmapWriter`.
+            dtype (np.dtype): Data type for the memmap file; must be a valid numpy dtype.
+            sequence_length (int): Number of tokens in each packed sequence.
+            pad_token_id (int): Token ID used to fill the space left in sequences.
+            max_tokens (int, optional): Maximum number of tokens per file, padding included.
+            policy (str, optional): How to pack documents, either `best_fit` or `concat`. Defaults to `best_fit`.
+        """
+        super().__init__(path=path, dtype=dtype, max_tokens=max_tokens)
+        if policy not in PACKING_POLICIES:
+            raise ValueError(f"Invalid packing policy {policy}; must be one of {PACKING_POLICIES}")
+        if not 0 < sequence_length < max_tokens:
+            raise ValueError(f"Sequence length must be positive and less than max_tokens, got {sequence_length}")
+
+        self.boundaries_path = self.memmap_path[: -len(self.MEMMAP_EXTENSION)] + self.BOUNDARIES_EXTENSION
+        self.sequence_length = sequence_length
+        self.pad_token_id = pad_token_id
+        self.policy = policy
+        self.max_sequences = (max_tokens - 1) // sequence_length
+
+        # space left and index of the sequences documents can still go in, sorted by space left
+        self._open_sequences: List[Tuple[int, int]] = []
+        self._boundaries: List[Tuple[int, int, int, int]] = []
+        self._metadata_rows = 0
+
+    @property
+    def num_sequences(self) -> int:
+        return self._written_tokens // self.sequence_length
+
+    def _plan(self, length: int) -> Optional[List[Tuple[int, int, int]]]:
+        """Where the pieces of a document of `length` tokens go, as (sequence, offset in sequence, number of
+        tokens); sequences that don't exist yet are numbered after the last one. None if they don't all fit."""
+        sequence_length, next_sequence = self.sequence_length, self.num_sequences
+        pieces: List[Tuple[int, int, int]] = []
+
+        if self.policy == "concat":
+            # fill the last sequence first, then as many new ones as needed
+            if self._open_sequences and length > 0:
+                space, sequence = self._open_sequences[-1]
+                pieces.append((sequence, sequence_length - space, min(space, length)))
+                length -= pieces[-1][2]
+        else:
+            # full sequences for documents longer than the sequence length; the rest goes where it fits best
+            tail = length % sequence_length
+            if tail and (i := bisect_left(self._open_sequences, (tail, -1))) < len(self._open_sequences):
+                space, sequence = self._open_sequences[i]
+                pieces.append((sequence, sequence_length - space, tail))
+                length -= tail
+
+        while length > 0:
+            pieces.append((next_sequence, 0, min(length, sequence_length)))
+            length -= pieces[-1][2]
+            next_sequence += 1
+
+        return pieces if next_sequence <= self.max_sequences else None
+
+    def _take_space(self, sequence: int, offset: int, used: int):
+        """Update the space left in a sequence after `used` tokens are put in it at `offset`."""
+        if offset > 0:
+            # the sequence was open; it is removed, and put back below if it still has space left
+            self._open_sequences.pop(bisect_left(self._open_sequences, (self.sequence_length - offset, sequence)))
+
+        if (space := self.sequence_length - offset - used) > 0:
+            if self.policy == "concat":
+                # only the last sequence stays open when concatenating
+                self._open_sequences = [(space, sequence)]
+            else:
+                insort(self._open_sequences, (space, sequence))
+                if len(self._open_sequences) > self.MAX_OPEN_SEQUENCES:
+                    # the fullest sequence is the least likely to fit another document; we close it.
+                    self._open_sequences.pop(0)
+
+    def write(self, output: TokenizerOutput, flush: bool = False) -> bool:
+        """Pack a document in the memmap file; return false if it does not fit."""
+        return not self.write_many(outputs=[output], flush=flush)
+
+    def write_many(self, outputs: List[TokenizerOutput], flush: bool = False) -> List[TokenizerOutput]:
+        """Pack documents in the memmap file in order, until one does not fit; return the ones not written."""
+        if self._local_memmap_path is None:
+            raise RuntimeError("MemmapFile is not open")
+
+        if self._metadata_file is None:
+            raise RuntimeError("Metadata file is not open")
+
+        rows: List[MemmapMetadata] = []
+        remaining: List[TokenizerOutput] = []
+        for i, output in enumerate(outputs):
+            if (pieces := self._plan(len(output.tokens))) is None:
+                remaining = outputs[i:]
+                break
+
+            # new sequences are filled with padding before documents are placed in them
+            if (num_sequences := max(sequence for sequence, _, _ in pieces) + 1) > self.num_sequences:
+                self._ensure_capacity(end := num_sequences * self.sequence_length)
+                assert self._memmap_file is not None
+                self._memmap_file[self._written_tokens : end] = self.pad_token_id
+                self._written_tokens = end
+
+            assert self._memmap_file is not None
+            tokens = np.asarray(output.tokens)
+            consumed = 0
+            for sequence, offset, length in pieces:
+                start = sequence * self.sequence_length + offset
+                self._memmap_file[start : start + length] = tokens[consumed : consumed + length]
+                self._boundaries.append((sequence, offset, offset + length, self._metadata_rows + len(rows)))
+                rows.append(
+                    MemmapMetadata(id=output.id, src=output.src, loc=output.loc, start=start, end=start + length)
+                )
+                self._take_space(sequence, offset, length)
+                consumed += length
+
+        if rows:
+            buffer = io.StringIO()
+            writer(buffer).writerows(rows)
+            self._metadata_file.write(buffer.getvalue())
+            self._metadata_rows += len(rows)
+
+        if flush:
+            self.flush()
+
+        return remaining
+
+    def close(self):
+        """Save the boundaries of the pieces in each sequence, then close the memmap file."""
+        boundaries = np.array(sorted(self._boundaries), dtype=np.int64).reshape(-1, 4)
+        with smart_open.open(self.boundaries_path, "wb") as f:
+            np.save(f, boundaries)
+
+        self._open_sequences, self._boundaries, self._metadata_rows = [], [], 0
+        return super().close()
+
+
+def make_memmap_writer(
+    path: str,
+    dtype: np.dtype,
+    max_tokens: int = MemmapWriter.DEFAULT_MAX_TOKENS,
+    sequence_length: Optional[int] = None,
+    pad_token_id: Optional[int] = None,
+    packing_policy: str = "best_fit",
+) -> MemmapWriter:
+    """Make a writer for a memmap file; documents are packed into sequences if `sequence_length` is provided."""
+    if sequence_length is None:
+        return MemmapWriter(path=path, dtype=dtype, max_tokens=max_tokens)
+    if pad_token_id is None:
+        raise ValueError("pad_token_id must be provided to pack documents into sequences")
+    return PackedMemmapWriter(
+        path=path,
+        dtype=dtype,
+        sequence_length=sequence_length,
+        pad_token_id=pad_token_id,
+        max_tokens=max_tokens,
+        policy=packing_policy,
+    )
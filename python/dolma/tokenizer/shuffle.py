@@ -0,0 +1,319 @@
+"""
+Global shuffling of tokenized documents. Without it, documents are only shuffled within a window of
+`local_shuffle` documents drawn from the few files a writer has open, so the order of the output follows the
+order of the input files. With it, tokenization happens in two passes:
+
+1. documents are tokenized into local memmaps in a scratch directory, as they would be without shuffling;
+2. a compact index of the length of every document is built from the metadata of those memmaps and
+   permuted; the permuted documents are split into output shards of at most `max_size` tokens, and each shard
+   gathers its documents from the memmaps of the first pass, in parallel across shards.
+
+The second pass reads every token once and writes it once, so its cost is bounded by disk bandwidth. The same
+pass, with or without permuting documents, is used to reshard tokenized memmaps into files of a different size
+without tokenizing again (see `dolma tokens-reshard`).
+"""
+
+import csv
+import os
+import shutil
+from contextlib import ExitStack
+from math import ceil, log10
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import smart_open
+
+from ..core.loggers import get_logger
+from ..core.parallel import BaseParallelProcessor, QueueType
+from ..core.paths import delete_file, glob_path, join_path, mkdir_p
+from .data_types import TokenizerOutput
+from .memmap_reader import find_memmap_paths
+from .memmap_writer import MemmapWriter, make_memmap_writer
+
+__all__ = ["MemMapShuffleWriter", "build_shuffle_plans", "reshard_memmaps", "shuffle_globally"]
+
+
+PLAN_EXTENSION = ".plan.csv"
+GROUP_EXTENSION = ".group.csv"
+
+# plans are written to at most this many files at once, to stay well below the limit of open files
+MAX_OPEN_PLANS = 256
+
+
+def _read_offsets(metadata_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end offsets of the documents in a memmap, from its metadata file."""
+    with smart_open.open(metadata_path, "rt") as f:
+        offsets = np.array([(int(row[0]), int(row[1])) for row in csv.reader(f)], dtype=np.int64).reshape(-1, 2)
+    return offsets[:, 0], offsets[:, 1]
+
+
+def build_shuffle_plans(
+    memmap_paths: List[str],
+    plans_dir: str,
+    max_tokens: int,
+    seed: int = 0,
+    shuffle: bool = True,
+) -> List[str]:
+    """Permute the documents in `memmap_paths` (unless `shuffle` is false, in which case documents keep their
+    order) and split them into shards of less than `max_tokens` tokens
+    (a document larger than that gets a shard of its own). Write a plan for each shard to `plans_dir`: one row
+    per document with its position in the shard, the memmap it is in, its offsets there, and its metadata.
+    Anything already in `plans_dir` is removed. Return the paths of the plans, in shard order."""
+    metadata_paths = [
+        path[: -len(MemmapWriter.MEMMAP_EXTENSION)] + MemmapWriter.METADATA_EXTENSION for path in memmap_paths
+    ]
+
+    # the compact index of all documents: their lengths, in the order of the memmaps; the memmap of each document
+    # is found again when its metadata is streamed to the plans
+    lengths = []
+    for metadata_path in metadata_paths:
+        starts, ends = _read_offsets(metadata_path)
+        lengths.append(ends - starts)
+    all_lengths = np.concatenate(lengths or [[]])
+
+    # documents in shuffled order; shards take consecutive documents while they fit
+    if shuffle:
+        permutation = np.random.default_rng(seed).permutation(len(all_lengths))
+    else:
+        permutation = np.arange(len(all_lengths))
+    cumulative = np.cumsum(all_lengths[permutation])
+    bounds = [0]
+    while bounds[-1] < len(permutation):
+        offset = cumulative[bounds[-1] - 1] if bounds[-1] > 0 else 0
+        bounds.append(max(int(np.searchsorted(cumulative, offset + max_tokens, side="left")), bounds[-1] + 1))
+
+    # for every document (in the order of the index), its shard and position in the shard
+    shard_of, position_of = np.empty(len(permutation), dtype=np.int64), np.empty(len(permutation), dtype=np.int64)
+    for shard, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        shard_of[permutation[start:end]] = shard
+        position_of[permutation[start:end]] = np.arange(end - start)
+
+    # plans of earlier runs must not be mixed with the plans of this one
+    if os.path.exists(plans_dir):
+        shutil.rmtree(plans_dir)
+    mkdir_p(plans_dir)
+    digits = int(ceil(log10(len(bounds) + 1)))
+    plan_paths = [join_path(None, plans_dir, f"{i:0{digits}d}{PLAN_EXTENSION}") for i in range(len(bounds) - 1)]
+
+    # we stream through the metadata once more to send each row to the plan of its shard.
+    def rows() -> Iterator[Tuple[int, Sequence[Any]]]:
+        index = 0
+        for i, metadata_path in enumerate(metadata_paths):
+            with smart_open.open(metadata_path, "rt") as f:
+                for start, end, *metadata in csv.reader(f):
+                    yield int(shard_of[index]), (position_of[index], i, start, end, *metadata)
+                    index += 1
+
+    _write_plans(rows(), plan_paths)
+    return plan_paths
+
+
+def _write_plans(rows: Iterable[Tuple[int, Sequence[Any]]], plan_paths: List[str]):
+    """Write each (shard, row) of `rows` to the plan of its shard. At most `MAX_OPEN_PLANS` files are open at
+    once: with more shards than that, rows are first split into one file per group of consecutive shards, and
+    each of those is then split into the plans of its group."""
+    group_size = int(ceil(len(plan_paths) / MAX_OPEN_PLANS))
+    if group_size <= 1:
+        paths = plan_paths
+    else:
+        # named after the first plan and the size of the group, so that nested groups do not collide
+        paths = [f"{path}.{group_size}{GROUP_EXTENSION}" for path in plan_paths[::group_size]]
+
+    with ExitStack() as stack:
+        writers = [csv.writer(stack.enter_context(open(path, "wt", newline=""))) for path in paths]
+        for shard, row in rows:
+            if group_size <= 1:
+                writers[shard].writerow(row)
+            else:
+                writers[shard // group_size].writerow((shard % group_size, *row))
+
+    if group_size <= 1:
+        return
+
+    for group, path in enumerate(paths):
+        with open(path, "rt", newline="") as f:
+            group_rows = ((int(shard), row) for shard, *row in csv.reader(f))
+            _write_plans(group_rows, plan_paths[group * group_size : (group + 1) * group_size])
+        os.remove(path)
+
+
+class MemMapShuffleWriter(BaseParallelProcessor):
+    """Second pass of a global shuffle: each source is the plan of a shard (see `build_shuffle_plans`), and its
+    destination is the memmap of that shard."""
+
+    @classmethod
+    def increment_progressbar(  # type: ignore[override]    # pylint: disable=arguments-differ
+        cls,
+        queue: QueueType,
+        /,
+        files: int = 0,
+        documents: int = 0,
+        tokens: int = 0,
+        memmaps: int = 0,
+    ) -> Dict[str, int]:
+        return super().increment_progressbar(
+            queue, files=files, documents=documents, tokens=tokens, memmaps=memmaps
+        )
+
+    @classmethod
+    def process_single(cls, source_path: str, destination_path: str, queue: QueueType, **kwargs: Any):
+        dtype: np.dtype = np.dtype(kwargs.pop("dtype", None) or "uint16")
+        max_size: int = kwargs.pop("max_size", None) or 1024 * 1024 * 1024
+        window_size: int = kwargs.pop("window_size", None) or 16 * 1024 * 1024
+        memmap_paths: List[str] = kwargs.pop("memmap_paths", None) or []
+        if not memmap_paths:
+            raise RuntimeError("memmap_paths should be a non-empty list of paths")
+
+        with open(source_path, "rt", newline="") as f:
+            plan = sorted(([int(v) for v in row[:4]], row[4:]) for row in csv.reader(f))
+
+        memmaps: Dict[int, np.memmap] = {}
+        longest = max((end - start for (_, _, start, end), _ in plan), default=0)
+
+        # a document larger than `max_size` is alone in its shard; make sure the writer takes it. Packed shards
+        # might not fit in one memmap because of padding; documents that don't fit go to the next one.
+        sequence_length: Optional[int] = kwargs.pop("sequence_length", None)
+        writer_kwargs: Dict[str, Any] = {
+            "dtype": dtype,
+            "max_tokens": max(max_size, longest + (sequence_length or 0) + 1),
+            "sequence_length": sequence_length,
+            "pad_token_id": kwargs.pop("pad_token_id", None),
+            "packing_policy": kwargs.pop("packing_policy", None) or "best_fit",
+        }
+        mm_cnt = 0
+
+        with ExitStack() as stack:
+            writer = stack.enter_context(
+                make_memmap_writer(path=f"{destination_path}-{mm_cnt:05d}", **writer_kwargs)
+            )
+            cls.increment_progressbar(queue, memmaps=1)
+
+            # documents are gathered in windows of consecutive documents of the shard; within a window, they
+            # are read in the order they appear in the memmaps of the first pass, so reads are sequential.
+            window_start = 0
+            while window_start < len(plan):
+                window_end, window_tokens = window_start, 0
+                while window_end < len(plan) and (window_tokens < window_size or window_end == window_start):
+                    (_, _, start, end), _ = plan[window_end]
+                    window_tokens += end - start
+                    window_end += 1
+
+                window = plan[window_start:window_end]
+                tokens: List[Optional[np.ndarray]] = [None] * len(window)
+                for j in sorted(range(len(window)), key=lambda j: window[j][0][1:3]):
+                    (_, file, start, end), _ = window[j]
+                    if file not in memmaps:
+                        memmaps[file] = np.memmap(memmap_paths[file], dtype=dtype, mode="r")
+                    # copy, so that the read happens here rather than when the shard is written
+                    tokens[j] = np.array(memmaps[file][start:end])
+
+                outputs = [
+                    TokenizerOutput.from_tokens(id=doc_id, src=src, loc=int(loc), tokens=doc_tokens)  # type: ignore
+                    for ((_, (doc_id, src, loc)), doc_tokens) in zip(window, tokens)
+                ]
+                while outputs := writer.write_many(outputs=outputs):
+                    mm_cnt += 1
+                    stack.pop_all().close()
+                    writer = stack.enter_context(
+                        make_memmap_writer(path=f"{destination_path}-{mm_cnt:05d}", **writer_kwargs)
+                    )
+                    cls.increment_progressbar(queue, memmaps=1)
+
+                cls.increment_progressbar(queue, documents=len(window), tokens=window_tokens)
+                window_start = window_end
+
+        cls.increment_progressbar(queue, files=1)
+
+    def __call__(  # type: ignore[override]    # pylint: disable=arguments-differ
+        self, plan_paths: List[str], **process_single_kwargs: Any
+    ):
+        """Run the processor on the plans returned by `build_shuffle_plans`; destinations are named after the
+        shards."""
+        destination, metadata = self.dst_prefixes[0], self.meta_prefixes[0]
+        mkdir_p(destination)
+        mkdir_p(metadata)
+
+        # same naming as the writers without global shuffle, which write part-<writer>-<memmap>.npy
+        digits = int(ceil(log10(len(plan_paths) + 1)))
+        all_destination_paths = [
+            join_path(None, destination, f"part-{i:0{digits}d}") for i in range(len(plan_paths))
+        ]
+        all_metadata_paths = [join_path(None, metadata, f"{i}.done") for i in range(len(plan_paths))]
+
+        print(f"Shuffling tokenized documents into {len(plan_paths):,} numpy destinations.")
+        if not plan_paths:
+            return
+
+        fn = self._debug_run_all if self.debug else self._multiprocessing_run_all
+        fn(
+            all_source_paths=plan_paths,
+            all_destination_paths=all_destination_paths,
+            all_metadata_paths=all_metadata_paths,
+            **process_single_kwargs,
+        )
+
+
+def reshard_memmaps(
+    memmap_paths: List[str],
+    destination: str,
+    scratch_dir: str,
+    metadata_dir: str,
+    max_tokens: int,
+    dtype: str,
+    shuffle: bool = True,
+    num_processes: int = 1,
+    seed: int = 0,
+    debug: bool = False,
+    window_size: Optional[int] = None,
+    sequence_length: Optional[int] = None,
+    pad_token_id: Optional[int] = None,
+    packing_policy: str = "best_fit",
+):
+    """Write the documents in `memmap_paths` to shards of less than `max_tokens` tokens in `destination`,
+    permuting them if `shuffle` is true. Plans of the shards are written to `scratch_dir`, which should be local.
+    If `sequence_length` is provided, documents are packed into sequences (see `PackedMemmapWriter`). Shards
+    already in `destination` are removed first."""
+    logger = get_logger(__name__)
+
+    # shards an earlier run wrote to the same destination would be mixed with the new ones, so they are removed
+    shard_extensions = (MemmapWriter.MEMMAP_EXTENSION, MemmapWriter.METADATA_EXTENSION)
+    stale_paths = [
+        path
+        for path in glob_path(destination)
+        if os.path.basename(path).startswith("part-") and path.endswith(shard_extensions)
+    ]
+    if set(stale_paths) & set(memmap_paths):
+        raise ValueError(f"Destination {destination} must not contain the memmaps being resharded")
+    for path in stale_paths:
+        delete_file(path)
+
+    plans_dir = join_path(None, scratch_dir, "plans")
+    plan_paths = build_shuffle_plans(
+        memmap_paths=memmap_paths, plans_dir=plans_dir, max_tokens=max_tokens, seed=seed, shuffle=shuffle
+    )
+    logger.info("Planned %d shards from %d tokenized files", len(plan_paths), len(memmap_paths))
+
+    writer = MemMapShuffleWriter(
+        source_prefix=plans_dir,
+        destination_prefix=destination,
+        metadata_prefix=metadata_dir,
+        num_processes=num_processes,
+        seed=seed,
+        debug=debug,
+    )
+    writer(
+        plan_paths=plan_paths,
+        memmap_paths=memmap_paths,
+        max_size=max_tokens,
+        dtype=dtype,
+        window_size=window_size,
+        sequence_length=sequence_length,
+        pad_token_id=pad_token_id,
+        packing_policy=packing_policy,
+    )
+
+
+def shuffle_globally(memmaps_dir: str, **reshard_kwargs: Any):
+    """Run the second pass of a global shuffle: permute the documents in the memmaps of `memmaps_dir` and write
+    them to new shards; see `reshard_memmaps` for the other arguments."""
+    reshard_memmaps(memmap_paths=find_memmap_paths(memmaps_dir), shuffle=True, **reshard_kwargs)
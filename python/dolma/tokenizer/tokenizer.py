@@ -7,11 +7,11 @@ import re
 from copy import deepcopy
 from enum import Enum
 from functools import cached_property
-from itertools import chain
+from itertools import chain, islice
 from os import PathLike
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import TYPE_CHECKING, Generator, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Generator, List, Optional, Sequence, Tuple, Union
 
 import msgspec
 import numpy as np
@@ -289,8 +289,8 @@ class Tokenizer:
         for start, end in slices:
             encoded_slice_iter = (
                 # the slicing operation is required if we have added a space in front of each paragraph
-                # during the `split_into_paragraphs` method.
-                encoded[pos][1:] if (self.tokenizer_has_prefix and pos > 0) else encoded[pos]
+                # during the `split_into_paragraphs` method; the first paragraph of each document has no space.
+                encoded[pos][1:] if (self.tokenizer_has_prefix and pos > start) else encoded[pos]
                 for pos in range(start, end)
             )
             merged.append(list(chain.from_iterable(encoded_slice_iter)))
@@ -343,6 +343,16 @@ class Tokenizer:
         return self.base_tokenizer.decode(token_ids, skip_special_tokens=skip_special_tokens)
 
 
+def set_tokenizer_threads(num_threads: int) -> None:
+    """Limit the number of threads the fast tokenizer uses to encode batches in this process. Must be called
+    before the first batch is encoded, since the thread pool is created then."""
+    if num_threads > 1:
+        os.environ["TOKENIZERS_PARALLELISM"] = "true"
+        os.environ["RAYON_NUM_THREADS"] = str(num_threads)
+    else:
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
 def make_tokenizer(
     tokenizer_name_or_path: str,
     **tokenizer_kwargs,
@@ -359,31 +369,75 @@ def tokenize_file(
     tokenizer_name_or_path: str,
     path: str,
     refresh_tokenizer_every: int = 0,
+    batch_size: int = 1,
+    start_line: int = 0,
     **tokenizer_kwargs,
 ) -> Generator[TokenizerOutput, None, None]:
     """Tokenize a file of documents using the provided tokenizer; file is expected to be a gzipped JSON lines
-    file, each containing a field named `text`.
+    file, each containing a field named `text`. Documents are read in batches of `batch_size` and encoded with a
+    single call to `Tokenizer.encode_batch`, which the fast tokenizer parallelizes across threads; outputs are
+    yielded in the same order as the documents in the file. The first `start_line` lines are skipped, so that
+    a file can be resumed after the `loc` of the last output tokenized from it.
     """
     tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
     dtype = deepcopy(tokenizer.dtype)
     decoder = msgspec.json.Decoder(InputSpec)
+    batch_size = max(1, batch_size)
+
     with smart_open.open(path, mode="rt") as input_stream:
-        for i, line in enumerate(input_stream, start=1):
+        # each element of the batch is (line number, id, text)
+        batch: List[Tuple[int, str, str]] = []
+        i = 0
+        for i, line in enumerate(islice(input_stream, start_line, None), start=start_line + 1):
             try:
                 row = decoder.decode(line)
                 if text := row.text.strip():
                     # skip empty docs
-                    tokens = tokenizer.encode(text, add_special_tokens=True)
-                    if refresh_tokenizer_every:
-                        # extra copy to prevent memory leaks
-                        tokens = np.array(tokens, dtype=dtype)
-                    yield TokenizerOutput.from_tokens(id=row.id, src=path, loc=i, tokens=tokens)  # pyright: ignore
-
-                if refresh_tokenizer_every > 0 and i % refresh_tokenizer_every == 0:
-                    # to prevent memory leaks, we refresh the tokenizer every so often
-                    del tokenizer
-                    gc.collect()
-                    tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
-
+                    batch.append((i, row.id, text))
             except Exception as ex:
                 logger.error("Error processing %s:%d", path, i, exc_info=ex)
+
+            if len(batch) >= batch_size:
+                yield from _tokenize_batch(tokenizer, batch, path, dtype if refresh_tokenizer_every else None)
+                batch = []
+
+            if refresh_tokenizer_every > 0 and i % refresh_tokenizer_every == 0:
+                # to prevent memory leaks, we refresh the tokenizer every so often; documents still in the
+                # batch are encoded first, so the refresh happens at the same point regardless of batch size.
+                yield from _tokenize_batch(tokenizer, batch, path, dtype)
+                batch = []
+                del tokenizer
+                gc.collect()
+                tokenizer = make_tokenizer(tokenizer_name_or_path, **tokenizer_kwargs)
+
+        yield from _tokenize_batch(tokenizer, batch, path, dtype if refresh_tokenizer_every else None)
+
+
+def _tokenize_batch(
+    tokenizer: Tokenizer, batch: List[Tuple[int, str, str]], path: str, dtype: Optional[np.dtype] = None
+) -> Generator[TokenizerOutput, None, None]:
+    """Encode a batch of (line number, id, text) with one call to the tokenizer. If encoding the batch fails,
+    documents are encoded one by one, so that only the ones that cause the error are skipped and logged."""
+    if not batch:
+        return
+
+    all_tokens: Sequence[Optional[List[int]]]
+    try:
+        all_tokens = tokenizer.encode_batch([text for _, _, text in batch], add_special_tokens=True)
+    except Exception:
+        one_by_one: List[Optional[List[int]]] = []
+        for loc, _, text in batch:
+            try:
+                one_by_one.append(tokenizer.encode(text, add_special_tokens=True))
+            except Exception as ex:
+                logger.error("Error processing %s:%d", path, loc, exc_info=ex)
+                one_by_one.append(None)
+        all_tokens = one_by_one
+
+    for (loc, doc_id, _), tokens in zip(batch, all_tokens):
+        if tokens is None:
+            continue
+        if dtype is not None:
+            # extra copy to prevent memory leaks
+            tokens = np.array(tokens, dtype=dtype)
+        yield TokenizerOutput.from_tokens(id=doc_id, src=path, loc=loc, tokens=tokens)  # pyright: ignore
@@ -0,0 +1,116 @@
+"""
+Benchmark for the character repetitions detector used by the `repetitions_v1` tagger.
+
+Compares `find_char_repetitions` with the backtracking regex it replaces on adversarial inputs (long lines
+without repetitions, strings full of squares but with no fourth powers, highly repetitive strings) as well as
+on natural-looking text. The regex is run with a timeout, since it can take minutes on some inputs.
+
+Usage:
+    python scripts/benchmark_repetitions.py --size 100000 --max-period 256
+"""
+
+import argparse
+import multiprocessing
+import random
+import re
+import string
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dolma.taggers.repetitions.utils import find_char_repetitions
+
+REGEX = r"(.+?)(\s?\1){3,}"
+
+
+def random_line(size: int, rng: random.Random) -> str:
+    """A single line of random words; the regex tries every unit length at every position."""
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 10))) for _ in range(size // 5)]
+    return " ".join(words)[:size]
+
+
+def fibonacci_word(size: int, _: random.Random) -> str:
+    """Contains many squares and cubes, but no fourth powers, so candidate repetitions never match."""
+    a, b = "a", "ab"
+    while len(b) < size:
+        a, b = b, b + a
+    return b[:size]
+
+
+def single_char(size: int, _: random.Random) -> str:
+    """A single, very long repetition."""
+    return "a" * size
+
+
+def repeated_lines(size: int, rng: random.Random) -> str:
+    """Natural-looking text with short lines, some of which are repeated."""
+    lines: List[str] = []
+    while sum(len(ln) + 1 for ln in lines) < size:
+        line = random_line(rng.randint(20, 120), rng)
+        lines.extend([line] * rng.choice([1, 1, 1, 4]))
+    return "\n".join(lines)[:size]
+
+
+def near_miss(size: int, rng: random.Random) -> str:
+    """Units that are repeated exactly three times (one short of a match), separated by random words."""
+    chunks: List[str] = []
+    while sum(len(c) for c in chunks) < size:
+        unit = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 30)))
+        chunks.append(" ".join([unit] * 3) + " " + random_line(10, rng) + " ")
+    return "".join(chunks)[:size]
+
+
+INPUTS: Dict[str, Callable[[int, random.Random], str]] = {
+    "random_line": random_line,
+    "fibonacci_word": fibonacci_word,
+    "single_char": single_char,
+    "repeated_lines": repeated_lines,
+    "near_miss": near_miss,
+}
+
+
+def _run_regex(text: str, queue: "multiprocessing.Queue[Tuple[float, int]]") -> None:
+    start = time.perf_counter()
+    count = sum(1 for _ in re.finditer(REGEX, text))
+    queue.put((time.perf_counter() - start, count))
+
+
+def time_regex(text: str, timeout: float) -> Optional[Tuple[float, int]]:
+    """Run the regex in a separate process, so that it can be stopped if it takes too long."""
+    queue: "multiprocessing.Queue[Tuple[float, int]]" = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_regex, args=(text, queue))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        return None
+    return queue.get()
+
+
+def time_detector(text: str, max_period: int) -> Tuple[float, int]:
+    start = time.perf_counter()
+    count = sum(1 for _ in find_char_repetitions(text, max_period=max_period))
+    return time.perf_counter() - start, count
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size", type=int, default=100_000, help="Number of characters in each input")
+    ap.add_argument("--max-period", type=int, default=256, help="Maximum unit length for the detector")
+    ap.add_argument("--timeout", type=float, default=60.0, help="Timeout in seconds for the regex")
+    ap.add_argument("--seed", type=int, default=0)
+    opts = ap.parse_args()
+
+    print(f"{'input':<16}{'regex (s)':>12}{'matches':>10}{'detector (s)':>16}{'matches':>10}")
+    for name, make_input in INPUTS.items():
+        text = make_input(opts.size, random.Random(opts.seed))
+        regex_result = time_regex(text, opts.timeout)
+        detector_time, detector_count = time_detector(text, opts.max_period)
+
+        regex_time_str, regex_count_str = (
+            (f"{regex_result[0]:.3f}", str(regex_result[1])) if regex_result else (f">{opts.timeout:.0f}", "-")
+        )
+        print(f"{name:<16}{regex_time_str:>12}{regex_count_str:>10}{detector_time:>16.3f}{detector_count:>10}")
+
+
+if __name__ == "__main__":
+    main()
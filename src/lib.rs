@@ -1,5 +1,6 @@
 use pyo3::exceptions;
 use pyo3::prelude::*;
+use pyo3::types::PyBytes;
 
 use adblock::lists::ParseOptions;
 use adblock::request::Request;
@@ -13,9 +14,11 @@ pub mod mixer;
 pub mod s3_util;
 pub mod shard;
 pub mod wimbd;
+pub mod words;
 
 use crate::deduper::deduper_config::DeduperConfig;
 use crate::mixer::mixer_config::MixerConfig;
+use crate::shard::shard_config::FilterConfig;
 use std::env;
 
 #[pyfunction]
@@ -44,6 +47,34 @@ fn mixer_entrypoint(config_str: &str) -> PyResult<()> {
     Ok(())
 }
 
+/// Count words in a document, as defined by UAX#29 word boundaries.
+///
+/// input:
+///     text: str -> the document
+///     ranges: Optional[List[Tuple[int, int]]] -> (start, end) character offsets of spans of the
+///         document (e.g. paragraphs) to count words in
+///     skip_whitespace: bool -> whether to ignore words that only contain whitespace
+///
+/// output:
+///     Tuple[int, List[int]] -> number of words in the document, and in each range. The document and
+///         each range are stripped of whitespace before counting, like Python's `str.strip()`.
+#[pyfunction]
+#[pyo3(signature = (text, ranges=None, skip_whitespace=false))]
+fn count_words(
+    py: Python,
+    text: &str,
+    ranges: Option<Vec<(usize, usize)>>,
+    skip_whitespace: bool,
+) -> (usize, Vec<usize>) {
+    py.allow_threads(|| {
+        let ranges = ranges.unwrap_or_default();
+        (
+            words::count_words(text, skip_whitespace),
+            words::count_words_in_ranges(text, &ranges, skip_whitespace),
+        )
+    })
+}
+
 /// Adblocker class
 /// Hold the adblocker engine loaded with the rules
 ///
@@ -62,6 +93,32 @@ struct UrlBlocker {
     engine: Engine,
 }
 
+/// Whether a url starts with a scheme followed by `://`; a scheme must come before the first `/`, `?` or `#`,
+/// so that urls with another url in their path (e.g. `web.archive.org/web/http://example.com`) have none.
+fn has_scheme(url: &str) -> bool {
+    let authority_start = match url.find("://") {
+        Some(index) => index,
+        None => return false,
+    };
+    let scheme = &url[..authority_start];
+    match scheme.chars().next() {
+        Some(first) if first.is_ascii_alphabetic() => scheme
+            .chars()
+            .all(|c| c.is_ascii_alphanumeric() || c == '+' || c == '-' || c == '.'),
+        _ => false,
+    }
+}
+
+/// Build an adblock request; urls without a scheme are assumed to be http urls.
+fn make_request(url: &str, source_url: &str, request_type: &str) -> Option<Request> {
+    let request = if has_scheme(url) {
+        Request::new(url, source_url, request_type)
+    } else {
+        Request::new(&format!("http://{}", url), source_url, request_type)
+    };
+    request.ok()
+}
+
 #[pymethods]
 impl UrlBlocker {
     #[new]
@@ -70,10 +127,44 @@ impl UrlBlocker {
             engine: Engine::from_rules(&rules, ParseOptions::default()),
         }
     }
+
+    /// Create an adblocker from an engine previously serialized with `serialize`.
+    ///
+    /// input:
+    ///     data: bytes -> the serialized engine
+    ///
+    /// example:
+    ///     braveblock.Adblocker.deserialize(data=adblocker.serialize())
+    #[staticmethod]
+    fn deserialize(data: &[u8]) -> PyResult<Self> {
+        let mut engine = Engine::new(true);
+        match engine.deserialize(data) {
+            Ok(_) => Ok(UrlBlocker { engine }),
+            Err(e) => Err(exceptions::PyValueError::new_err(format!(
+                "Invalid serialized engine: {:?}",
+                e
+            ))),
+        }
+    }
+
+    /// Serialize the compiled engine to bytes, so that it can be loaded without parsing the rules again.
+    ///
+    /// returns:
+    ///     bytes -> the serialized engine
+    fn serialize<'py>(&self, py: Python<'py>) -> PyResult<&'py PyBytes> {
+        match self.engine.serialize_raw() {
+            Ok(data) => Ok(PyBytes::new(py, &data)),
+            Err(e) => Err(exceptions::PyRuntimeError::new_err(format!(
+                "Could not serialize engine: {:?}",
+                e
+            ))),
+        }
+    }
+
     /// The function that should tell whether a specific request should be blocked according to the loaded rules
     ///
     /// input:
-    ///     url: str -> The inspected url that should be tested
+    ///     url: str -> The inspected url that should be tested; if it has no scheme, http is assumed
     ///     source_url: str -> The source url that made the request to the inspected url
     ///     request_type: str -> The type of the resource that is being requested. Can be one of the following:
     ///         "beacon", "csp_report", "document", "font", "image", "imageset", "main_frame",
@@ -96,16 +187,142 @@ impl UrlBlocker {
         source_url: &str,
         request_type: &str,
     ) -> PyResult<bool> {
-        match Request::new(url, source_url, request_type) {
-            Ok(request) => {
+        match make_request(url, source_url, request_type) {
+            Some(request) => {
                 let blocker_result = self.engine.check_network_request(&request);
                 Ok(blocker_result.matched)
             }
-            Err(_) => {
+            None => {
                 return Err(exceptions::PyValueError::new_err("Invalid request"));
             }
         }
     }
+
+    /// Same as `check_network_urls`, but checks a list of urls in a single call.
+    ///
+    /// input:
+    ///     urls: List[str] -> The inspected urls that should be tested
+    ///     source_urls: Optional[List[str]] -> The source urls for each of the inspected urls; if not
+    ///         provided, an empty source url is used for all requests
+    ///     request_type: str -> The type of the resource that is being requested (same for all urls)
+    ///
+    /// returns:
+    ///     List[bool] -> Whether each request should be blocked or not; invalid urls are never blocked
+    ///
+    /// example:
+    ///     adblocker.check_many(
+    ///         urls=["example.com/-advertisement-icon.", "example.com/index.html"],
+    ///     )
+    #[pyo3(signature = (urls, source_urls=None, request_type=""))]
+    fn check_many(
+        &mut self,
+        urls: Vec<String>,
+        source_urls: Option<Vec<String>>,
+        request_type: &str,
+    ) -> PyResult<Vec<bool>> {
+        if let Some(source_urls) = &source_urls {
+            if source_urls.len() != urls.len() {
+                return Err(exceptions::PyValueError::new_err(format!(
+                    "Got {} urls but {} source urls",
+                    urls.len(),
+                    source_urls.len()
+                )));
+            }
+        }
+
+        let results = urls
+            .iter()
+            .enumerate()
+            .map(|(i, url)| {
+                let source_url = match &source_urls {
+                    Some(source_urls) => source_urls[i].as_str(),
+                    None => "",
+                };
+                match make_request(url, source_url, request_type) {
+                    Some(request) => self.engine.check_network_request(&request).matched,
+                    None => false,
+                }
+            })
+            .collect();
+        Ok(results)
+    }
+}
+
+/// Document filter, using the same include/exclude expressions as the `filter` of mixer streams.
+/// A document is kept if it matches any `include` expression (or if there are none), and no
+/// `exclude` expression.
+///
+/// input:
+///     include: List[str] -> expressions for documents to keep
+///     exclude: List[str] -> expressions for documents to remove
+///     syntax: str -> syntax of the expressions; either "jsonpath" or "jq"
+///
+/// example:
+///     DocFilter(
+///         include=[],
+///         exclude=[".attributes.exp__tagger__length[0][2] < 100"],
+///         syntax="jq",
+///     )
+#[pyclass(unsendable)]
+struct DocFilter {
+    filter: filters::DocFilter,
+}
+
+impl DocFilter {
+    fn keep(&self, doc: &[u8]) -> PyResult<bool> {
+        let json: serde_json::Value = match serde_json::from_slice(doc) {
+            Ok(json) => json,
+            Err(e) => {
+                return Err(exceptions::PyValueError::new_err(format!(
+                    "Invalid document: {:?}",
+                    e
+                )))
+            }
+        };
+        match self.filter.should_keep(&json) {
+            Ok(keep) => Ok(keep),
+            Err(e) => Err(exceptions::PyValueError::new_err(e.to_string())),
+        }
+    }
+}
+
+#[pymethods]
+impl DocFilter {
+    #[new]
+    #[pyo3(signature = (include=Vec::new(), exclude=Vec::new(), syntax="jsonpath"))]
+    fn new(include: Vec<String>, exclude: Vec<String>, syntax: &str) -> PyResult<Self> {
+        let config = FilterConfig {
+            include,
+            exclude,
+            syntax: Some(syntax.to_string()),
+        };
+        match filters::DocFilter::new(Some(&config)) {
+            Ok(filter) => Ok(DocFilter { filter }),
+            Err(e) => Err(exceptions::PyValueError::new_err(e.to_string())),
+        }
+    }
+
+    /// Tell whether a document should be kept.
+    ///
+    /// input:
+    ///     doc: bytes -> the document, encoded as JSON
+    ///
+    /// returns:
+    ///     bool -> Whether the document should be kept or not
+    fn should_keep(&self, doc: &[u8]) -> PyResult<bool> {
+        self.keep(doc)
+    }
+
+    /// Same as `should_keep`, but for a list of documents.
+    ///
+    /// input:
+    ///     docs: List[bytes] -> the documents, encoded as JSON
+    ///
+    /// returns:
+    ///     List[bool] -> Whether each document should be kept or not
+    fn should_keep_many(&self, docs: Vec<&[u8]>) -> PyResult<Vec<bool>> {
+        docs.iter().map(|doc| self.keep(doc)).collect()
+    }
 }
 
 // A Python module implemented in Rust. The name of this function must match
@@ -115,7 +332,9 @@ impl UrlBlocker {
 fn dolma(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(deduper_entrypoint, m)?)?;
     m.add_function(wrap_pyfunction!(mixer_entrypoint, m)?)?;
+    m.add_function(wrap_pyfunction!(count_words, m)?)?;
     m.add_class::<UrlBlocker>()?;
+    m.add_class::<DocFilter>()?;
 
     if env::var("RUST_LOG").is_err() {
         env::set_var("RUST_LOG", "dolma=info,deduper=info");
@@ -124,3 +343,28 @@ fn dolma(_py: Python, m: &PyModule) -> PyResult<()> {
 
     Ok(())
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_has_scheme() {
+        assert!(has_scheme("http://example.com"));
+        assert!(has_scheme("https://example.com/path?q=http://other.com"));
+        assert!(has_scheme("git+ssh://example.com"));
+        assert!(!has_scheme("example.com"));
+        assert!(!has_scheme("localhost:8080/path"));
+        assert!(!has_scheme("web.archive.org/web/2020/http://bad.com"));
+        assert!(!has_scheme("example.com?next=http://bad.com"));
+        assert!(!has_scheme("example.com#http://bad.com"));
+        assert!(!has_scheme("://example.com"));
+    }
+
+    #[test]
+    fn test_make_request_url_in_path() {
+        let engine = Engine::from_rules(&["bad.com".to_string()], ParseOptions::default());
+        let request = make_request("web.archive.org/web/2020/http://bad.com", "", "other").unwrap();
+        assert!(engine.check_network_request(&request).matched);
+    }
+}
@@ -0,0 +1,84 @@
+//! Word counting based on UAX#29 word boundaries.
+//!
+//! Used by the `uniseg_length_*` taggers as a faster alternative to iterating over
+//! `uniseg.wordbreak.words` in Python. Whitespace is stripped and detected with the same
+//! rules as Python's `str.strip()` and `str.isspace()`, so that counts match the Python taggers.
+
+use unicode_segmentation::UnicodeSegmentation;
+
+/// Same characters as Python's `str.isspace()`: Unicode White_Space, plus the ASCII
+/// information separators (U+001C to U+001F).
+fn is_py_whitespace(c: char) -> bool {
+    c.is_whitespace() || ('\u{1c}'..='\u{1f}').contains(&c)
+}
+
+/// Count word segments in `text` after stripping leading and trailing whitespace.
+/// If `skip_whitespace` is true, segments that only contain whitespace are not counted.
+pub fn count_words(text: &str, skip_whitespace: bool) -> usize {
+    text.trim_matches(is_py_whitespace)
+        .split_word_bounds()
+        .filter(|w| !skip_whitespace || w.chars().any(|c| !is_py_whitespace(c)))
+        .count()
+}
+
+/// Same as `count_words`, but for each `(start, end)` range of *character* offsets in `text`
+/// (the offsets used by Python strings). Offsets past the end of the text are clamped; ranges
+/// with `start >= end` have no words.
+pub fn count_words_in_ranges(
+    text: &str,
+    ranges: &[(usize, usize)],
+    skip_whitespace: bool,
+) -> Vec<usize> {
+    if ranges.is_empty() {
+        return Vec::new();
+    }
+
+    // byte offset of each character, plus the end of the text
+    let byte_offsets: Vec<usize> = text
+        .char_indices()
+        .map(|(i, _)| i)
+        .chain(std::iter::once(text.len()))
+        .collect();
+    let num_chars = byte_offsets.len() - 1;
+
+    ranges
+        .iter()
+        .map(|&(start, end)| {
+            let (start, end) = (start.min(num_chars), end.min(num_chars));
+            if start >= end {
+                0
+            } else {
+                count_words(
+                    &text[byte_offsets[start]..byte_offsets[end]],
+                    skip_whitespace,
+                )
+            }
+        })
+        .collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_count_words() {
+        assert_eq!(count_words("", false), 0);
+        assert_eq!(count_words("   ", false), 0);
+        assert_eq!(count_words("  hello world  ", false), 3);
+        assert_eq!(count_words("  hello world  ", true), 2);
+        assert_eq!(count_words("can't stop, won't stop.", true), 6);
+        assert_eq!(count_words("\u{1c}hello\u{1f}", false), 1);
+    }
+
+    #[test]
+    fn test_count_words_in_ranges() {
+        let text = "héllo wörld\n\nsecond paragraph\n";
+        let ranges = vec![(0, 12), (12, 13), (13, 30), (20, 10), (25, 100)];
+        assert_eq!(
+            count_words_in_ranges(text, &ranges, true),
+            vec![2, 0, 2, 0, 1]
+        );
+        assert_eq!(count_words_in_ranges(text, &[], true), Vec::<usize>::new());
+    }
+}
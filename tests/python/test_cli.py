@@ -0,0 +1,85 @@
+import json
+import re
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from typing import Dict
+
+import smart_open
+
+from dolma.cli import BaseCli
+from dolma.cli.main import AVAILABLE_COMMANDS
+
+LOCAL_DATA = Path(__file__).parent.parent / "data"
+
+# modules that take a long time to import, and that are not needed to parse arguments
+HEAVY_MODULES = ["numpy", "smart_open", "boto3", "nltk", "tokenizers", "cached_path", "dolma.core.paths"]
+
+
+def import_times(code: str) -> Dict[str, float]:
+    """Run `code` in a new interpreter with `-X importtime`; return the cumulative import time of each module."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    times: Dict[str, float] = {}
+    for line in output.stderr.splitlines():
+        if match := re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S+)", line):
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+class TestCliStartup(unittest.TestCase):
+    # generous, to avoid flaky failures on slow machines; importing all commands takes about 1s.
+    STARTUP_BUDGET_SECONDS = 1.0
+
+    def test_commands_are_lazy(self):
+        times = import_times("import dolma.cli.main")
+        self.assertIn("dolma.cli.main", times)
+
+        for lazy_cli in AVAILABLE_COMMANDS.values():
+            module_name = "dolma.cli" + lazy_cli.entry_point.split(":")[0]
+            self.assertNotIn(module_name, times)
+        for module_name in HEAVY_MODULES:
+            self.assertNotIn(module_name, times)
+
+        self.assertLess(times["dolma.cli.main"], self.STARTUP_BUDGET_SECONDS)
+
+    def test_only_selected_command_is_imported(self):
+        code = (
+            "import sys; from dolma.cli.main import make_parser; make_parser('stat'); "
+            "print(sorted(m for m in sys.modules if m.startswith('dolma.cli.')))"
+        )
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(
+            output.stdout.strip().splitlines()[-1],
+            str(["dolma.cli.analyzer", "dolma.cli.main", "dolma.cli.shared"]),
+        )
+
+    def test_load_commands(self):
+        for name, lazy_cli in AVAILABLE_COMMANDS.items():
+            cli = lazy_cli.load()
+            self.assertTrue(issubclass(cli, BaseCli), name)
+            self.assertEqual(cli.DESCRIPTION, lazy_cli.help, name)
+
+
+class TestTaggerCliStream(unittest.TestCase):
+    def test_stdin_stdout(self):
+        with smart_open.open(f"{LOCAL_DATA}/provided/documents/000.json.gz", "rt") as f:
+            documents = f.read()
+        docs = [json.loads(ln) for ln in documents.splitlines()]
+
+        code = "from dolma.cli.main import main; main()"
+        output = subprocess.run(
+            [sys.executable, "-c", code, "tag", "--taggers", "char_length_v1", "--stdin", "--stdout"],
+            input=documents,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        rows = [json.loads(ln) for ln in output.stdout.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [doc["id"] for doc in docs])
+        self.assertEqual([row["source"] for row in rows], [doc["source"] for doc in docs])
+        for row, doc in zip(rows, docs):
+            n = len(doc["text"])
+            self.assertEqual(row["attributes"], {"char_length_v1__char_length_v1__length": [[0, n, n]]})
@@ -1,7 +1,28 @@
+import os
 import unittest
+from unittest import mock
 
 from dolma.core.data_types import Document
-from dolma.taggers.length import CharLengthStripWsV1, CharLengthV1
+from dolma.taggers.length import (
+    NATIVE_WORD_COUNTER_ENV_VAR,
+    CharLengthStripWsV1,
+    CharLengthV1,
+    OlmoPreTokenizerParagraphsV1,
+    OlmoPreTokenizerV1,
+    UnisegLengthV1,
+    UnisegParagraphsV1,
+    UnisegParagraphsWithDocLengthV1,
+    UnisegParagraphsWithEmptyV1,
+)
+
+MULTILINGUAL_TEXT = """
+  The quick brown fox can't jump over 3.14 lazy dogs, e-mail me at foo_bar@example.com!\t
+
+日本語のテキストとカタカナ。 한국어 문장입니다. ภาษาไทย
+مرحبا بالعالم — हिन्दी पाठ «quoted» 1,000 U.S.A.\r
+Emoji: 😀 👍🏽 👩\u200d👩\u200d👧 🇺🇸🇫🇷 and combining e\u0301 ﬁ ß\u00a0Ω\u3000end\x1c
+\n\n   \n
+last line without newline"""
 
 
 class TestLengthTaggers(unittest.TestCase):
@@ -49,3 +70,61 @@ class TestLengthTaggers(unittest.TestCase):
 
         result = self.char_length_strip_ws_v1.predict(self.empty_doc_with_ws)
         self.assertEqual(result.spans[0].score, 0)
+
+
+class TestNativeWordCounter(unittest.TestCase):
+    def setUp(self) -> None:
+        texts = [MULTILINGUAL_TEXT, "", "   \n\t ", "one", "\n\nparagraph\n\n  another  one \n"]
+        texts.extend(MULTILINGUAL_TEXT[i:] for i in range(0, len(MULTILINGUAL_TEXT), 17))
+        self.docs = [Document(text=text, id=str(i), source=__file__) for i, text in enumerate(texts)]
+
+    def test_native_same_as_uniseg(self):
+        for tagger_cls in (
+            UnisegLengthV1,
+            UnisegParagraphsV1,
+            UnisegParagraphsWithEmptyV1,
+            UnisegParagraphsWithDocLengthV1,
+        ):
+            with mock.patch.dict(os.environ, {NATIVE_WORD_COUNTER_ENV_VAR: "0"}):
+                uniseg_tagger = tagger_cls()
+            with mock.patch.dict(os.environ, {NATIVE_WORD_COUNTER_ENV_VAR: "1"}):
+                native_tagger = tagger_cls()
+
+            self.assertFalse(uniseg_tagger.native_word_counter)
+            self.assertTrue(native_tagger.native_word_counter)
+
+            for doc in self.docs:
+                self.assertEqual(
+                    native_tagger.group_output(native_tagger.predict(doc)),
+                    uniseg_tagger.group_output(uniseg_tagger.predict(doc)),
+                    f"{tagger_cls.__name__} on {doc.text!r}",
+                )
+
+
+class TestOlmoPreTokenizer(unittest.TestCase):
+    def setUp(self) -> None:
+        texts = [MULTILINGUAL_TEXT, "", "   \n\t ", "one", "\n\nparagraph\n\n  another  one's 123 \n"]
+        texts.extend(MULTILINGUAL_TEXT[i:] for i in range(0, len(MULTILINGUAL_TEXT), 17))
+        self.docs = [Document(text=text, id=str(i), source=__file__) for i, text in enumerate(texts)]
+
+    def test_count_pre_tokens(self):
+        tagger = OlmoPreTokenizerV1()
+        texts = [doc.text for doc in self.docs]
+        self.assertEqual(
+            tagger.count_pre_tokens(texts), [len(tagger.pre_tokenizer.pre_tokenize_str(text)) for text in texts]
+        )
+
+    def test_predict_batch(self):
+        tagger = OlmoPreTokenizerV1()
+        for doc, result in zip(self.docs, tagger.predict_batch(self.docs)):
+            self.assertEqual(result.spans[0].score, len(tagger.pre_tokenizer.pre_tokenize_str(doc.text)))
+
+        tagger = OlmoPreTokenizerParagraphsV1()
+        for doc, result in zip(self.docs, tagger.predict_batch(self.docs)):
+            self.assertEqual(tagger.group_output(result), tagger.group_output(tagger.predict(doc)))
+            *paragraph_spans, doc_span = result.spans
+            for span in paragraph_spans:
+                self.assertEqual(
+                    span.score, len(tagger.pre_tokenizer.pre_tokenize_str(doc.text[span.start : span.end]))
+                )
+            self.assertEqual(doc_span.score, sum(span.score for span in paragraph_spans))
@@ -8,6 +8,7 @@ from unittest import TestCase
 
 import smart_open
 
+from dolma.core.errors import DolmaHandoff
 from dolma.core.parallel import BaseParallelProcessor, QueueType
 
 LOCAL_DATA = Path(__file__).parent.parent / "data"
@@ -31,6 +32,32 @@ class MockProcessor(BaseParallelProcessor):
         queue.put((1,))
 
 
+class MockHandoffProcessor(BaseParallelProcessor):
+    """Copies one line of the source per call, and hands off the rest to a new process."""
+
+    MAX_TASKS_PER_CHILD = 1
+
+    @classmethod
+    def increment_progressbar(cls, queue, /, cnt: int = 0):  # type: ignore[override]
+        return super().increment_progressbar(queue, cnt=cnt)
+
+    @classmethod
+    def process_single(
+        cls,
+        source_path: str,
+        destination_path: str,
+        queue: QueueType,
+        **kwargs: Any,
+    ):
+        line = kwargs.get("line", 0)
+        with smart_open.open(source_path, "rt") as f:
+            lines = f.read().splitlines()
+        with smart_open.open(destination_path, "at") as g:
+            g.write(f"{os.getpid()}\t{lines[line]}\n")
+        if line + 1 < len(lines):
+            raise DolmaHandoff({"line": line + 1})
+
+
 class TestParallel(TestCase):
     def test_base_parallel_processor(self):
         with self.assertRaises(ValueError):
@@ -63,3 +90,28 @@ class TestParallel(TestCase):
             dest = [p for p in os.listdir(f"{d}/destination")]
             self.assertEqual(sorted(src), sorted(meta))
             self.assertEqual(sorted(src), sorted(dest))
+
+    def test_handoff(self):
+        for debug in (True, False):
+            with TemporaryDirectory() as d:
+                os.makedirs(f"{d}/source")
+                for i in range(2):
+                    with open(f"{d}/source/{i}.txt", "wt") as f:
+                        f.write("\n".join(f"line {j} of {i}" for j in range(3)))
+
+                proc = MockHandoffProcessor(
+                    source_prefix=f"{d}/source",
+                    destination_prefix=f"{d}/destination",
+                    metadata_prefix=f"{d}/metadata",
+                    num_processes=2,
+                    debug=debug,
+                )
+                proc()
+
+                self.assertEqual(len(os.listdir(f"{d}/metadata")), 2)
+                for i in range(2):
+                    with open(f"{d}/destination/{i}.txt", "rt") as f:
+                        pids, lines = zip(*(ln.split("\t") for ln in f.read().splitlines()))
+                    self.assertEqual(list(lines), [f"line {j} of {i}" for j in range(3)])
+                    # each call after a handoff runs in a new process, unless in debug mode
+                    self.assertEqual(len(set(pids)), 1 if debug else 3)
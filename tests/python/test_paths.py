@@ -1,6 +1,7 @@
 import itertools
 import os
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 from dolma.core.paths import (
@@ -8,6 +9,7 @@ from dolma.core.paths import (
     _pathify,
     _unescape_glob,
     add_suffix,
+    get_fingerprint,
     glob_path,
     is_glob,
     join_path,
@@ -292,6 +294,19 @@ class TestPaths(TestCase):
         path = "/no/glob/here"
         self.assertEqual(split_glob(path), ("/no/glob/here", ""))
 
+    def test_get_fingerprint(self):
+        with TemporaryDirectory() as tmpdir:
+            (path := Path(tmpdir) / "file.txt").write_text("hello")
+            fingerprint = get_fingerprint(str(path))
+            self.assertEqual(get_fingerprint(str(path)), fingerprint)
+
+            # changing the size or the modification time changes the fingerprint
+            path.write_text("hello world")
+            self.assertNotEqual(get_fingerprint(str(path)), fingerprint)
+            fingerprint = get_fingerprint(str(path))
+            os.utime(path, (0, 0))
+            self.assertNotEqual(get_fingerprint(str(path)), fingerprint)
+
 
 class TestSplitExt(TestCase):
     def test_file(self):
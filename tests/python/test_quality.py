@@ -52,3 +52,16 @@ class TestDolma17QualityClassifier(TestCase):
         scores = {s.type: s.score for s in pred.spans}
         self.assertGreater(scores["lq"], 0.25)
         self.assertAlmostEqual(sum(scores.values()), 1.0, delta=0.01)
+
+    def test_predict_batch(self):
+        docs = [
+            Document(source="test", id=str(i), text=text, version="v0")
+            for i, text in enumerate([WIKIPEDIA_TEXT, CREATIVE_COMMONS_BLOG_TEXT, LOW_QUALITY_TEXT, "", "a\x1cb"])
+        ]
+        for doc, pred in zip(docs, self.quality_tagger.predict_batch(docs)):
+            self.assertEqual(pred.spans, self.quality_tagger.predict(doc).spans)
+
+    def test_preprocess_text(self):
+        for text in [WIKIPEDIA_TEXT, LOW_QUALITY_TEXT, "", "  \n\t ", "a\x1cb \x1f c d e\r\nf"]:
+            tokens = [token for token, _ in self.quality_tagger.preprocess(text)]
+            self.assertEqual(self.quality_tagger.preprocess_text(text), " ".join(tokens))
@@ -1,7 +1,17 @@
+import importlib
+import pkgutil
+import subprocess
+import sys
+import tempfile
 import unittest
+from importlib.metadata import EntryPoint
+from pathlib import Path
 from typing import Type
+from unittest import mock
 
-from dolma.core.registry import BaseRegistry
+import dolma.taggers
+from dolma.core.registry import BaseRegistry, TaggerRegistry
+from dolma.taggers import BUILTIN_TAGGERS
 
 
 class TestNewRegistry(unittest.TestCase):
@@ -66,3 +76,67 @@ class TestNewRegistry(unittest.TestCase):
 
         self.assertTrue(registry2.has("test2"))
         self.assertFalse(registry2.has("test1"))
+
+    def test_lazy(self) -> None:
+        registry = self.make_registry()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            module_name = "dolma_test_lazy_registry_module"
+            Path(temp_dir, f"{module_name}.py").write_text("class LazyClass:\n    pass\n")
+            sys.path.insert(0, temp_dir)
+            try:
+                registry.add_lazy("lazy", f"{module_name}:LazyClass")
+                self.assertTrue(registry.has("lazy"))
+                self.assertEqual(registry.names(), ["lazy"])
+                self.assertEqual(registry.entry_point("lazy"), f"{module_name}:LazyClass")
+                self.assertNotIn(module_name, sys.modules)
+
+                # module is imported (and the class added to the registry) on first use
+                lazy_cls = registry.get("lazy")
+                self.assertIn(module_name, sys.modules)
+                self.assertEqual(lazy_cls.__name__, "LazyClass")
+                self.assertEqual(list(registry.items()), [("lazy", lazy_cls)])
+            finally:
+                sys.path.remove(temp_dir)
+                sys.modules.pop(module_name, None)
+
+        with self.assertRaises(ValueError):
+            registry.add_lazy("invalid", "no_colon_here")
+
+    def test_entry_points(self) -> None:
+        class PluginRegistry(BaseRegistry):
+            ENTRY_POINTS_GROUP = "dolma.test_plugins"
+
+        entry_points = [
+            EntryPoint(name="plugin", value="collections:OrderedDict", group="dolma.test_plugins"),
+            EntryPoint(name="builtin", value="collections:Counter", group="dolma.test_plugins"),
+        ]
+        PluginRegistry.add_lazy("builtin", "collections:defaultdict")
+
+        with mock.patch("dolma.core.registry._entry_points", return_value=entry_points) as mock_entry_points:
+            self.assertEqual(PluginRegistry.names(), ["builtin", "plugin"])
+            self.assertEqual(PluginRegistry.names(), ["builtin", "plugin"])
+            mock_entry_points.assert_called_once_with("dolma.test_plugins")
+
+        # objects added with add_lazy take precedence over entry points
+        self.assertEqual(PluginRegistry.get("plugin").__name__, "OrderedDict")
+        self.assertEqual(PluginRegistry.get("builtin").__name__, "defaultdict")
+
+
+class TestTaggerRegistry(unittest.TestCase):
+    def test_builtin_taggers_in_sync(self):
+        # import all tagger modules, so that all taggers are added to the registry by their decorators
+        for module in pkgutil.walk_packages(dolma.taggers.__path__, prefix="dolma.taggers."):
+            importlib.import_module(module.name)
+
+        registered = {
+            name: f"{tagger_cls.__module__}:{tagger_cls.__qualname__}"
+            for name, tagger_cls in TaggerRegistry._get_storage().items()
+            if tagger_cls.__module__.startswith("dolma.taggers.")
+        }
+        self.assertEqual(registered, BUILTIN_TAGGERS)
+
+    def test_import_is_lazy(self):
+        code = "import sys, dolma; print(sorted(m for m in sys.modules if m.startswith('dolma.taggers.')))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "[]")
@@ -1,10 +1,16 @@
+import random
+import re
+import string
+from typing import List, Tuple
 from unittest import TestCase
 
 import numpy as np
 
 from dolma.taggers.repetitions.utils import (
+    find_char_repetitions,
     find_end_first_consecutive_true,
     find_periodic_sequences,
+    find_periodic_sequences_batch,
     find_start_last_consecutive_true,
     group_consecutive_values,
 )
@@ -124,3 +130,84 @@ class TestTrueLocsDetection(TestCase):
         arr = np.array(list(map(int, "112233445566778899")))
         sequences = list(find_periodic_sequences(arr, max_period=10))
         self.assertEqual(len(sequences), 0)
+
+    def test_find_periodic_sequences_batch(self):
+        arrs = [
+            self._to_array("5000007"),
+            self._to_array("004646464639955055055046550"),
+            self._to_array(""),
+            self._to_array("123456789"),
+            # same sequence at the end of one array and the start of the next should not be merged
+            self._to_array("1231"),
+            self._to_array("231231"),
+        ]
+        batch_sequences = find_periodic_sequences_batch(arrs, max_period=4)
+        self.assertEqual(len(batch_sequences), len(arrs))
+        for arr, sequences in zip(arrs, batch_sequences):
+            self.assertEqual(sequences, list(find_periodic_sequences(arr, max_period=4)))
+
+        rng = random.Random(0)
+        for _ in range(200):
+            arrs = [
+                np.array([rng.randint(0, rng.choice([1, 2, 5])) for _ in range(rng.randint(0, 60))])
+                for _ in range(rng.randint(1, 5))
+            ]
+            min_period, max_period = rng.randint(1, 3), rng.randint(1, 13)
+            batch_sequences = find_periodic_sequences_batch(arrs, max_period=max_period, min_period=min_period)
+            for arr, sequences in zip(arrs, batch_sequences):
+                expected = list(find_periodic_sequences(arr, max_period=max_period, min_period=min_period))
+                self.assertEqual(sequences, expected)
+
+        with self.assertRaises(ValueError):
+            find_periodic_sequences_batch([np.array([1, -1, 1])], max_period=2)
+
+
+class TestCharRepetitions(TestCase):
+    REGEX = re.compile(r"(.+?)(\s?\1){3,}")
+
+    def _regex_repetitions(self, text: str) -> List[Tuple[int, int, int]]:
+        return [(m.start(), m.end(), m.group(0).count(m.group(1))) for m in self.REGEX.finditer(text)]
+
+    def _repetitions(self, text: str, max_period: int = 100, **kwargs) -> List[Tuple[int, int, int]]:
+        return [(r.start, r.end, r.times) for r in find_char_repetitions(text, max_period=max_period, **kwargs)]
+
+    def test_same_as_regex(self):
+        texts = [
+            "",
+            "aaaa",
+            "aaa",
+            "a a a a",
+            "blah blah blah blah blah",
+            "ab\nab\nab\nab\n",
+            "abababab abab",
+            "No reps at the beginning of this sentence but MMMMMMMMMM",
+            "Seeing doubles: bass banana bass banana bass banana bass banana",
+            "x  x  x  x",
+            "　a　a　a　a",
+        ]
+        for text in texts:
+            self.assertEqual(self._repetitions(text), self._regex_repetitions(text), repr(text))
+
+    def test_random_texts(self):
+        rng = random.Random(0)
+        for _ in range(1_000):
+            text = "".join(rng.choices("ab \n", k=rng.randint(0, 60)))
+            window_size = rng.choice([1, 7, 1_000])
+            self.assertEqual(
+                self._repetitions(text, window_size=window_size), self._regex_repetitions(text), repr(text)
+            )
+
+    def test_max_period(self):
+        text = "abcdefgh" * 4
+        self.assertEqual(self._repetitions(text, max_period=8), [(0, 32, 4)])
+        self.assertEqual(self._repetitions(text, max_period=7), [])
+
+    def test_long_line(self):
+        # the unbounded regex is quadratic on a long line; we compare with a regex that caps the unit length
+        rng = random.Random(0)
+        text = " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 10))) for _ in range(5_000))
+        expected = [
+            (m.start(), m.end(), m.group(0).count(m.group(1)))
+            for m in re.finditer(r"(.{1,256}?)(\s?\1){3,}", text)
+        ]
+        self.assertEqual(self._repetitions(text, max_period=256), expected)
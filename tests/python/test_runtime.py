@@ -8,11 +8,18 @@ from unittest import TestCase
 
 import smart_open
 
+from dolma.core.analyzer import create_and_run_analyzer
+from dolma.core.caps import CAPPED_ATTRIBUTE, TaggerCap
+from dolma.core.cascade import CASCADE_SKIPPED_ATTRIBUTE, CascadeStage, FilterSpec
+from dolma.core.errors import DolmaConfigError
 from dolma.core.runtime import (
+    DEFERRED_SUFFIX,
     _make_paths_from_prefix,
     _make_paths_from_substitution,
     create_and_run_tagger,
+    tag_stream,
 )
+from dolma.core.sampling import SampleSpec, is_sampled, read_sample_spec
 
 LOCAL_DATA = Path(__file__).parent.parent / "data"
 
@@ -109,6 +116,343 @@ class TestRuntimeUtilities(TestCase):
                     self.assertEqual(value[0][0], 0)
                     self.assertEqual(value[0][1], len(d["text"]))
 
+    def test_runtime_batch_size(self):
+        documents_path = f"{LOCAL_DATA}/provided/documents/000.json.gz"
+        taggers = ["c4_v1", "char_length_v1"]
+
+        outputs = []
+        for batch_size in (1, 7):
+            with TemporaryDirectory() as temp_dir:
+                create_and_run_tagger(
+                    documents=[documents_path],
+                    destination=temp_dir,
+                    taggers=taggers,
+                    experiment="test",
+                    debug=True,
+                    batch_size=batch_size,
+                )
+                with smart_open.open(os.path.join(temp_dir, "test", "000.json.gz"), "rt") as f:
+                    outputs.append([json.loads(ln) for ln in f])
+
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_runtime_cascade(self):
+        documents_path = f"{LOCAL_DATA}/provided/documents/000.json.gz"
+        with smart_open.open(documents_path, "rt") as f:
+            docs = [json.loads(ln) for ln in f]
+
+        # run c4_v1 only on documents with at least 1000 characters
+        cascade = [
+            CascadeStage(
+                taggers=["c4_v1"],
+                include=[],
+                exclude=[".attributes.test__char_length_v1__length[0][2] < 1000"],
+                syntax="jq",
+            )
+        ]
+
+        with TemporaryDirectory() as temp_dir:
+            create_and_run_tagger(
+                documents=[documents_path],
+                destination=temp_dir,
+                taggers=["char_length_v1", "c4_v1"],
+                experiment="test",
+                debug=True,
+            )
+            with smart_open.open(os.path.join(temp_dir, "test", "000.json.gz"), "rt") as f:
+                expected = [json.loads(ln) for ln in f]
+
+        for batch_size in (1, 7):
+            with TemporaryDirectory() as temp_dir:
+                create_and_run_tagger(
+                    documents=[documents_path],
+                    destination=temp_dir,
+                    taggers=["char_length_v1"],
+                    cascade=cascade,
+                    experiment="test",
+                    debug=True,
+                    batch_size=batch_size,
+                )
+                with smart_open.open(os.path.join(temp_dir, "test", "000.json.gz"), "rt") as f:
+                    outputs = [json.loads(ln) for ln in f]
+
+            self.assertEqual(len(outputs), len(docs))
+            skipped_cnt = 0
+            for doc, output, expected_output in zip(docs, outputs, expected):
+                if len(doc["text"]) >= 1000:
+                    self.assertEqual(output, expected_output)
+                else:
+                    skipped_cnt += 1
+                    c4_attributes = {
+                        k: v for k, v in output["attributes"].items() if k.startswith("test__c4_v1__")
+                    }
+                    self.assertEqual(
+                        c4_attributes, {f"test__c4_v1__{CASCADE_SKIPPED_ATTRIBUTE}": [[0, len(doc["text"]), 1.0]]}
+                    )
+            self.assertGreater(skipped_cnt, 0)
+            self.assertLess(skipped_cnt, len(docs))
+
+    def test_runtime_cascade_validation(self):
+        with self.assertRaises(DolmaConfigError):
+            create_and_run_tagger(
+                documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                taggers=["c4_v1"],
+                cascade=[CascadeStage(taggers=["c4_v1"], include=[".attributes"], exclude=[], syntax="jq")],
+            )
+
+        with self.assertRaises(DolmaConfigError):
+            create_and_run_tagger(
+                documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                taggers=["char_length_v1"],
+                cascade=[CascadeStage(taggers=["c4_v1"], include=[], exclude=[], syntax="jq")],
+            )
+
+    def _run_capped(self, caps: List[TaggerCap], **kwargs) -> List[dict]:
+        with TemporaryDirectory() as temp_dir:
+            create_and_run_tagger(
+                documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                destination=temp_dir,
+                taggers=["char_length_v1"],
+                caps=caps,
+                experiment="test",
+                debug=True,
+                **kwargs,
+            )
+            self.assertEqual(os.listdir(os.path.join(temp_dir, "test")), ["000.json.gz"])
+            with smart_open.open(os.path.join(temp_dir, "test", "000.json.gz"), "rt") as f:
+                return [json.loads(ln)["attributes"] for ln in f]
+
+    def test_runtime_caps(self):
+        with smart_open.open(f"{LOCAL_DATA}/provided/documents/000.json.gz", "rt") as f:
+            lengths = [len(json.loads(ln)["text"]) for ln in f]
+        self.assertTrue(any(n > 1000 for n in lengths) and any(n <= 1000 for n in lengths))
+
+        capped_key = f"test__char_length_v1__{CAPPED_ATTRIBUTE}"
+        for batch_size in (1, 7):
+            truncated = self._run_capped([TaggerCap(["char_length_v1"], max_chars=1000)], batch_size=batch_size)
+            sampled = self._run_capped(
+                [TaggerCap(["char_length_v1"], max_chars=1000, policy="sample")], batch_size=batch_size
+            )
+            deferred = self._run_capped(
+                [TaggerCap(["char_length_v1"], max_chars=1000, policy="defer")], batch_size=batch_size
+            )
+
+            for n, truncated_attrs, sampled_attrs, deferred_attrs in zip(lengths, truncated, sampled, deferred):
+                if n <= 1000:
+                    self.assertEqual(truncated_attrs["test__char_length_v1__length"], [[0, n, n]])
+                    self.assertEqual(truncated_attrs, sampled_attrs)
+                    self.assertEqual(truncated_attrs, deferred_attrs)
+                    self.assertNotIn(capped_key, truncated_attrs)
+                    continue
+
+                self.assertEqual(truncated_attrs["test__char_length_v1__length"], [[0, 1000, 1000]])
+                self.assertEqual(truncated_attrs[capped_key], [[0, n, 1000 / n]])
+
+                starts = [round(i * (n - 250) / 3) for i in range(4)]
+                self.assertEqual(
+                    sampled_attrs["test__char_length_v1__length"], [[s, s + 250, 250] for s in starts]
+                )
+                self.assertEqual(sampled_attrs[capped_key], [[0, n, 1000 / n]])
+
+                self.assertEqual(deferred_attrs["test__char_length_v1__length"], [[0, n, n]])
+                self.assertEqual(deferred_attrs[capped_key], [[0, n, 1.0]])
+
+    def test_runtime_caps_stale_deferred(self):
+        with TemporaryDirectory() as temp_dir:
+            # deferred documents another run left under the same destination are not tagged by this run
+            stale_path = os.path.join(temp_dir, "test", f"other.json.gz{DEFERRED_SUFFIX}")
+            os.makedirs(os.path.dirname(stale_path))
+            with smart_open.open(stale_path, "wt") as f:
+                f.write("not a deferred row\n")
+
+            create_and_run_tagger(
+                documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                destination=temp_dir,
+                taggers=["char_length_v1"],
+                caps=[TaggerCap(["char_length_v1"], max_chars=1000, policy="defer")],
+                experiment="test",
+                debug=True,
+            )
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(temp_dir, "test"))), ["000.json.gz", os.path.basename(stale_path)]
+            )
+
+    def test_runtime_caps_validation(self):
+        invalid_caps = [
+            TaggerCap(["char_length_v1"]),
+            TaggerCap(["char_length_v1"], max_chars=0),
+            TaggerCap(["char_length_v1"], max_chars=10, policy="drop"),
+            TaggerCap(["c4_v1"], max_chars=10),
+        ]
+        for cap in invalid_caps:
+            with self.assertRaises(DolmaConfigError):
+                create_and_run_tagger(
+                    documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                    taggers=["char_length_v1"],
+                    caps=[cap],
+                )
+
+        # taggers whose output feeds the filters of a cascade cannot be deferred
+        with self.assertRaises(DolmaConfigError):
+            create_and_run_tagger(
+                documents=[f"{LOCAL_DATA}/provided/documents/000.json.gz"],
+                taggers=["char_length_v1"],
+                cascade=[CascadeStage(taggers=["c4_v1"], include=[], exclude=[".attributes"], syntax="jq")],
+                caps=[TaggerCap(["char_length_v1"], max_chars=10, policy="defer")],
+            )
+
+    def test_runtime_sample_rate(self):
+        documents_path = f"{LOCAL_DATA}/provided/documents/000.json.gz"
+        with smart_open.open(documents_path, "rt") as f:
+            docs = [json.loads(ln) for ln in f]
+        sampled_ids = [doc["id"] for doc in docs if is_sampled(doc["id"], 0.5)]
+        self.assertTrue(0 < len(sampled_ids) < len(docs))
+
+        with TemporaryDirectory() as temp_dir:
+            create_and_run_tagger(
+                documents=[documents_path], destination=temp_dir, taggers=["char_length_v1"], debug=True
+            )
+            with smart_open.open(os.path.join(temp_dir, "char_length_v1", "000.json.gz"), "rt") as f:
+                expected = {row["id"]: row for row in map(json.loads, f)}
+
+        with TemporaryDirectory() as temp_dir:
+            create_and_run_tagger(
+                documents=[documents_path],
+                destination=temp_dir,
+                taggers=["char_length_v1"],
+                sample_rate=0.5,
+                debug=True,
+            )
+            attributes_path = os.path.join(temp_dir, "char_length_v1", "000.json.gz")
+            with smart_open.open(attributes_path, "rt") as f:
+                outputs = [json.loads(ln) for ln in f]
+            sample_spec = read_sample_spec(attributes_path)
+
+            self.assertEqual([row["id"] for row in outputs], sampled_ids)
+            self.assertEqual(outputs, [expected[doc_id] for doc_id in sampled_ids])
+            self.assertEqual(
+                sample_spec, SampleSpec(sample_rate=0.5, documents=len(docs), sampled=len(sampled_ids))
+            )
+
+            # statistics are extrapolated to all documents; the sidecar is not analyzed as an attributes file
+            report_dir = os.path.join(temp_dir, "report")
+            create_and_run_analyzer(
+                attributes=[os.path.join(temp_dir, "char_length_v1", "*")], report=report_dir, debug=True
+            )
+            with smart_open.open(os.path.join(report_dir, "summaries.jsonl.gz"), "rt") as f:
+                summaries = {summary["name"]: summary for summary in map(json.loads, f)}
+            score_summary = summaries["char_length_v1__char_length_v1__length/score"]
+            self.assertEqual(score_summary["total"], len(docs))
+            self.assertAlmostEqual(
+                score_summary["sum"],
+                sum(len(doc["text"]) for doc in docs if doc["id"] in sampled_ids) * len(docs) / len(sampled_ids),
+            )
+
+            # tagging all documents into the same destination removes the sidecar, so counts are not extrapolated
+            create_and_run_tagger(
+                documents=[documents_path],
+                destination=temp_dir,
+                taggers=["char_length_v1"],
+                ignore_existing=True,
+                debug=True,
+            )
+            self.assertIsNone(read_sample_spec(attributes_path))
+
+            report_dir = os.path.join(temp_dir, "report-full")
+            create_and_run_analyzer(
+                attributes=[os.path.join(temp_dir, "char_length_v1", "*")], report=report_dir, debug=True
+            )
+            with smart_open.open(os.path.join(report_dir, "summaries.jsonl.gz"), "rt") as f:
+                summaries = {summary["name"]: summary for summary in map(json.loads, f)}
+            score_summary = summaries["char_length_v1__char_length_v1__length/score"]
+            self.assertEqual(score_summary["total"], len(docs))
+            self.assertAlmostEqual(score_summary["sum"], sum(len(doc["text"]) for doc in docs))
+
+    def test_is_sampled(self):
+        ids = [f"doc-{i}" for i in range(10_000)]
+        sampled = [doc_id for doc_id in ids if is_sampled(doc_id, 0.1)]
+        self.assertAlmostEqual(len(sampled) / len(ids), 0.1, delta=0.01)
+        self.assertEqual(sampled, [doc_id for doc_id in ids if is_sampled(doc_id, 0.1)])
+        self.assertTrue(set(sampled) < set(doc_id for doc_id in ids if is_sampled(doc_id, 0.2)))
+        self.assertTrue(all(is_sampled(doc_id, 1.0) for doc_id in ids))
+
+    def test_runtime_output_filter(self):
+        documents_path = f"{LOCAL_DATA}/provided/documents/000.json.gz"
+        with smart_open.open(documents_path, "rt") as f:
+            lines = f.read().splitlines()
+        expected_lines = [ln for ln in lines if len(json.loads(ln)["text"]) >= 1000]
+        self.assertTrue(0 < len(expected_lines) < len(lines))
+
+        for experiment, attributes in ((None, False), ("test", True)):
+            exp_name = experiment or "char_length_v1"
+            with TemporaryDirectory() as temp_dir:
+                create_and_run_tagger(
+                    documents=[documents_path],
+                    taggers=["char_length_v1"],
+                    experiment=experiment,
+                    output_filter=FilterSpec(
+                        include=[],
+                        exclude=[f".attributes.{exp_name}__char_length_v1__length[0][2] < 1000"],
+                        syntax="jq",
+                    ),
+                    filtered_destination=temp_dir,
+                    filtered_attributes=attributes,
+                    debug=True,
+                )
+                with smart_open.open(os.path.join(temp_dir, "documents", "000.json.gz"), "rt") as f:
+                    self.assertEqual(f.read().splitlines(), expected_lines)
+
+                attributes_path = os.path.join(temp_dir, "attributes", exp_name, "000.json.gz")
+                self.assertEqual(os.path.exists(attributes_path), attributes)
+                if attributes:
+                    with smart_open.open(attributes_path, "rt") as f:
+                        rows = [json.loads(ln) for ln in f]
+                    self.assertEqual([row["id"] for row in rows], [json.loads(ln)["id"] for ln in expected_lines])
+                else:
+                    self.assertEqual(os.listdir(temp_dir), ["documents"])
+
+        with self.assertRaises(DolmaConfigError):
+            create_and_run_tagger(
+                documents=[documents_path],
+                taggers=["char_length_v1"],
+                output_filter=FilterSpec(include=[".attributes"], exclude=[], syntax="jq"),
+            )
+
+    def test_tag_stream(self):
+        documents_path = f"{LOCAL_DATA}/provided/documents/000.json.gz"
+        taggers = ["char_length_v1", "c4_v1"]
+        with smart_open.open(documents_path, "rt") as f:
+            docs = [json.loads(ln) for ln in f]
+
+        with TemporaryDirectory() as temp_dir:
+            create_and_run_tagger(
+                documents=[documents_path], destination=temp_dir, taggers=taggers, experiment="test", debug=True
+            )
+            with smart_open.open(os.path.join(temp_dir, "test", "000.json.gz"), "rt") as f:
+                expected = [(row["id"], row["attributes"]) for row in map(json.loads, f)]
+
+        for num_workers, batch_size, max_in_flight in ((0, 1, None), (2, 3, 1)):
+            results = tag_stream(
+                documents=iter(docs * 3),
+                taggers=taggers,
+                experiment="test",
+                num_workers=num_workers,
+                batch_size=batch_size,
+                max_in_flight=max_in_flight,
+            )
+            # round trip through json to turn tuples into lists
+            self.assertEqual(json.loads(json.dumps(list(results))), [list(e) for e in expected * 3])
+
+        with self.assertRaises(DolmaConfigError):
+            next(tag_stream(docs, taggers, caps=[TaggerCap(["c4_v1"], max_chars=10, policy="defer")]))
+
+        # unknown taggers are reported before starting workers, which would otherwise fail to start forever
+        with self.assertRaises(ValueError):
+            next(tag_stream(docs, ["c4_v1", "not_a_tagger"], num_workers=1))
+        with self.assertRaises(ValueError):
+            cascade = [CascadeStage(taggers=["not_a_tagger"], include=[".attributes"], exclude=[], syntax="jq")]
+            next(tag_stream(docs, ["c4_v1"], num_workers=1, cascade=cascade))
+
     def test_alt_src(self):
         taggers = ["c4_v1"]
         experiment_name = "test"
@@ -318,3 +662,27 @@ class TestRuntimeUtilities(TestCase):
                     for attr, doc in zip(attributes, documents):
                         # check if the id of the document and the attribute is the same
                         self.assertEqual(attr["id"], doc["id"])
+
+
+class TestTaggerCap(TestCase):
+    def test_exceeds(self):
+        cap = TaggerCap(["tagger"], max_chars=10, max_paragraphs=2)
+        self.assertFalse(cap.exceeds("a\nb\n"))
+        self.assertTrue(cap.exceeds("a\nb\nc"))
+        self.assertTrue(cap.exceeds("a" * 11))
+        self.assertIsNone(cap.windows("a" * 10))
+
+    def test_windows(self):
+        text = "".join(f"paragraph {i:02d}\n" for i in range(20))
+
+        truncate = TaggerCap(["tagger"], max_paragraphs=3)
+        self.assertEqual(truncate.windows(text), [(0, 39)])
+
+        sample = TaggerCap(["tagger"], max_paragraphs=4, policy="sample", num_windows=2)
+        self.assertEqual(sample.windows(text), [(0, 26), (234, 260)])
+
+        sample_chars = TaggerCap(["tagger"], max_chars=20, policy="sample", num_windows=2)
+        self.assertEqual(sample_chars.windows(text), [(0, 10), (250, 260)])
+
+        sample_both = TaggerCap(["tagger"], max_chars=20, max_paragraphs=4, policy="sample", num_windows=2)
+        self.assertEqual(sample_both.windows(text), [(0, 10), (234, 244)])
@@ -1,8 +1,10 @@
 import csv
 import json
+import os
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import patch
 
 import numpy
 import smart_open
@@ -10,7 +12,15 @@ from tokenizers import Tokenizer as BaseTokenizer
 from typing_extensions import TypedDict
 
 from dolma.cli.__main__ import main
-from dolma.tokenizer import Tokenizer, tokenize_in_parallel
+from dolma.tokenizer import (
+    MemmapDataset,
+    Tokenizer,
+    TokenizerOutput,
+    shuffle,
+    tokenize_file,
+    tokenize_in_parallel,
+)
+from dolma.tokenizer.memmap_writer import MemmapWriter, PackedMemmapWriter
 
 TEST_DIR = Path(__file__).parent.parent.resolve()
 
@@ -117,6 +127,257 @@ class TestTokenizer(TestCase):
         self.assertEqual(no_split_tokens, split_tokens)
         self.assertEqual(split_tokens, TEXT_NEWLINE_START["gpt_neo"])
 
+    def test_tokenize_file_batches(self):
+        texts = [TEXT_WITH_NO_NEWLINES["text"], "  ", TEXT_WITH_NEW_LINES["text"], TEXT_NEWLINE_START["text"]] * 3
+        with NamedTemporaryFile(mode="wt", suffix=".jsonl") as f:
+            for i, text in enumerate(texts):
+                f.write(json.dumps({"id": str(i), "text": text, "source": "test"}) + "\n")
+            f.flush()
+
+            for segment in (False, True):
+                tokenizer = Tokenizer.from_file(**LLAMA_TOKENIZER, segment_before_tokenization=segment)
+                kwargs = {**LLAMA_TOKENIZER, "segment_before_tokenization": segment}
+                name = kwargs.pop("filename")
+
+                # batches of any size give the same outputs, in the same order, as encoding one document at a time
+                expected = [(str(i), i + 1, tokenizer.encode(t.strip())) for i, t in enumerate(texts) if t.strip()]
+                for batch_size in (1, 4, 5, 100):
+                    outputs = list(tokenize_file(name, f.name, batch_size=batch_size, **kwargs))
+                    self.assertEqual([(o.id, o.loc, list(o.tokens)) for o in outputs], expected)
+
+                outputs = list(tokenize_file(name, f.name, refresh_tokenizer_every=3, batch_size=2, **kwargs))
+                self.assertEqual([(o.id, o.loc, list(o.tokens)) for o in outputs], expected)
+
+
+class TestMemmapWriter(TestCase):
+    def test_write_many(self):
+        outputs = [
+            TokenizerOutput.from_tokens(id=f"doc,{i}", src="src.json.gz", loc=i, tokens=list(range(i, 2 * i + 1)))
+            for i in range(10)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            # write one document at a time as a reference
+            with MemmapWriter(path=f"{tmpdir}/one", dtype=numpy.dtype("uint16"), max_tokens=40) as writer:
+                written = 0
+                while written < len(outputs) and writer.write(outputs[written]):
+                    written += 1
+
+            with MemmapWriter(path=f"{tmpdir}/many", dtype=numpy.dtype("uint16"), max_tokens=40) as writer:
+                self.assertEqual(writer.write_many(outputs[:2]), [])
+                remaining = writer.write_many(outputs[2:])
+                self.assertEqual(remaining, outputs[written:])
+                self.assertEqual(writer.write_many(remaining), remaining)
+
+            with smart_open.open(f"{tmpdir}/one.csv.gz") as f, smart_open.open(f"{tmpdir}/many.csv.gz") as g:
+                self.assertEqual(list(csv.reader(f)), list(csv.reader(g)))
+            self.assertEqual(
+                numpy.fromfile(f"{tmpdir}/one.npy", dtype=numpy.uint16).tolist(),
+                numpy.fromfile(f"{tmpdir}/many.npy", dtype=numpy.uint16).tolist(),
+            )
+            self.assertEqual(
+                numpy.fromfile(f"{tmpdir}/many.npy", dtype=numpy.uint16).tolist(),
+                [t for output in outputs[:written] for t in output.tokens],
+            )
+
+    def test_grow_and_truncate(self):
+        with TemporaryDirectory() as tmpdir:
+            writer = MemmapWriter(path=f"{tmpdir}/grow", dtype=numpy.dtype("uint32"), max_tokens=1000)
+            writer.GROWTH_CHUNK_TOKENS = 8
+            expected = []
+            with writer:
+                for i in range(30):
+                    tokens = list(range(i, i + i % 5 + 1))
+                    self.assertTrue(
+                        writer.write(TokenizerOutput.from_tokens(id=str(i), src="", loc=i, tokens=tokens))
+                    )
+                    expected.extend(tokens)
+                    # the file grows in chunks, and is never preallocated to `max_tokens`
+                    self.assertLess(Path(f"{tmpdir}/grow.npy").stat().st_size, 4 * (len(expected) * 2 + 8))
+
+            # on close, the file is truncated to the tokens written
+            self.assertEqual(Path(f"{tmpdir}/grow.npy").stat().st_size, 4 * len(expected))
+            self.assertEqual(numpy.fromfile(f"{tmpdir}/grow.npy", dtype=numpy.uint32).tolist(), expected)
+
+    def test_packed(self):
+        lengths = [5, 30, 12, 3, 16, 1, 9, 40, 7, 15, 2, 11]
+        outputs = [
+            TokenizerOutput.from_tokens(id=str(i), src="src", loc=i, tokens=list(range(100 * i, 100 * i + n)))
+            for i, n in enumerate(lengths)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            for policy in ("best_fit", "concat"):
+                path = f"{tmpdir}/{policy}"
+                with PackedMemmapWriter(
+                    path=path, dtype=numpy.dtype("uint16"), sequence_length=16, pad_token_id=0, policy=policy
+                ) as writer:
+                    self.assertEqual(writer.write_many(outputs[:5]), [])
+                    self.assertEqual(writer.write_many(outputs[5:]), [])
+
+                sequences = numpy.fromfile(f"{path}.npy", dtype=numpy.uint16).reshape(-1, 16)
+                boundaries = numpy.load(f"{path}.boundaries.npy")
+                with smart_open.open(f"{path}.csv.gz") as f:
+                    rows = list(csv.reader(f))
+
+                # boundaries are sorted, and pieces of documents are in the order of metadata rows
+                self.assertEqual(boundaries.tolist(), sorted(boundaries.tolist()))
+                pieces = {}
+                for sequence, start, end, row in sorted(boundaries.tolist(), key=lambda b: b[3]):
+                    self.assertEqual(int(rows[row][0]), sequence * 16 + start)
+                    pieces.setdefault(rows[row][2], []).extend(sequences[sequence, start:end].tolist())
+                self.assertEqual(pieces, {output.id: output.tokens for output in outputs})
+
+                if policy == "concat":
+                    # no padding except at the end
+                    self.assertEqual(len(sequences), -(-sum(lengths) // 16))
+                else:
+                    # documents that fit in a sequence are not split
+                    num_pieces = {doc_id: sum(1 for r in rows if r[2] == doc_id) for doc_id in pieces}
+                    for output in outputs:
+                        self.assertEqual(num_pieces[output.id], -(-len(output.tokens) // 16))
+
+        with self.assertRaises(ValueError):
+            PackedMemmapWriter(
+                path="x", dtype=numpy.dtype("uint16"), sequence_length=16, pad_token_id=0, policy="x"
+            )
+
+    def test_packed_full(self):
+        outputs = [TokenizerOutput.from_tokens(id=str(i), src="", loc=i, tokens=[1] * 10) for i in range(10)]
+        with TemporaryDirectory() as tmpdir:
+            # room for 3 sequences of 16 tokens; with best fit, each holds one document
+            with PackedMemmapWriter(
+                path=f"{tmpdir}/full",
+                dtype=numpy.dtype("uint16"),
+                sequence_length=16,
+                pad_token_id=0,
+                max_tokens=50,
+            ) as writer:
+                self.assertEqual(writer.write_many(outputs), outputs[3:])
+                self.assertFalse(writer.write(outputs[3]))
+            self.assertEqual(Path(f"{tmpdir}/full.npy").stat().st_size, 2 * 48)
+
+
+class TestMemmapDataset(TestCase):
+    def test_dataset(self):
+        tokenizer = Tokenizer.from_file(**LLAMA_TOKENIZER)
+        texts = {f"doc-{i}": f"Document number {i}." + " Again." * (i % 7) for i in range(40)}
+        with TemporaryDirectory() as tmpdir:
+            outputs = [
+                TokenizerOutput.from_tokens(id=doc_id, src="src", loc=i, tokens=tokenizer.encode(text))
+                for i, (doc_id, text) in enumerate(texts.items())
+            ]
+            for i in range(2):
+                with MemmapWriter(path=f"{tmpdir}/part-{i}-00000", dtype=tokenizer.dtype) as writer:
+                    writer.write_many(outputs[i * 20 : (i + 1) * 20])
+
+            for _ in range(2):
+                # the second time, the index is read from the cache
+                dataset = MemmapDataset(tmpdir, tokenizer=tokenizer, cache_dir=f"{tmpdir}/cache")
+                self.assertEqual(len(dataset), 40)
+                self.assertEqual(len(list(Path(f"{tmpdir}/cache").iterdir())), 2)
+
+                self.assertEqual([t.tolist() for t in dataset], [o.tokens for o in outputs])
+                self.assertEqual(dataset.get(25).tolist(), outputs[25].tokens)
+                self.assertEqual(dataset[-1].tolist(), outputs[-1].tokens)
+                self.assertEqual(dataset.decode(dataset.find("doc-33")), texts["doc-33"])
+                self.assertIsNone(dataset.find("missing"))
+
+                indices = [39, 0, 21, 5, 21]
+                tokens, offsets = dataset.gather(indices)
+                for i, index in enumerate(indices):
+                    self.assertEqual(tokens[offsets[i] : offsets[i + 1]].tolist(), outputs[index].tokens)
+
+            with self.assertRaises(IndexError):
+                dataset.get(40)
+
+    def test_reshard(self):
+        outputs = [
+            TokenizerOutput.from_tokens(id=f"doc-{i}", src="src", loc=i, tokens=list(range(i, i + 1 + i % 13)))
+            for i in range(60)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            # outputs of two runs of `dolma tokens`
+            for run in range(2):
+                for part in range(2):
+                    with MemmapWriter(path=f"{tmpdir}/run-{run}/part-{part}-00000", dtype=numpy.uint16) as writer:
+                        writer.write_many(outputs[run * 30 + part * 15 : run * 30 + (part + 1) * 15])
+
+            for shuffle_docs in (False, True):
+                config = {
+                    "sources": [f"{tmpdir}/run-0", f"{tmpdir}/run-1/*.npy"],
+                    "destination": f"{tmpdir}/resharded-{shuffle_docs}",
+                    "max_size": 100,
+                    "shuffle": shuffle_docs,
+                    "debug": True,
+                }
+                with NamedTemporaryFile(mode="wt") as f:
+                    json.dump(config, f)
+                    f.flush()
+                    main(argv=["-c", f.name, "tokens-reshard"])
+
+                dataset = MemmapDataset(config["destination"], cache_dir=f"{tmpdir}/cache")
+                self.assertGreater(len(dataset.readers), 4)
+                for reader in dataset.readers:
+                    self.assertLess(len(reader.tokens), 100)
+
+                resharded = [tokens.tolist() for tokens in dataset]
+                if shuffle_docs:
+                    self.assertNotEqual(resharded, [output.tokens for output in outputs])
+                    self.assertEqual(sorted(resharded), sorted(output.tokens for output in outputs))
+                else:
+                    self.assertEqual(resharded, [output.tokens for output in outputs])
+                for output in outputs:
+                    self.assertEqual(dataset.get(dataset.find(output.id)).tolist(), output.tokens)
+
+    def test_reshard_same_work_dir(self):
+        outputs = [
+            TokenizerOutput.from_tokens(id=f"doc-{i}", src="src", loc=i, tokens=list(range(i, i + 1 + i % 13)))
+            for i in range(60)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            with MemmapWriter(path=f"{tmpdir}/source/part-0-00000", dtype=numpy.uint16) as writer:
+                writer.write_many(outputs)
+
+            for max_size in (50, 200):
+                config = {
+                    "sources": [f"{tmpdir}/source"],
+                    "destination": f"{tmpdir}/resharded-{max_size}",
+                    "max_size": max_size,
+                    "debug": True,
+                    "work_dir": {"input": f"{tmpdir}/work/input", "output": f"{tmpdir}/work/output"},
+                }
+                with NamedTemporaryFile(mode="wt") as f:
+                    json.dump(config, f)
+                    f.flush()
+                    main(argv=["-c", f.name, "tokens-reshard"])
+
+                dataset = MemmapDataset(config["destination"], cache_dir=f"{tmpdir}/cache-{max_size}")
+                self.assertEqual([tokens.tolist() for tokens in dataset], [output.tokens for output in outputs])
+
+    def test_reshard_same_scratch_dir(self):
+        outputs = [
+            TokenizerOutput.from_tokens(id=f"doc-{i}", src="src", loc=i, tokens=list(range(i, i + 1 + i % 13)))
+            for i in range(60)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            with MemmapWriter(path=f"{tmpdir}/source/part-0-00000", dtype=numpy.uint16) as writer:
+                writer.write_many(outputs)
+
+            # the second run makes fewer shards than the first, and more plans than files it may open at once
+            for run, max_tokens in enumerate((50, 200)):
+                with patch.object(shuffle, "MAX_OPEN_PLANS", 2):
+                    shuffle.reshard_memmaps(
+                        memmap_paths=[f"{tmpdir}/source/part-0-00000.npy"],
+                        destination=f"{tmpdir}/resharded-{run}",
+                        scratch_dir=f"{tmpdir}/scratch",
+                        metadata_dir=f"{tmpdir}/metadata-{run}",
+                        max_tokens=max_tokens,
+                        dtype="uint16",
+                        debug=True,
+                    )
+                dataset = MemmapDataset(f"{tmpdir}/resharded-{run}", cache_dir=f"{tmpdir}/cache-{run}")
+                self.assertEqual(sorted(tokens.tolist() for tokens in dataset), sorted(o.tokens for o in outputs))
+                self.assertEqual(len(os.listdir(f"{tmpdir}/scratch/plans")), len(dataset.readers))
+
 
 class TestTokenizerCli(TestCase):
     def test_llama_segment_e2e(self, segment: bool = True, fast: bool = True, refresh: int = 0):
@@ -387,6 +648,174 @@ class TestShufflingTokenizer(TestCase):
             # verify that there has bee shuffling
             self.assertNotEqual(list(all_tokens), sorted(all_tokens))
 
+    def test_global_shuffle(self):
+        tokenizer = Tokenizer.from_file(**LLAMA_TOKENIZER)
+        with TemporaryDirectory() as tmpdir:
+            (source := Path(tmpdir) / "src").mkdir(parents=True, exist_ok=True)
+            destination = Path(tmpdir) / "dst"
+
+            texts = {}
+            for i in range(4):
+                with smart_open.open(source / f"{i}.jsonl.gz", "wt") as f:
+                    for j in range(16):
+                        texts[f"{i}-{j}"] = f"Document {j} of file {i}." + " More text." * j
+                        f.write(json.dumps({"text": texts[f"{i}-{j}"], "id": f"{i}-{j}"}) + "\n")
+
+            tokenize_in_parallel(
+                sources=[f"{source}/*.gz"],
+                destination=str(destination),
+                tokenizer_name_or_path=LLAMA_TOKENIZER["filename"],
+                bos_token_id=LLAMA_TOKENIZER["bos_token_id"],
+                eos_token_id=LLAMA_TOKENIZER["eos_token_id"],
+                max_size=256,
+                debug=True,
+                global_shuffle=True,
+                shuffle_dir=f"{tmpdir}/scratch",
+                metadata_dir=f"{tmpdir}/metadata",
+            )
+
+            ids = []
+            for metadata_path in sorted(destination.glob("part-*.csv.gz")):
+                memmap = numpy.fromfile(str(metadata_path).replace(".csv.gz", ".npy"), dtype=numpy.uint16)
+                with smart_open.open(metadata_path) as f:
+                    rows = list(csv.reader(f))
+                # every output file is within size, and has the tokens of its documents
+                self.assertLess(len(memmap), 256)
+                self.assertEqual(int(rows[-1][1]), len(memmap))
+                for start, end, doc_id, *_ in rows:
+                    self.assertEqual(memmap[int(start) : int(end)].tolist(), tokenizer.encode(texts[doc_id]))
+                ids.extend(row[2] for row in rows)
+
+            self.assertGreater(len(list(destination.glob("part-*.npy"))), 1)
+            self.assertEqual(sorted(ids), sorted(texts))
+
+            # documents of the same file are spread across output files
+            first_file = [doc_id.split("-")[0] for doc_id in ids[: len(ids) // 4]]
+            self.assertEqual(len(set(first_file)), 4)
+
+    def test_incremental(self):
+        tokenizer = Tokenizer.from_file(**LLAMA_TOKENIZER)
+        with TemporaryDirectory() as tmpdir:
+            (source := Path(tmpdir) / "src").mkdir(parents=True, exist_ok=True)
+            cache = Path(tmpdir) / "cache"
+
+            texts = {}
+
+            def add_file(i: int):
+                with smart_open.open(source / f"{i}.jsonl.gz", "wt") as f:
+                    for j in range(8):
+                        texts[f"{i}-{j}"] = f"Document {j} of file {i}." + " More text." * j
+                        f.write(json.dumps({"text": texts[f"{i}-{j}"], "id": f"{i}-{j}"}) + "\n")
+
+            # all runs write to the same destination; shards of earlier runs must not be left next to new ones
+            destination = Path(tmpdir) / "destination"
+
+            def run(run_id: str, max_size: int = 256, **kwargs):
+                tokenize_in_parallel(
+                    sources=[f"{source}/*.gz"],
+                    destination=str(destination),
+                    tokenizer_name_or_path=LLAMA_TOKENIZER["filename"],
+                    bos_token_id=LLAMA_TOKENIZER["bos_token_id"],
+                    eos_token_id=LLAMA_TOKENIZER["eos_token_id"],
+                    max_size=max_size,
+                    debug=True,
+                    cache_dir=str(cache),
+                    metadata_dir=f"{tmpdir}/metadata-{run_id}",
+                    **kwargs,
+                )
+                dataset = MemmapDataset(str(destination), cache_dir=f"{tmpdir}/index-{run_id}")
+                for doc_id, text in texts.items():
+                    self.assertEqual(dataset.get(dataset.find(doc_id)).tolist(), tokenizer.encode(text))
+                self.assertEqual(len(dataset), len(texts))
+                return {path.name: path.stat().st_mtime_ns for path in cache.glob("*.npy")}
+
+            for i in range(2):
+                add_file(i)
+            first = run("first")
+            self.assertEqual(len(first), 2)
+
+            # only the new file is tokenized; cached files are reused as they are
+            add_file(2)
+            second = run("second")
+            self.assertEqual(len(second), 3)
+            self.assertEqual({k: v for k, v in second.items() if k in first}, first)
+
+            # changing a file or the tokenizer configuration invalidates the cache
+            add_file(0)
+            self.assertEqual(len(run("third")), 4)
+            self.assertEqual(len(run("fourth", encode_special_tokens=True)), 7)
+
+            # fewer, larger shards than the runs before
+            self.assertEqual(len(run("fifth", max_size=4096, encode_special_tokens=True)), 7)
+            self.assertEqual(len(list(destination.glob("*.npy"))), 1)
+
+    def test_recycle(self):
+        tokenizer = Tokenizer.from_file(**LLAMA_TOKENIZER)
+        with TemporaryDirectory() as tmpdir:
+            (source := Path(tmpdir) / "src").mkdir(parents=True, exist_ok=True)
+            destination = Path(tmpdir) / "dst"
+
+            texts = {}
+            for i in range(5):
+                with smart_open.open(source / f"{i}.jsonl.gz", "wt") as f:
+                    for j in range(20):
+                        texts[f"{i}-{j}"] = f"Document {j} of file {i}." + " More text." * (j % 4)
+                        f.write(json.dumps({"text": texts[f"{i}-{j}"], "id": f"{i}-{j}"}) + "\n")
+
+            # two files at a time, and a window of 6 documents: the writer hands off files in the middle
+            tokenize_in_parallel(
+                sources=[f"{source}/*.gz"],
+                destination=str(destination),
+                tokenizer_name_or_path=LLAMA_TOKENIZER["filename"],
+                bos_token_id=LLAMA_TOKENIZER["bos_token_id"],
+                eos_token_id=LLAMA_TOKENIZER["eos_token_id"],
+                ring_size=2,
+                local_shuffle=6,
+                encode_batch_size=4,
+                recycle_after_documents=15,
+                debug=True,
+                metadata_dir=f"{tmpdir}/metadata",
+            )
+
+            # each process writes to its own memmap, numbered in sequence
+            memmaps = sorted(p.name for p in destination.glob("*.npy"))
+            self.assertEqual(memmaps, [f"part-0-{i:05d}.npy" for i in range(len(memmaps))])
+            self.assertGreaterEqual(len(memmaps), 100 // 18)
+
+            dataset = MemmapDataset(str(destination), cache_dir=f"{tmpdir}/index")
+            self.assertEqual(len(dataset), len(texts))
+            for doc_id, text in texts.items():
+                self.assertEqual(dataset.get(dataset.find(doc_id)).tolist(), tokenizer.encode(text))
+
+    def test_dedupe(self):
+        with TemporaryDirectory() as tmpdir:
+            (source := Path(tmpdir) / "src").mkdir(parents=True, exist_ok=True)
+
+            # files 0 and 1 have the same texts with different ids; file 2 has new texts, and one more copy
+            for i in range(3):
+                with smart_open.open(source / f"{i}.jsonl.gz", "wt") as f:
+                    for j in range(8):
+                        text = f"Document {j + 8 * (i // 2)}." + " More text." * j
+                        f.write(json.dumps({"text": f"  {text}" if i == 1 else text, "id": f"{i}-{j}"}) + "\n")
+                    f.write(json.dumps({"text": "Document 0.", "id": f"{i}-copy"}) + "\n")
+
+            for dedupe, expected in (("drop", 16), ("count", 27)):
+                destination = Path(tmpdir) / dedupe
+                tokenize_in_parallel(
+                    sources=[f"{source}/*.gz"],
+                    destination=str(destination),
+                    tokenizer_name_or_path=LLAMA_TOKENIZER["filename"],
+                    bos_token_id=LLAMA_TOKENIZER["bos_token_id"],
+                    eos_token_id=LLAMA_TOKENIZER["eos_token_id"],
+                    debug=True,
+                    dedupe=dedupe,
+                    dedupe_dir=f"{tmpdir}/scratch",
+                    metadata_dir=f"{tmpdir}/metadata-{dedupe}",
+                )
+                dataset = MemmapDataset(str(destination), cache_dir=f"{tmpdir}/cache")
+                self.assertEqual(len(dataset), expected)
+                self.assertEqual(len({tuple(tokens.tolist()) for tokens in dataset}), 16)
+
 
 class TestTokenizeSpecialTokens(TestCase):
     def test_tokenize_special_tokens(self):
@@ -1,11 +1,14 @@
 import tempfile
 from contextlib import ExitStack
 from pathlib import Path
-from unittest import TestCase
+from unittest import TestCase, mock
 
+import numpy as np
+
+from dolma.core.blocklist import BlocklistIndex, make_index_key
 from dolma.core.data_types import DocumentWithMetadata
 from dolma.core.url_blocker import UrlBlocker
-from dolma.taggers.url import BaseDomainTagger, BaseUrlTagger
+from dolma.taggers.url import AdbUrlTagger, BaseDomainTagger, BaseUrlTagger
 
 LOCAL_DATA = Path(__file__).parent.parent / "data"
 
@@ -43,6 +46,40 @@ class TestUrlBlocker(TestCase):
         self.assertTrue(engine.check_network_urls("pjatr.com", None, "image"))
         self.assertFalse(engine.check_network_urls("pjatr.com", None, "document"))
 
+    def test_check_many(self):
+        engine = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz", cache=False)
+        urls = ["berush.com", "example.com", "http://berush.com"]
+        self.assertEqual(engine.check_many(urls), [engine.check_network_urls(url) for url in urls])
+        self.assertEqual(engine.check_many(["pjatr.com"], request_type="image"), [True])
+        self.assertEqual(engine.check_many([]), [])
+
+        with self.assertRaises(ValueError):
+            engine.check_many(urls, source_urls=["example.com"])
+
+    def test_serialize(self):
+        engine = UrlBlocker.from_adb_paths(LOCAL_DATA / "urls/easylist.txt.gz", cache=False)
+        engine = UrlBlocker.from_serialized(engine.serialize())
+        self.assertTrue(engine.check_network_urls("berush.com"))
+        self.assertFalse(engine.check_network_urls("example.com"))
+
+    def test_adb_tagger_batch(self):
+        class TestAdbTagger(AdbUrlTagger):
+            BLOCKLIST_PATHS = [str(LOCAL_DATA / "urls/easylist.txt.gz")]
+
+        tagger = TestAdbTagger()
+        docs = [
+            DocumentWithMetadata(source=__file__, version="0", id=str(i), text="text", metadata={"url": url})
+            for i, url in enumerate(["berush.com", "example.com", "", "http://berush.com/page"])
+        ]
+        expected = [bool(tagger.predict(doc).spans) for doc in docs]
+        self.assertEqual(expected, [True, False, False, True])
+
+        # all urls of a batch are checked with a single call to the engine
+        tagger.engine = mock.Mock(wraps=tagger.engine)
+        self.assertEqual([bool(result.spans) for result in tagger.predict_batch(docs)], expected)
+        self.assertEqual(tagger.engine.check_many.call_count, 1)
+        self.assertEqual(tagger.predict_batch([]), [])
+
 
 class TestUrlMatcher(TestCase):
     links_tagger: BaseUrlTagger
@@ -125,3 +162,45 @@ class TestUrlMatcher(TestCase):
 
         doc = self.make_doc("http://example.com/foo")
         self.assertTrue(self.domains_tagger.predict(doc).spans)
+
+
+class TestBlocklistIndex(TestCase):
+    def test_index_lookup(self):
+        index = BlocklistIndex.from_entries(["example.com", "example2.com", "example.com"])
+        self.assertEqual(len(index), 2)
+        self.assertIn("example.com", index)
+        self.assertIn("example2.com", index)
+        self.assertNotIn("example3.com", index)
+        self.assertNotIn("", index)
+
+    def test_index_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            calls = []
+
+            def entries_fn():
+                calls.append(1)
+                return ["example.com", "example2.com"]
+
+            index = BlocklistIndex.get_or_build(key="test", entries_fn=entries_fn, cache_dir=temp_dir)
+            self.assertIn("example.com", index)
+            self.assertEqual(len(calls), 1)
+
+            # second time around, the index is memory-mapped from disk and entries are not parsed again
+            index = BlocklistIndex.get_or_build(key="test", entries_fn=entries_fn, cache_dir=temp_dir)
+            self.assertIn("example2.com", index)
+            self.assertNotIn("example3.com", index)
+            self.assertEqual(len(calls), 1)
+            self.assertIsInstance(index.hashes, np.memmap)
+
+    def test_index_key(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f"{temp_dir}/domains.txt"
+            with open(path, "w") as f:
+                f.write("example.com\n")
+            key = make_index_key(name="tagger", paths=[path])
+            self.assertEqual(key, make_index_key(name="tagger", paths=[path]))
+            self.assertNotEqual(key, make_index_key(name="other_tagger", paths=[path]))
+
+            with open(path, "a") as f:
+                f.write("example2.com\n")
+            self.assertNotEqual(key, make_index_key(name="tagger", paths=[path]))